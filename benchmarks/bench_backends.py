@@ -0,0 +1,73 @@
+"""
+Speed of the Polars backend of the enrichment stages against the pandas stages.
+
+Each backend runs on its own read of the same input files, since the stages
+change the Base frame in place; the SAP Notes cache is cleared before each
+run so that both parse every note. The two outputs are
+written as CSV and must be byte for byte identical. Polars runs the joins
+over its thread pool (its size is printed; set POLARS_MAX_THREADS to change
+it), the pandas stages on one core.
+
+    python benchmarks/bench_backends.py --sizes 10k 100k
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from bench_pipeline import output_digest  # noqa: E402
+from datagen import DATA_DIR, dataset, parse_size  # noqa: E402
+
+from commissions.instrumentation import RunReport  # noqa: E402
+from commissions.note_cache import NOTES_CACHE  # noqa: E402
+from commissions.pipeline import BACKENDS, PipelineOptions, load_inputs, run_pipeline, write_output  # noqa: E402
+from commissions.polars_backend import have_polars  # noqa: E402
+from commissions.reporting import NullReporter  # noqa: E402
+
+
+def run(inputs, backend, output):
+    """Stage time of one backend, its output written to ``output``."""
+    NOTES_CACHE.clear()
+    options = PipelineOptions(backend=backend)
+    start = time.perf_counter()
+    base_df = run_pipeline(inputs, NullReporter(), options, RunReport())
+    elapsed = time.perf_counter() - start
+    write_output(base_df, output)
+    return elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', nargs='+', default=['10k'], help="Base rows, e.g. 10k 100k 1M")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=DATA_DIR,
+                        help="Where generated datasets are kept (default: %(default)s)")
+    args = parser.parse_args(argv)
+    if not have_polars():
+        parser.error("the polars backend needs polars (pip install polars)")
+    import polars as pl
+
+    print(f"polars {pl.__version__}, {pl.thread_pool_size()} threads")
+    identical = True
+    for size in args.sizes:
+        rows = parse_size(size)
+        paths = dataset(rows, args.data_dir, args.seed)
+        directory = os.path.dirname(paths['base'])
+        times, digests = {}, {}
+        for backend in BACKENDS:
+            output = os.path.join(directory, f"processed-{backend}.csv")
+            times[backend] = run(load_inputs(paths), backend, output)
+            digests[backend] = output_digest(output)['sha256']
+        same = digests['pandas'] == digests['polars']
+        identical &= same
+        print(f"\n== {rows} rows ==")
+        print(f"pandas:     {times['pandas']:.2f}s")
+        print(f"polars:     {times['polars']:.2f}s  ({times['pandas'] / times['polars']:.2f}x)")
+        print(f"identical:  {same}")
+    return 0 if identical else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""
+Batch runs over several periods, in one process and over a process pool.
+
+The Base of a dataset is split by sales order into ``--periods`` monthly
+files, and every note is rewritten to name a doctor in the spelling of its
+period ('DR. GARCIA LOPEZ' in one, 'Dr Garcia L.' or 'García López' in
+another), so that the variants of a name are spread over periods handled by
+different workers. run_batch runs once with one worker and once with
+``--workers``, each from a copy of the same doctor dictionary; the period
+outputs and the saved dictionaries must be identical, and DOCTOR must be
+what a single run over the whole Base gives.
+
+    python benchmarks/bench_batch.py --rows 100000 --periods 6 --workers 3
+"""
+import argparse
+import dataclasses
+import filecmp
+import os
+import shutil
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from datagen import DATA_DIR, dataset  # noqa: E402
+
+from commissions.batch import run_batch  # noqa: E402
+from commissions.doctors import DoctorDictionary  # noqa: E402
+from commissions.instrumentation import RunReport  # noqa: E402
+from commissions.note_cache import NOTES_CACHE  # noqa: E402
+from commissions.pipeline import PipelineOptions, load_inputs, run_pipeline  # noqa: E402
+from commissions.reporting import NullReporter  # noqa: E402
+
+# Spellings of the same doctors, one per period in turn
+VARIANTS = [
+    ["DR. GARCIA LOPEZ", "Dra. Ana Ruiz Gil", "MARTINEZ"],
+    ["Dr Garcia L.", "RUIZ GIL", "Dr. Martínez"],
+    ["García López", "Ana Ruiz", "martinez"],
+    ["GARCIA", "Dra. A. Ruiz Gil", "DR MARTINEZ"],
+]
+
+# Doctor dictionary every run starts from
+KNOWN_DOCTORS = ["GARCÍA LÓPEZ", "ANA RUIZ GIL"]
+
+
+def split_periods(paths, periods, directory):
+    """Base files of ``periods`` months and the SAP Notes naming each period's spellings."""
+    os.makedirs(directory, exist_ok=True)
+    base_df = pd.read_csv(paths['base'], dtype=str, keep_default_na=False)
+    orders = pd.Series(base_df['IDOrder'].unique())
+    period = pd.Series(orders.index % periods, index=orders.to_numpy())
+    base_paths = {}
+    for number in range(periods):
+        name = f"2024-{number + 1:02d}"
+        base_paths[name] = os.path.join(directory, f"base_{name.replace('-', '_')}.csv")
+        base_df[base_df['IDOrder'].map(period).to_numpy() == number].to_csv(base_paths[name], index=False)
+    notes = [f"NHC: {position} DR. {VARIANTS[period[order] % len(VARIANTS)][position % 3]} "
+             f"FECHA: 01/02/2024" for position, order in enumerate(orders)]
+    notes_path = os.path.join(directory, 'notes.csv')
+    pd.DataFrame({'Sales Order': orders, 'Note Text': notes}).to_csv(notes_path, index=False)
+    return base_paths, notes_path
+
+
+def options_from(seed_path, path):
+    """Options with a fresh copy at ``path`` of the dictionary in ``seed_path``."""
+    shutil.copyfile(seed_path, path)
+    NOTES_CACHE.clear()
+    return PipelineOptions(doctors=DoctorDictionary.load(path))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=20000, help="Base rows over all periods")
+    parser.add_argument('--periods', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--data-dir', default=DATA_DIR,
+                        help="Where generated datasets are kept (default: %(default)s)")
+    args = parser.parse_args(argv)
+    paths = dataset(args.rows, args.data_dir)
+    directory = os.path.join(os.path.dirname(paths['base']), 'batch')
+    base_paths, notes_path = split_periods(paths, args.periods, directory)
+    seed_path = os.path.join(directory, 'doctors-seed.csv')
+    pd.DataFrame({'canonical': KNOWN_DOCTORS, 'alias': KNOWN_DOCTORS}).to_csv(seed_path, index=False)
+    inputs = load_inputs(dict({name: path for name, path in paths.items() if name != 'base'},
+                              sap_notes=notes_path))
+
+    times, outputs, dictionaries = {}, {}, {}
+    for workers in (1, args.workers):
+        outputs[workers] = os.path.join(directory, f"out-{workers}")
+        dictionaries[workers] = os.path.join(directory, f"doctors-{workers}.csv")
+        shutil.rmtree(outputs[workers], ignore_errors=True)
+        options = options_from(seed_path, dictionaries[workers])
+        start = time.perf_counter()
+        run_batch(inputs, base_paths, outputs[workers], NullReporter(), options, RunReport(), workers=workers)
+        times[workers] = time.perf_counter() - start
+
+    whole = pd.concat([pd.read_csv(path, dtype=str, keep_default_na=False) for path in base_paths.values()],
+                      ignore_index=True)
+    options = options_from(seed_path, os.path.join(directory, 'doctors-whole.csv'))
+    expected = run_pipeline(dataclasses.replace(inputs, base=whole), NullReporter(), options,
+                            RunReport())['DOCTOR']
+
+    same_outputs = all(filecmp.cmp(os.path.join(outputs[1], f"{period}.csv"),
+                                   os.path.join(outputs[args.workers], f"{period}.csv"), shallow=False)
+                       for period in base_paths)
+    same_dictionaries = filecmp.cmp(dictionaries[1], dictionaries[args.workers], shallow=False)
+    found = pd.concat([pd.read_csv(os.path.join(outputs[args.workers], f"{period}.csv"), dtype=str,
+                                   keep_default_na=False)['DOCTOR'] for period in base_paths],
+                      ignore_index=True)
+    same_doctors = found.tolist() == expected.astype(str).tolist()
+
+    print(f"\n{args.rows} rows in {args.periods} periods, {found.nunique()} doctors")
+    print(f"1 worker:          {times[1]:.2f}s")
+    print(f"{args.workers} workers:         {times[args.workers]:.2f}s")
+    print(f"same outputs:      {same_outputs}")
+    print(f"same dictionaries: {same_dictionaries}")
+    print(f"same as one run:   {same_doctors}")
+    return 0 if same_outputs and same_dictionaries and same_doctors else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
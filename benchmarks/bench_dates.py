@@ -0,0 +1,90 @@
+"""
+Speed of the tiered date parser against dateparser on every value.
+
+Every value is generated from a known date, and parse_dates must read it
+back as that date. Day-first values, including the ones followed by a time
+or by text that only dateparser reads, must also give what the original
+whole-note parsing gave: dateparser on the note, then again on the
+dd/mm/yyyy text (its month-first reading swapped day and month twice). The
+run exits with status 1 on any difference.
+
+    python benchmarks/bench_dates.py --rows 20000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date
+
+import dateparser
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from commissions.dates import DATE_FORMAT, DATEPARSER_LANGUAGES, parse_dates  # noqa: E402
+
+# Layouts of the generated dates; the day-first ones are also compared with the original parsing
+DAY_FIRST_LAYOUTS = ["{d:02d}/{m:02d}/{y}", "{d}-{m}-{yy}", "{d:02d}.{m:02d}.{y}", "{d:02d}/{m:02d}/{y} 10:30",
+                     "{d:02d}.{m:02d}.{y} 08:15", "{d:02d}/{m:02d}/{y} texto"]
+LAYOUTS = DAY_FIRST_LAYOUTS + ["{y}-{m:02d}-{d:02d}", "{y}-{m:02d}-{d:02d} 10:30", "{d} de {month} de {y}"]
+
+MONTHS = ["enero", "febrero", "marzo", "abril", "mayo", "junio", "julio", "agosto", "septiembre",
+          "octubre", "noviembre", "diciembre"]
+
+
+def make_dates(rows, seed=0):
+    """(values, expected dd/mm/yyyy or None, whether the layout is day first)."""
+    rng = random.Random(seed)
+    values, expected, day_first = [], [], []
+    for _ in range(rows):
+        y, m, d = rng.choice([2023, 2024, 2025]), rng.randint(1, 12), rng.randint(1, 28)
+        layout = rng.choice(LAYOUTS)
+        values.append(layout.format(d=d, m=m, y=y, yy=y % 100, month=MONTHS[m - 1]))
+        # dateparser reads no date out of a date followed by a word
+        expected.append(None if 'texto' in layout else f"{d:02d}/{m:02d}/{y}")
+        day_first.append(layout in DAY_FIRST_LAYOUTS)
+    return pd.Series(values), pd.Series(expected, dtype=object), pd.Series(day_first)
+
+
+def original_date(text):
+    """The whole-note date of the original script: dateparser, then dateparser on its dd/mm/yyyy."""
+    first = dateparser.parse(text, languages=DATEPARSER_LANGUAGES)
+    if first is None:
+        return None
+    second = dateparser.parse(first.strftime(DATE_FORMAT), languages=DATEPARSER_LANGUAGES)
+    if second is None or second.date() > date.today():
+        return None
+    return second.strftime(DATE_FORMAT)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=5000)
+    args = parser.parse_args(argv)
+    values, expected, day_first = make_dates(args.rows)
+
+    start = time.perf_counter()
+    original = values.map(original_date)
+    dateparser_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = parse_dates(values)
+    tiered_time = time.perf_counter() - start
+
+    print(f"rows:       {args.rows}")
+    print(f"dateparser: {dateparser_time:.2f}s")
+    print(f"tiered:     {tiered_time:.2f}s  ({dateparser_time / tiered_time:.1f}x)")
+    found = result.dates.astype(object)
+    wrong = ~((found == expected) | (found.isna() & expected.isna()))
+    changed = day_first & ~((found == original) | (found.isna() & original.isna()))
+    print(f"tiers:      {result.stats.summary()}")
+    print(f"wrong:      {int(wrong.sum())}")
+    print(f"changed:    {int(changed.sum())} day-first values differ from the original parsing")
+    for value in values[wrong | changed].unique()[:5]:
+        print(f"  {value!r}: {found[values == value].iloc[0]} (original {original[values == value].iloc[0]})")
+    return 1 if (wrong | changed).any() else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
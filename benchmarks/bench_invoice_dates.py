@@ -0,0 +1,79 @@
+"""
+Speed of parsing the Invoice Date once against the per-row fallback and second parse.
+
+The former code ran a scalar pd.to_datetime for every row without an
+intervention date, then parsed the whole column again to format it in
+finalize_output. Both results are compared with the single parse.
+
+    python benchmarks/bench_invoice_dates.py --rows 200000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from commissions.dates import DATE_FORMAT, parse_invoice_dates  # noqa: E402
+
+
+def make_invoice_dates(rows, seed=0):
+    """ISO invoice dates, as the Base exports have them, with a few blanks."""
+    rng = np.random.default_rng(seed)
+    dates = pd.to_datetime('2024-01-01') + pd.to_timedelta(rng.integers(0, 700, rows), unit='D')
+    dates = pd.Series(dates.strftime('%Y-%m-%d'), dtype=object)
+    dates[rng.random(rows) < 0.03] = None
+    return dates
+
+
+def _format_invoice_date(value):
+    value = pd.to_datetime(value, errors='coerce')
+    if pd.notnull(value):
+        return value.strftime("%d/%m/%Y")
+    return None
+
+
+def with_scalar_parse(dates, fallback):
+    """The former fallback and finalize formatting, kept as the reference output."""
+    fecha = dates[fallback].map(_format_invoice_date)
+    invoice = pd.to_datetime(dates, errors='coerce').dt.strftime("%d/%m/%Y")
+    return fecha, invoice
+
+
+def with_single_parse(dates, fallback):
+    parsed = parse_invoice_dates(dates)
+    formatted = parsed.dt.strftime(DATE_FORMAT)
+    return formatted[fallback], formatted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--fallback', type=float, default=0.4,
+                        help="Share of rows without an intervention date in their note")
+    args = parser.parse_args(argv)
+    dates = make_invoice_dates(args.rows)
+    fallback = pd.Series(np.random.default_rng(1).random(args.rows) < args.fallback, index=dates.index)
+
+    start = time.perf_counter()
+    expected_fecha, expected_invoice = with_scalar_parse(dates, fallback)
+    scalar_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fecha, invoice = with_single_parse(dates, fallback)
+    single_time = time.perf_counter() - start
+
+    identical = (fecha.astype(object).fillna('').equals(expected_fecha.astype(object).fillna(''))
+                 and invoice.astype(object).fillna('').equals(expected_invoice.astype(object).fillna('')))
+    print(f"rows:       {args.rows} ({fallback.sum()} falling back)")
+    print(f"scalar:     {scalar_time:.2f}s")
+    print(f"single:     {single_time:.2f}s  ({scalar_time / single_time:.1f}x)")
+    print(f"identical:  {identical}")
+    return 0 if identical else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
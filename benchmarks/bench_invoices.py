@@ -0,0 +1,68 @@
+"""
+Speed of the FACTURAS COMISIONADAS aggregation against groupby().apply.
+
+    python benchmarks/bench_invoices.py --invoices 200000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from commissions.stages import aggregate_commissioned_invoices  # noqa: E402
+
+NAMES = ['ANA GARCIA', 'LUIS PEREZ', 'MARTA RUIZ', 'JORGE SANZ', None]
+
+
+def make_invoices(invoices, seed=0):
+    """Commission history with 1-4 payments per invoice and a few gaps."""
+    rng = random.Random(seed)
+    rows = []
+    for number in rng.sample(range(10**8, 10**9), invoices):
+        for _ in range(rng.randint(1, 4)):
+            period = rng.choice([f"{rng.randint(2019, 2025)}-{rng.randint(1, 12):02d}", None])
+            rows.append((str(number), rng.choice(NAMES), period))
+    return pd.DataFrame(rows, columns=['IDBillDoc', 'CurrentCorrected_Name', 'PERIODO COMISION'], dtype=str)
+
+
+def aggregate_with_apply(invoices_df):
+    """The former per-group implementation, kept as the reference output."""
+    invoices_df = invoices_df.assign(
+        doc_nr_formatted=invoices_df['IDBillDoc'].astype(str).str.zfill(10))
+    return invoices_df.groupby('doc_nr_formatted').apply(
+        lambda df: "LA FACTURA {} FUE COMISIONADA ".format(df['IDBillDoc'].iloc[0]) +
+        " & ".join([f"A {name} EN {period}"
+                    for name, period in zip(df['CurrentCorrected_Name'], df['PERIODO COMISION'])])
+    ).to_dict()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--invoices', type=int, default=50000)
+    args = parser.parse_args(argv)
+    invoices_df = make_invoices(args.invoices)
+
+    start = time.perf_counter()
+    expected = aggregate_with_apply(invoices_df)
+    apply_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    agg = aggregate_commissioned_invoices(invoices_df)
+    agg_time = time.perf_counter() - start
+
+    identical = agg['PAGADAS'].to_dict() == expected
+    print(f"rows:       {len(invoices_df)} ({len(agg)} invoices)")
+    print(f"apply:      {apply_time:.2f}s")
+    print(f"agg:        {agg_time:.2f}s  ({apply_time / agg_time:.1f}x)")
+    print(f"payments:   {np.bincount(agg['PAYMENTS'])[1:].tolist()} invoices with 1, 2, ... payments")
+    print(f"identical:  {identical}")
+    return 0 if identical else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+Speed of the MasterDataES stage on a line-level file against a plain merge.
+
+A MasterDataES file of ``--master-rows`` lines is generated for the Base of
+a dataset: most (IDBillDoc, IDBillDocItem) pairs of the Base with their
+item numbers zero padded the way SAP exports them, some repeated lines and
+lines of other invoices. The stage (composite KeyIndex, then the lookup) is
+timed against the merge the prototype script did, after zero padding both
+sides so that it can match at all; the IDCurrentCorrected they give must be
+identical.
+
+    python benchmarks/bench_master_data_es.py --rows 1000000 --master-rows 3000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from datagen import DATA_DIR, dataset  # noqa: E402
+
+from commissions.joins import doc_number_key  # noqa: E402
+from commissions.pipeline import load_inputs  # noqa: E402
+from commissions.reporting import ConsoleReporter  # noqa: E402
+from commissions.stages import MASTER_DATA_KEYS, index_master_data, match_master_data  # noqa: E402
+
+
+def master_data(base_df, rows, seed=0):
+    """A MasterDataES frame of about ``rows`` lines for ``base_df``."""
+    rng = np.random.default_rng(seed)
+    pairs = base_df[MASTER_DATA_KEYS].drop_duplicates()
+    pairs = pairs[rng.random(len(pairs)) < 0.9]
+    extra = max(0, rows - len(pairs))
+    other = pd.DataFrame({
+        'IDBillDoc': rng.integers(10**9, 2 * 10**9, extra).astype(str),
+        'IDBillDocItem': (rng.integers(1, 50, extra) * 10).astype(str),
+    })
+    lines = pd.concat([pairs, other], ignore_index=True)
+    lines = pd.concat([lines, lines.sample(frac=0.01, random_state=seed)], ignore_index=True)
+    return pd.DataFrame({
+        'IDBillDoc': lines['IDBillDoc'].to_numpy(),
+        'IDBillDocItem': lines['IDBillDocItem'].str.zfill(6).to_numpy(),
+        'IDCurrentCorrected': rng.integers(10**5, 10**6, len(lines)).astype(str),
+        'CurrentCorrected_Name': 'REP',
+    }).astype(str)
+
+
+def merged(base_df, master_df):
+    """IDCurrentCorrected by pd.merge on zero padded keys, the last line of a repeated pair."""
+    left = pd.DataFrame({key: doc_number_key(base_df[key].to_numpy()).to_numpy() for key in MASTER_DATA_KEYS})
+    right = pd.DataFrame({key: doc_number_key(master_df[key].to_numpy()).to_numpy() for key in MASTER_DATA_KEYS})
+    right['IDCurrentCorrected'] = master_df['IDCurrentCorrected'].to_numpy()
+    right = right.drop_duplicates(MASTER_DATA_KEYS, keep='last')
+    return left.merge(right, on=MASTER_DATA_KEYS, how='left')['IDCurrentCorrected'].astype(object)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=100000, help="Base rows")
+    parser.add_argument('--master-rows', type=int, default=1000000, help="MasterDataES lines")
+    parser.add_argument('--data-dir', default=DATA_DIR,
+                        help="Where generated datasets are kept (default: %(default)s)")
+    args = parser.parse_args(argv)
+    base_df = load_inputs({'base': dataset(args.rows, args.data_dir)['base']}).base
+    master_df = master_data(base_df, args.master_rows)
+    reporter = ConsoleReporter()
+
+    start = time.perf_counter()
+    expected = merged(base_df, master_df)
+    merge_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    master_index = index_master_data(master_df, reporter)
+    index_time = time.perf_counter() - start
+    start = time.perf_counter()
+    found = match_master_data(base_df.copy(), master_index, reporter)['IDCurrentCorrected']
+    lookup_time = time.perf_counter() - start
+
+    identical = expected.equals(found.reset_index(drop=True).astype(object))
+    print(f"\nBase rows {len(base_df)}, MasterDataES lines {len(master_df)}")
+    print(f"merge:           {merge_time:.2f}s")
+    print(f"index:           {index_time:.2f}s")
+    print(f"lookup:          {lookup_time:.2f}s  ({merge_time / (index_time + lookup_time):.1f}x with the index)")
+    print(f"identical:       {identical}")
+    return 0 if identical else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+Speed of reading the reference tables from the master data store against parsing the files.
+
+The SAMES, PO, FACTURAS and FOCUS files of a generated dataset are loaded
+into a fresh store once; then a run's reference tables are taken from the
+files (read_file, no Feather cache) and from the store (the rows of the
+keys the Base looks up). Both sets go through the pipeline, whose outputs
+must be identical. With --excel the reference files are read as the .xlsx
+workbooks they usually are, written from the generated CSVs first.
+
+    python benchmarks/bench_masterdata.py --rows 100000 --excel
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import pandas as pd  # noqa: E402
+from datagen import DATA_DIR, dataset  # noqa: E402
+
+from commissions.masterdata import TABLES, MasterDataStore  # noqa: E402
+from commissions.pipeline import PipelineInputs, load_inputs, run_pipeline  # noqa: E402
+from commissions.reporting import NullReporter  # noqa: E402
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--data-dir', default=DATA_DIR,
+                        help="Where generated datasets are kept (default: %(default)s)")
+    parser.add_argument('--excel', action='store_true', help="Read the reference files as .xlsx")
+    args = parser.parse_args(argv)
+    paths = dataset(args.rows, args.data_dir)
+    # Generated datasets have no MasterDataES file
+    tables = [name for name in TABLES if name in paths]
+    others = {name: path for name, path in paths.items() if name not in TABLES}
+    inputs = load_inputs(others)
+
+    with tempfile.TemporaryDirectory() as directory:
+        references = {name: paths[name] for name in tables}
+        if args.excel:
+            for name, path in references.items():
+                references[name] = os.path.join(directory, f"{name}.xlsx")
+                pd.read_csv(path, dtype=str).to_excel(references[name], index=False)
+
+        store = MasterDataStore(os.path.join(directory, 'master.sqlite'))
+        start = time.perf_counter()
+        store.refresh(load_inputs(references), NullReporter())
+        load_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        from_files = load_inputs(references)
+        files_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        from_store = store.inputs(inputs, inputs.base)
+        store_time = time.perf_counter() - start
+
+    expected = run_pipeline(PipelineInputs(**dict(inputs.items(), **{name: getattr(from_files, name)
+                                                                     for name in tables})), NullReporter())
+    found = run_pipeline(from_store, NullReporter())
+    identical = expected.astype(object).equals(found.astype(object))
+    rows = {name: len(getattr(from_files, name)) for name in tables}
+    selected = {name: len(getattr(from_store, name)) for name in tables}
+    print(f"reference rows:  {rows}")
+    print(f"rows selected:   {selected}")
+    print(f"first load:      {load_time:.2f}s (reading the files included)")
+    print(f"files:           {files_time:.2f}s")
+    print(f"store:           {store_time:.2f}s  ({files_time / store_time:.1f}x)")
+    print(f"identical:       {identical}")
+    return 0 if identical else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""
+Speed of the vectorized NHC fallback from the SO PO Number against the row-by-row loop.
+
+Rows whose note gives no NHC and rows with no SAP note at all both fall
+back to the SO PO Number; the output of extract_notes is checked against
+the former loop separately for each of those two groups.
+
+    python benchmarks/bench_nhc_fallback.py --rows 200000
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from datagen import generate  # noqa: E402
+
+from commissions.note_cache import parse_notes  # noqa: E402
+from commissions.notes import NHC_FROM_SO_PO_PATTERN  # noqa: E402
+from commissions.reporting import NullReporter  # noqa: E402
+from commissions.stages import extract_notes, match_po_data, nhc_from_so_po  # noqa: E402
+
+
+def _nhc_from_so_po(so_po):
+    """The former per-row fallback, kept as the reference output."""
+    if pd.isna(so_po):
+        return 'NHC NO INFORMADO'
+    match = re.search(NHC_FROM_SO_PO_PATTERN, str(so_po))
+    if match:
+        return match.group(1) or match.group(2)
+    return 'NHC NO INFORMADO'
+
+
+def nhc_with_loop(note_nhc, so_po):
+    nhc = note_nhc.copy()
+    no_nhc = nhc.isna()
+    nhc[no_nhc] = so_po[no_nhc].map(_nhc_from_so_po)
+    return nhc
+
+
+def nhc_vectorized(note_nhc, so_po):
+    return note_nhc.combine_first(nhc_from_so_po(so_po[note_nhc.isna()]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=50000)
+    args = parser.parse_args(argv)
+    inputs = generate(args.rows)
+    reporter = NullReporter()
+    base_df = match_po_data(inputs['base'], inputs['po'], reporter)
+    base_df = extract_notes(base_df, inputs['sap_notes'], reporter)
+
+    # NHC found in the notes alone, before any fallback
+    fields, _ = parse_notes(base_df['SAPNotes'], cache=None)
+    note_nhc = pd.Series(None, index=base_df.index, dtype=object)
+    note_nhc[fields.index] = fields['NHC']
+    so_po = base_df['SO PO Number']
+
+    start = time.perf_counter()
+    expected = nhc_with_loop(note_nhc, so_po)
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorized = nhc_vectorized(note_nhc, so_po)
+    vectorized_time = time.perf_counter() - start
+
+    has_note = base_df['SAPNotes'].notna()
+    fallback = note_nhc.isna()
+    identical = True
+    for group, rows in [("note without NHC", has_note & fallback), ("no note", ~has_note)]:
+        same = base_df.loc[rows, 'NHC'].astype(object).equals(expected[rows])
+        print(f"{group + ':':18}{rows.sum()} rows, identical: {same}")
+        identical &= same
+    identical &= base_df['NHC'].astype(object).equals(expected) and vectorized.astype(object).equals(expected)
+
+    print(f"rows:             {len(base_df)} ({fallback.sum()} falling back)")
+    print(f"loop:             {loop_time:.3f}s")
+    print(f"vectorized:       {vectorized_time:.3f}s  ({loop_time / vectorized_time:.1f}x)")
+    print(f"identical:        {identical}")
+    return 0 if identical else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
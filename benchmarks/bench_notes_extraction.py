@@ -0,0 +1,256 @@
+"""
+Speed comparison of the per-row SAP Notes loop against the columnar
+extraction in commissions.notes and the memoized commissions.note_cache.
+
+The loop is extract_sap_notes_info of the original Streamlit script, copied
+below, so the output of the rewritten extraction is checked against the
+code it replaced. NHC and DOCTOR must be identical. F. Int - Textos may only
+differ where user-004 meant it to: dates with mixed separators such as
+'19.02/2024', which the original read as arbitrary dates (often today's
+day and month) and the tiered parser reads day first. ISO and written dates
+and 2-digit years 31-68, the other changes of user-004, are not generated.
+The run exits with status 1 on any other difference.
+
+    python benchmarks/bench_notes_extraction.py --rows 20000 --lines-per-note 8
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+from datetime import datetime
+
+import dateparser
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from commissions.note_cache import NoteCache, parse_notes  # noqa: E402
+from commissions.notes import extract_sap_notes_columns  # noqa: E402
+
+SAMPLE_NOTES = [
+    "NHC: {nhc} DR. {doctor} F.I. {fecha}",
+    "N. MEDICO: ** {doctor} ** NHC: ** {nhc} ** F.INTERVENCIÓN: [[ {fecha} ]]",
+    "NHC {nhc} DOCTOR: {doctor} FECHA: {fecha}",
+    "N.H.C. {nhc} MEDICO: {doctor} INTERVENIDO EL {fecha}",
+    "HISTORIA NUM. {nhc} DR {doctor}",
+    "NHC: ___ DR. ___ FECHA INT.: [[ {fecha} ]]",
+    "NH: {nhc} F.INT: {fecha} DR. -",
+    "PACIENTE {doctor}",
+    "{fecha}",
+]
+DOCTORS = ["GARCIA LOPEZ", "Juan Perez", "MARTINEZ", "Ana Ruiz Gil"]
+
+OUTPUT_COLUMNS = ["NHC", "F. Int - Textos", "DOCTOR"]
+
+
+def make_notes(rows, lines_per_note=1, seed=0):
+    """Random notes; each note text is repeated on about ``lines_per_note`` rows."""
+    rng = random.Random(seed)
+    notes = []
+    for _ in range(max(1, rows // lines_per_note)):
+        fecha = "{:02d}{}{:02d}{}{}".format(rng.randint(1, 28), rng.choice("/.-"), rng.randint(1, 12),
+                                           rng.choice("/."), rng.choice(["2024", "2025", "24"]))
+        notes.append(rng.choice(SAMPLE_NOTES).format(
+            nhc=rng.randint(1000, 999999), doctor=rng.choice(DOCTORS), fecha=fecha))
+    return pd.Series([rng.choice(notes) for _ in range(rows)])
+
+
+# extract_sap_notes_info and normalize_date_format of the original Streamlit
+# script, kept as the reference the rewritten extraction is checked against.
+# Only its prints and st.success calls are left out.
+
+def original_normalize_date_format(date_string):
+    if not date_string:
+        return None
+    cleaned_date = re.sub(r'[_\s]+', '', date_string.strip())
+    cleaned_date = re.sub(r'[^\d\-/]', '', cleaned_date)
+    if not cleaned_date or not cleaned_date.strip():
+        return None
+    try:
+        parsed_date = dateparser.parse(cleaned_date, languages=['es', 'en'])
+        if parsed_date:
+            if parsed_date.date() > datetime.now().date():
+                return None
+            return parsed_date.strftime("%d/%m/%Y")
+    except Exception:
+        pass
+    date_patterns = [
+        r'^(\d{1,2})[/-](\d{1,2})[/-](\d{4})$',
+        r'^(\d{1,2})[/-](\d{1,2})[/-](\d{2})$',
+        r'^(\d{4})[/-](\d{1,2})[/-](\d{1,2})$',
+    ]
+    for pattern in date_patterns:
+        try:
+            match = re.match(pattern, cleaned_date)
+            if match is None:
+                continue
+            part1, part2, part3 = match.groups()
+            if len(part3) == 4:
+                if len(part1) == 4:
+                    year, month, day = part1, part2, part3
+                else:
+                    day, month, year = part1, part2, part3
+            else:
+                day, month, year_short = part1, part2, part3
+                year = f"20{year_short}" if int(year_short) <= 30 else f"19{year_short}"
+            day_int, month_int, year_int = int(day), int(month), int(year)
+            if not (1 <= month_int <= 12 and 1 <= day_int <= 31 and 1900 <= year_int <= 2100):
+                continue
+            return datetime(year_int, month_int, day_int).strftime("%d/%m/%Y")
+        except Exception:
+            continue
+    return None
+
+
+def original_extract_sap_notes_info(note):
+    if pd.isna(note):
+        return None, None, None
+    note = str(note)
+
+    nhc_patterns = [
+        r'NHC:?\s*\*\*\s*([^*]+)\s*\*\*',
+        r'NHC:?\s*\*\s*([^*]+)\s*\*',
+        r'NHC:?\s+(\d+)',
+        r'NHC:?\s*(?:NUMERO|NÚMERO|N[º°]|NUM)?\.?\s*:?\s*(\d+)',
+        r'NHC:?\s*(?:NUM|NUMERO|NÚMERO|N[º°])?\s*\.?\s*(\w+)',
+        r'N\.?\s*H\.?\s*C\.?:?\s+(\d+)',
+        r'NH:?\s+(\d+)',
+        r'HISTORIA:?\s*(?:NUM|NUMERO|NÚMERO|N[º°])?\s*\.?\s*(\d+)'
+    ]
+    nhc = None
+    for pattern in nhc_patterns:
+        nhc_match = re.search(pattern, note, re.IGNORECASE)
+        if nhc_match:
+            nhc = nhc_match.group(1).strip()
+            nhc = None if nhc.count('_') > 1 else nhc.replace('_', '')
+            break
+
+    doctor_patterns = [
+        r'N\.?\s*MEDICO:?\s*ºº\s*([^º]+)\s*ºº',
+        r'N\.?\s*MEDICO:?\s*\*\*\s*([^*]+)\s*\*\*',
+        r'DOCTOR:?\s*(?:\/|:)?\s*([A-Za-zÀ-ÿ\s.,]+?)(?:\s+\w+:)',
+        r'DR\.?\s*(?:\/|:)?\s*([A-Za-zÀ-ÿ\s.,]+?)(?:\s+\w+:)',
+        r'DR\.?\s*(?:\/|:)?\s*([A-Za-zÀ-ÿ\s.,]+?)$',
+        r'MEDICO:?\s*(?:\/|:)?\s*([A-Za-zÀ-ÿ\s.,]+?)(?:\s+\w+:)'
+    ]
+    doctor = None
+    for pattern in doctor_patterns:
+        doctor_match = re.search(pattern, note, re.IGNORECASE)
+        if doctor_match:
+            doctor = doctor_match.group(1).strip()
+            break
+
+    try:
+        parsed_date = dateparser.parse(note, languages=['es', 'en'])
+        if parsed_date:
+            return nhc, original_normalize_date_format(parsed_date.strftime("%d/%m/%Y")), doctor
+    except Exception:
+        pass
+
+    fecha_patterns = [
+        r'F\.?\s*INTERVENCI[ÓO]N:?\s*\[\[\s*([\d./\s]+)\s*\]\]',
+        r'FECHA\s*INT\.?:?\s*\[\[\s*([\d./\s]+)\s*\]\]',
+        r'FECHA\s*INT\.?\s*\[\[\s*([\d./\s]+)\s*\]\]',
+        r'F\.?\s*I\.?\s*[:.]?\s*([\d]{1,2}[./][\d]{1,2}[./][\d]{2,4})',
+        r'FECHA:?\s*([\d]{1,2}[./][\d]{1,2}[./][\d]{2,4})',
+        r'F\.?\s*INTERVENCI[ÓO]N:?\s*([\d]{1,2}[./][\d]{1,2}[./][\d]{2,4})',
+        r'F\.?\s*INT\.?:?\s*([\d]{1,2}[./][\d]{1,2}[./][\d]{2,4})',
+        r'FECHA\s*(?:DE)?\s*(?:LA)?\s*INTERVENCI[ÓO]N:?\s*([\d]{1,2}[./][\d]{1,2}[./][\d]{2,4})',
+        r'INTERVENIDO:?\s*(?:EL|EN)?\s*([\d]{1,2}[./][\d]{1,2}[./][\d]{2,4})',
+    ]
+    fecha_raw = None
+    for pattern in fecha_patterns:
+        fecha_match = re.search(pattern, note, re.IGNORECASE)
+        if fecha_match:
+            fecha_raw = fecha_match.group(1).strip()
+            break
+    if not fecha_raw:
+        return nhc, None, doctor
+
+    try:
+        parsed_date = dateparser.parse(fecha_raw, languages=['es', 'en'])
+        if parsed_date:
+            return nhc, original_normalize_date_format(parsed_date.strftime("%d/%m/%Y")), doctor
+    except Exception:
+        pass
+
+    date_regex_patterns = [
+        r'(\d{1,2})[/-](\d{1,2})[/-](\d{4})',
+        r'(\d{1,2})[/-](\d{1,2})[/-](\d{2})',
+        r'(\d{4})[/-](\d{1,2})[/-](\d{1,2})',
+    ]
+    for regex_pattern in date_regex_patterns:
+        date_match = re.search(regex_pattern, fecha_raw)
+        if date_match:
+            try:
+                part1, part2, part3 = date_match.groups()
+                if len(part3) == 4:
+                    if len(part1) == 4:
+                        year, month, day = part1, part2, part3
+                    else:
+                        day, month, year = part1, part2, part3
+                else:
+                    day, month, year_short = part1, part2, part3
+                    year = f"20{year_short}" if int(year_short) <= 30 else f"19{year_short}"
+                day, month, year = int(day), int(month), int(year)
+                if 1 <= month <= 12 and 1 <= day <= 31 and 1900 <= year <= 2100:
+                    fecha_int = datetime(year, month, day).strftime("%d/%m/%Y")
+                    return nhc, original_normalize_date_format(fecha_int), doctor
+            except (ValueError, IndexError, TypeError):
+                continue
+    return nhc, None, doctor
+
+
+def run_loop(notes):
+    rows = [original_extract_sap_notes_info(note) for note in notes]
+    return pd.DataFrame(rows, index=notes.index, columns=OUTPUT_COLUMNS)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--lines-per-note', type=int, default=1,
+                        help="Average number of Base rows sharing one note text")
+    args = parser.parse_args(argv)
+
+    notes = make_notes(args.rows, args.lines_per_note)
+
+    start = time.perf_counter()
+    expected = run_loop(notes)
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = extract_sap_notes_columns(notes)
+    columnar_time = time.perf_counter() - start
+
+    cache = NoteCache()
+    start = time.perf_counter()
+    memoized, stats = parse_notes(notes, cache)
+    memoized_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parse_notes(notes, cache)
+    warm_time = time.perf_counter() - start
+
+    expected = expected.astype(object).where(expected.notna(), None)
+    result = result[OUTPUT_COLUMNS]
+    differs = ~((expected == result) | (expected.isna() & result.isna()))
+    separators = notes.str.extract(r'\d{1,2}([/.-])\d{1,2}([/.])\d{2,4}')
+    mixed = separators[0].notna() & (separators[0] != separators[1])
+    unexplained = differs.any(axis=1) & ~(mixed & ~differs[["NHC", "DOCTOR"]].any(axis=1))
+    identical = not unexplained.any() and result.equals(memoized[OUTPUT_COLUMNS])
+    print(f"rows:      {args.rows} ({stats.distinct} distinct notes)")
+    print(f"loop:      {loop_time:.2f}s")
+    print(f"columnar:  {columnar_time:.2f}s  ({loop_time / columnar_time:.1f}x)")
+    print(f"memoized:  {memoized_time:.2f}s  ({loop_time / memoized_time:.1f}x)")
+    print(f"warm:      {warm_time:.2f}s  ({loop_time / warm_time:.1f}x, cache hit rate {cache.hit_rate:.0%})")
+    print(f"differences: {int(differs.any(axis=1).sum())} rows, {int(unexplained.sum())} not from "
+          f"mixed date separators")
+    print(f"matches original: {identical}")
+    return 0 if identical else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,50 @@
+"""
+Speed of the SAP Notes parsing as the process pool grows.
+
+    python benchmarks/bench_notes_parallel.py --rows 200000 --workers 1 2 4 8 16
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from bench_notes_extraction import make_notes  # noqa: E402
+
+from commissions import note_cache  # noqa: E402
+from commissions.note_cache import parse_notes  # noqa: E402
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--lines-per-note', type=int, default=1,
+                        help="Average number of Base rows sharing one note text")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--min-notes', type=int, default=note_cache.PARALLEL_MIN_NOTES,
+                        help="Serial below this many distinct notes (default: %(default)s)")
+    args = parser.parse_args(argv)
+    note_cache.PARALLEL_MIN_NOTES = args.min_notes
+
+    notes = make_notes(args.rows, args.lines_per_note)
+    print(f"rows:      {args.rows}, {os.cpu_count()} CPUs")
+
+    expected = serial_time = None
+    identical = True
+    for workers in args.workers:
+        start = time.perf_counter()
+        result, stats = parse_notes(notes, cache=None, workers=workers)
+        elapsed = time.perf_counter() - start
+        if expected is None:
+            expected, serial_time = result, elapsed
+        same = result.equals(expected)
+        identical = identical and same
+        print(f"workers {workers:>3}: {elapsed:.2f}s  ({serial_time / elapsed:.1f}x)  "
+              f"used {stats.workers}{'' if same else '  DIFFERENT OUTPUT'}")
+    print(f"identical: {identical}")
+    return 0 if identical else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""
+Speed of the note pattern search: the per-pattern cascade used by
+commissions.patterns against one combined alternation per family.
+
+The combined regex scans each note once with a lookahead alternation
+'(?=(p1)|(p2)|...)' and keeps the highest-priority pattern seen, which gives
+the same values as the cascade.
+
+    python benchmarks/bench_patterns.py --rows 100k
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from collections import Counter
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from datagen import DATA_DIR, dataset, parse_size  # noqa: E402
+
+from commissions.patterns import NOTE_PATTERNS, PATTERN_FLAGS, format_hits  # noqa: E402
+
+
+def combined_search(family):
+    """Single-scan matcher of ``family``: text -> group 1 of the first-priority pattern."""
+    regex = re.compile('(?=' + '|'.join(f'({source})' for source in family.sources) + ')', PATTERN_FLAGS)
+    # Group number of each alternative; its own capture follows it
+    starts, group = [], 1
+    for pattern in family.patterns:
+        starts.append(group)
+        group += 1 + pattern.regex.groups
+
+    def search(text):
+        best, best_value = len(starts), None
+        for match in regex.finditer(text):
+            for position in range(best):
+                if match.group(starts[position]) is not None:
+                    best, best_value = position, match.group(starts[position] + 1)
+                    break
+            if best == 0:
+                break
+        return best_value
+    return search
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', default='100k', help="Base rows of the synthetic dataset")
+    args = parser.parse_args(argv)
+    paths = dataset(parse_size(args.rows), DATA_DIR)
+    notes = pd.read_csv(paths['sap_notes'], dtype=str)['Note Text'].dropna().astype(object)
+    print(f"notes: {len(notes)}")
+
+    identical = True
+    for family in NOTE_PATTERNS.values():
+        hits = Counter()
+        start = time.perf_counter()
+        cascade = family.extract(notes, hits)
+        cascade_time = time.perf_counter() - start
+
+        search = combined_search(family)
+        start = time.perf_counter()
+        combined = pd.Series([search(note) for note in notes], index=notes.index, dtype=object)
+        combined_time = time.perf_counter() - start
+
+        same = cascade.fillna('<none>').equals(combined.fillna('<none>'))
+        identical = identical and same
+        print(f"{family.name:<7} cascade {cascade_time:.3f}s  combined {combined_time:.3f}s  same: {same}")
+        print(f"        hits: {format_hits(hits)}")
+    return 0 if identical else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""
+End-to-end benchmark of the commission pipeline on synthetic datasets.
+
+Generates (once) the inputs of each size with benchmarks/datagen.py, runs
+the whole pipeline in process and prints the time of every stage. The
+processed output is hashed column by column and compared with the stored
+baseline in benchmarks/baselines, so a speed change that alters the output
+fails the run.
+
+    python benchmarks/bench_pipeline.py --sizes 10k 100k 1M
+    python benchmarks/bench_pipeline.py --sizes 10k --update-baselines
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from datagen import DATA_DIR, dataset, parse_size  # noqa: E402
+
+from commissions.dtypes import arrow_string_dtype  # noqa: E402
+from commissions.instrumentation import RunReport  # noqa: E402
+from commissions.note_cache import NOTES_CACHE  # noqa: E402
+from commissions.pipeline import (  # noqa: E402
+    BACKENDS,
+    PipelineOptions,
+    load_inputs,
+    run_pipeline,
+    write_output,
+)
+from commissions.reporting import NullReporter  # noqa: E402
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_DIR = os.path.join(BENCH_DIR, 'baselines')
+
+
+def output_digest(path):
+    """sha256 of the output file and of each of its columns."""
+    with open(path, 'rb') as f:
+        file_digest = hashlib.sha256(f.read()).hexdigest()
+    df = pd.read_csv(path, dtype=str, keep_default_na=False, encoding='utf-8-sig')
+    columns = {}
+    for column in df.columns:
+        columns[column] = hashlib.sha256('\n'.join(df[column]).encode('utf-8')).hexdigest()
+    return {'rows': len(df), 'sha256': file_digest, 'columns': columns}
+
+
+def baseline_path(rows, seed):
+    return os.path.join(BASELINE_DIR, f"rows{rows}-seed{seed}.json")
+
+
+def compare(digest, baseline):
+    """Names of the columns (or structural problems) that differ from the baseline."""
+    if digest['sha256'] == baseline['sha256']:
+        return []
+    problems = []
+    if digest['rows'] != baseline['rows']:
+        problems.append(f"rows {digest['rows']} != {baseline['rows']}")
+    if list(digest['columns']) != list(baseline['columns']):
+        problems.append("column names or order")
+    problems += [column for column, value in digest['columns'].items()
+                 if baseline['columns'].get(column, value) != value]
+    return problems or ["file bytes"]
+
+
+def run(rows, seed, data_dir, workers, arrow_strings=False, backend='pandas'):
+    paths = dataset(rows, data_dir, seed)
+    NOTES_CACHE.clear()
+    report = RunReport()
+    options = PipelineOptions(note_workers=workers,
+                              string_dtype=arrow_string_dtype() if arrow_strings else None,
+                              backend=backend)
+    inputs = load_inputs(paths, report=report, options=options)
+    base_df = run_pipeline(inputs, NullReporter(), options, report)
+    output = os.path.join(os.path.dirname(paths['base']), 'processed.csv')
+    write_output(base_df, output, report)
+    return report, output
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', nargs='+', default=['10k'], help="Base rows, e.g. 10k 100k 1M")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=DATA_DIR,
+                        help="Where generated datasets are kept (default: %(default)s)")
+    parser.add_argument('-j', '--workers', type=int, default=1, help="SAP Notes worker processes")
+    parser.add_argument('--arrow-strings', action='store_true',
+                        help="Run with Arrow string columns and categoricals")
+    parser.add_argument('--backend', choices=BACKENDS, default='pandas',
+                        help="Engine of the enrichment stages (default: %(default)s)")
+    parser.add_argument('--update-baselines', action='store_true',
+                        help="Store this run's output hashes and timings as the new baselines")
+    parser.add_argument('--json', metavar='PATH', help="Also write the timings of every size as JSON")
+    args = parser.parse_args(argv)
+
+    failed = False
+    results = {}
+    for size in args.sizes:
+        rows = parse_size(size)
+        report, output = run(rows, args.seed, args.data_dir, args.workers, args.arrow_strings,
+                             args.backend)
+        digest = output_digest(output)
+        results[rows] = report.to_dict()
+
+        path = baseline_path(rows, args.seed)
+        baseline = None
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                baseline = json.load(f)
+
+        print(f"\n== {rows} rows (seed {args.seed}) ==")
+        print(report.summary())
+        line = f"end to end: {report.wall_s:.2f}s"
+        if baseline and baseline.get('wall_s'):
+            line += f"  (baseline {baseline['wall_s']:.2f}s, {baseline['wall_s'] / report.wall_s:.2f}x)"
+        print(line)
+
+        if args.update_baselines:
+            os.makedirs(BASELINE_DIR, exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(dict(digest, wall_s=report.wall_s), f, indent=2)
+            print(f"output: baseline written to {os.path.relpath(path)}")
+        elif baseline is None:
+            print("output: no baseline stored (run with --update-baselines)")
+        else:
+            problems = compare(digest, baseline)
+            failed = failed or bool(problems)
+            print("output: matches baseline" if not problems
+                  else f"output: DIFFERS from baseline in {', '.join(problems)}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""
+Synthetic commission inputs for the benchmarks.
+
+Writes the seven input files of a run as CSV: a Base file of ``rows``
+invoice lines and the SAP Notes, SAMES, PO, INCIDENCIAS, FACTURAS and FOCUS
+files that go with it. The SAP Notes use every NHC / DOCTOR / F.INTERVENCIÓN
+layout the patterns in commissions.notes target, plus blank form fields and
+notes with nothing to extract. Output depends only on ``rows`` and ``seed``.
+
+    python benchmarks/datagen.py 100k /tmp/commissions-100k
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# Where the benchmarks keep generated datasets between runs
+DATA_DIR = os.path.join(tempfile.gettempdir(), 'commissions-bench')
+
+# File written for each input, as named in PipelineInputs
+FILE_NAMES = {
+    'base': 'base.csv',
+    'sap_notes': 'sap_notes.csv',
+    'sames': 'sames.csv',
+    'po': 'po.csv',
+    'incidencias': 'incidencias.csv',
+    'facturas': 'facturas.csv',
+    'focus': 'focus.csv',
+}
+
+# Average Base lines per sales order and per invoice
+LINES_PER_ORDER = 8
+LINES_PER_INVOICE = 3
+
+DOCTORS = ["GARCIA LOPEZ", "Juan Perez", "MARTINEZ", "Ana Ruiz Gil", "FERNÁNDEZ DÍAZ", "dr house"]
+PAYEES = ["ANA SANZ", "LUIS PEREZ", "MARTA RUIZ", "JORGE GIL"]
+REPS = ["REP NORTE", "REP SUR", "REP CENTRO", "REP LEVANTE"]
+BUS = ["SPORTS MEDICINE", "ORTHOPAEDICS", "WOUND"]
+BU2 = ["RECON", "TRAUMA", "AWM"]
+
+NHC_LAYOUTS = [
+    "NHC: ** {nhc} **", "NHC: * {nhc} *", "NHC: {nhc}", "NHC  {nhc}", "NHC NUMERO: {nhc}",
+    "NHC Nº {nhc}", "NHC NUM. AB{nhc}", "N.H.C.: {nhc}", "NH: {nhc}", "HISTORIA NUM. {nhc}",
+    "NHC: ___",
+]
+DOCTOR_LAYOUTS = [
+    "N. MEDICO: ºº {doctor} ºº", "N. MEDICO: ** {doctor} **", "DOCTOR: {doctor} OBS:",
+    "DR. {doctor} NOTA:", "MEDICO: {doctor} CENTRO:", "DR. ___ NOTA:", "DR. - NOTA:", "DOCTOR: 1234 X:",
+]
+FECHA_LAYOUTS = [
+    "F.INTERVENCIÓN: [[ {d}.{m}.{y} ]]", "F.INTERVENCIÓN: [[ {d}./{m}/{y}]]", "FECHA INT.: [[ {d}/{m}/{y} ]]",
+    "FECHA INT [[ {d}/{m}/{y} ]]", "F.I. {d}.{m}.{y}", "F.I {d}/{m}/{y}", "FECHA: {d}/{m}/{yy}",
+    "F.INTERVENCION: {d}/{m}/{y}", "F.INT: {d}/{m}/{y}", "FECHA DE LA INTERVENCIÓN: {d}/{m}/{y}",
+    "INTERVENIDO EL {d}/{m}/{y}", "FECHA INT.: [[ ]]",
+]
+# Notes that are only a date, or carry nothing the patterns look for
+BARE_NOTES = ["{d}/{m}/{y}", "{d}-{m}-{yy}", "{y}-{m}-{d}", "{d} de marzo de {y}",
+              "PACIENTE PRIVADO", "SIN DATOS", ""]
+
+PO_LAYOUTS = ["NHC {nhc}", "NHC: {nhc}", "NHC CIC {nhc} / 12", "NHC: **AB{short}**", "PO-{short}", "{nhc}"]
+
+
+def parse_size(text):
+    """'10k' -> 10000, '1M' -> 1000000."""
+    text = text.strip().lower()
+    factor = {'k': 1_000, 'm': 1_000_000}.get(text[-1:], 1)
+    return int(float(text.rstrip('km')) * factor)
+
+
+def _ids(rng, count, low, high):
+    return [str(value) for value in low + rng.choice(high - low, size=count, replace=False)]
+
+
+def _note(rng, nhc, doctor):
+    y = rng.choice([2023, 2024, 2025])
+    parts = {'d': f"{rng.randint(1, 28):02d}", 'm': f"{rng.randint(1, 12):02d}", 'y': y, 'yy': y % 100}
+    if rng.random() < 0.1:
+        return rng.choice(BARE_NOTES).format(**parts)
+    fields = [rng.choice(NHC_LAYOUTS).format(nhc=nhc)]
+    if rng.random() < 0.8:
+        fields.append(rng.choice(DOCTOR_LAYOUTS).format(doctor=doctor))
+    if rng.random() < 0.85:
+        fields.append(rng.choice(FECHA_LAYOUTS).format(**parts))
+    rng.shuffle(fields)
+    return " ".join(fields)
+
+
+def generate(rows, seed=0):
+    """Return {input name: DataFrame} for a Base file of ``rows`` lines."""
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    orders = _ids(np_rng, max(1, rows // LINES_PER_ORDER), 10**6, 10**8)
+    invoices = _ids(np_rng, max(1, rows // LINES_PER_INVOICE), 10**8, 10**9)
+    materials = _ids(np_rng, max(10, min(20_000, rows // 50)), 10**5, 10**7)
+    nhcs = _ids(np_rng, max(1, len(orders) // 2), 1000, 10**6)
+
+    invoice_dates = pd.to_datetime('2024-01-01') + pd.to_timedelta(np_rng.integers(0, 700, rows), unit='D')
+    invoice_dates = pd.Series(invoice_dates.strftime('%Y-%m-%d'), dtype=object)
+    invoice_dates[np_rng.random(rows) < 0.03] = None
+    order_column = pd.Series(np_rng.choice(orders, rows), dtype=object)
+    order_column[np_rng.random(rows) < 0.02] = 'RECLASIFICACIÓN REBATES'
+    base = pd.DataFrame({
+        'IDOrder': order_column,
+        'IDBillDoc': np_rng.choice(invoices, rows),
+        'IDBillDocItem': (np_rng.integers(1, 50, rows) * 10).astype(str),
+        'IDMaterial': np_rng.choice(materials, rows),
+        'BU': np_rng.choice(BUS, rows),
+        'BU 2': np_rng.choice(BU2, rows),
+        'Invoice Date': invoice_dates,
+        'Amount': np.round(np_rng.uniform(10, 5000, rows), 2).astype(str),
+        'F. Int - Formula': '', 'NHC - Textos': '', 'NHC - Formula': '', 'Dr - Textos': '',
+    })
+
+    order_nhc = {order: rng.choice(nhcs) for order in orders}
+    noted = [order for order in orders if rng.random() > 0.1]
+    sap_notes = pd.DataFrame({
+        'Sales Order': noted,
+        'Note Text': [_note(rng, order_nhc[order], rng.choice(DOCTORS)) for order in noted],
+    })
+
+    in_po = [order for order in orders if rng.random() > 0.05]
+    po = pd.DataFrame({
+        'SD Document': [order.zfill(10) for order in in_po],
+        'Purchase order number': [rng.choice(PO_LAYOUTS).format(nhc=order_nhc[order], short=rng.randint(1, 999))
+                                  for order in in_po],
+        'Your Reference': [f"REF{rng.randint(1, 99999)}" for _ in in_po],
+    })
+
+    in_sames = [nhc for nhc in nhcs if rng.random() > 0.3]
+    sames = pd.DataFrame({
+        'Nº Historial Clínico': in_sames,
+        'Comisionista (11)': [rng.choice(REPS) for _ in in_sames],
+    })
+
+    commented = [invoice for invoice in invoices if rng.random() < 0.15]
+    incidencias = pd.DataFrame({
+        'IDBillDoc': commented,
+        'COMENTARIOS S+N': [f"RECLASIFICAR A {rng.choice(REPS)}" for _ in commented],
+    })
+
+    paid = [invoice for invoice in invoices if rng.random() < 0.3 for _ in range(rng.randint(1, 3))]
+    facturas = pd.DataFrame({
+        'IDBillDoc': paid,
+        'CurrentCorrected_Name': [rng.choice(PAYEES) for _ in paid],
+        'PERIODO COMISION': [f"{rng.choice([2023, 2024])}-{rng.randint(1, 12):02d}" for _ in paid],
+    })
+
+    in_focus = [material for material in materials if rng.random() < 0.4]
+    focus = pd.DataFrame({
+        'IDMaterial': in_focus,
+        'PRODUCT TYPE': [rng.choice(['FOCUS', 'CORE', 'NEW LAUNCH']) for _ in in_focus],
+    })
+
+    return {'base': base, 'sap_notes': sap_notes, 'sames': sames, 'po': po,
+            'incidencias': incidencias, 'facturas': facturas, 'focus': focus}
+
+
+def write_dataset(rows, directory, seed=0):
+    """Generate the inputs into ``directory``; returns {input name: path}."""
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for name, df in generate(rows, seed).items():
+        paths[name] = os.path.join(directory, FILE_NAMES[name])
+        df.to_csv(paths[name], index=False)
+    return paths
+
+
+def dataset(rows, root, seed=0):
+    """Paths of the dataset for ``rows`` / ``seed`` under ``root``, generated once."""
+    directory = os.path.join(root, f"rows{rows}-seed{seed}")
+    paths = {name: os.path.join(directory, file) for name, file in FILE_NAMES.items()}
+    if all(os.path.exists(path) for path in paths.values()):
+        return paths
+    return write_dataset(rows, directory, seed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('rows', help="Base rows, e.g. 10000, 100k or 1M")
+    parser.add_argument('directory')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    for name, path in write_dataset(parse_size(args.rows), args.directory, args.seed).items():
+        print(f"{name:<12} {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,16 @@
+"""
+Headless engine behind the Spanish commissions Streamlit app.
+"""
+from .batch import find_base_files, run_batch
+from .io import InputFileError, read_file
+from .notes import extract_sap_notes_info, normalize_date_format
+from .pipeline import (
+    PipelineInputs,
+    PipelineOptions,
+    load_inputs,
+    run_pipeline,
+    run_pipeline_chunked,
+    run_pipeline_incremental,
+    write_output,
+)
+from .reporting import ChunkReporter, ConsoleReporter, NullReporter
@@ -0,0 +1,204 @@
+"""
+Batch runs over many monthly Base files with one set of reference files.
+
+The reference files are read and indexed once; each Base file (a period)
+then goes through the stages in a process pool, the workers receiving the
+indexes once when they start. Every period is written on its own,
+``OUT/<period>.csv`` (or .parquet / .xlsx), and as one partition of the
+combined output ``OUT/combined/PERIOD=<period>/part-0.parquet``, which
+pandas or pyarrow read back as one table with a PERIOD column (CSV
+partitions when pyarrow is missing).
+"""
+import copy
+import dataclasses
+import glob
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from .export import FORMATS, export, write_csv, write_parquet
+from .instrumentation import RunReport
+from .io import InputFileError, read_file
+from .pipeline import (
+    REQUIRED_INPUTS,
+    PipelineOptions,
+    _check_inputs,
+    _read_input,
+    _run_stages,
+    index_references,
+)
+from .refstore import have_pyarrow
+from .reporting import BufferedReporter, ConsoleReporter
+
+BASE_EXTENSIONS = ('.csv', '.xlsx', '.xls')
+
+# yyyy-mm, yyyy_mm or yyyymm in a Base file name gives its period
+PERIOD_PATTERN = re.compile(r'(?<!\d)((?:19|20)\d{2})[-_. ]?(0[1-9]|1[0-2])(?!\d)')
+
+COMBINED_DIR = 'combined'
+PERIOD_COLUMN = 'PERIOD'
+
+
+def period_name(path):
+    """'2024-03' for base_2024_03.xlsx; the file name without extension when it has no month."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    match = PERIOD_PATTERN.search(stem)
+    return f"{match.group(1)}-{match.group(2)}" if match else stem
+
+
+def find_base_files(pattern):
+    """
+    {period: path} of the Base files in directory ``pattern``, or matching
+    the glob ``pattern``, in period order.
+    """
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '*')
+    paths = [path for path in glob.glob(pattern) if path.lower().endswith(BASE_EXTENSIONS)]
+    if not paths:
+        raise ValueError(f"No Base files (csv/xlsx) match {pattern}")
+    periods = {}
+    for path in sorted(paths):
+        period = period_name(path)
+        if period in periods:
+            raise ValueError(f"{os.path.basename(periods[period])} and {os.path.basename(path)} "
+                             f"are both period {period}")
+        periods[period] = path
+    return dict(sorted(periods.items()))
+
+
+def partition_path(output_dir, period):
+    extension = 'parquet' if have_pyarrow() else 'csv'
+    return os.path.join(output_dir, COMBINED_DIR, f"{PERIOD_COLUMN}={period}", f"part-0.{extension}")
+
+
+@dataclasses.dataclass
+class PeriodResult:
+    """What processing one period gave, sent back from the worker."""
+    period: str
+    path: str
+    rows: int
+    report: RunReport
+    warnings: list
+    # Doctor dictionary of the worker, with the spellings it learned
+    doctors: object = None
+
+
+def run_period(references, period, base_path, output_dir, format='csv', options=None):
+    """
+    Process the Base file of ``period`` against the indexed ``references``
+    and write its output file and combined partition. Returns a PeriodResult.
+    """
+    options = options or PipelineOptions()
+    report = RunReport()
+    reporter = BufferedReporter()
+    try:
+        base_df, timing = _read_input('base', base_path, read_file, None, options.string_dtype)
+    except InputFileError as e:
+        raise InputFileError(f"{period}: {e}") from e
+    report.add(timing)
+    base_df = _run_stages(base_df, references, reporter, options, report)
+    with report.measure('export', rows_in=len(base_df)) as timing:
+        path = export(base_df, os.path.join(output_dir, f"{period}.{format}"), format)
+        partition = partition_path(output_dir, period)
+        os.makedirs(os.path.dirname(partition), exist_ok=True)
+        (write_parquet if have_pyarrow() else write_csv)(base_df, partition)
+        timing.rows_out = len(base_df)
+    return PeriodResult(period, path, len(base_df), report, reporter.warnings, options.doctors)
+
+
+# Indexed references and options of a batch worker, set once when it starts
+_worker = {}
+
+
+def _init_worker(references, options):
+    _worker['references'] = references
+    _worker['options'] = options
+
+
+def _run_worker_period(period, base_path, output_dir, format):
+    return run_period(_worker['references'], period, base_path, output_dir, format, _worker['options'])
+
+
+def _run_parallel(periods, workers, references, options, output_dir, format, on_done):
+    """Run ``periods`` over ``workers`` processes; the first failure cancels the periods not started."""
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                               initargs=(references, options))
+    try:
+        futures = [pool.submit(_run_worker_period, period, path, output_dir, format)
+                   for period, path in periods.items()]
+        for future in as_completed(futures):
+            on_done(future.result())
+    except BaseException:
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    # Waited for, so that no pipe is written to after this process moves on
+    pool.shutdown(wait=True)
+
+
+def run_batch(inputs, base_paths, output_dir, reporter=None, options=None, report=None,
+              workers=1, format='csv'):
+    """
+    Process every Base file of ``base_paths`` ({period: path}) against the
+    reference tables of ``inputs`` (``inputs.base`` is ignored), indexed
+    once, over ``workers`` processes. Writes ``output_dir``/<period>.<format>
+    and the combined output partitioned by period. Returns {period: rows}.
+    """
+    reporter = reporter or ConsoleReporter()
+    options = options or PipelineOptions()
+    _check_inputs(inputs, [name for name in REQUIRED_INPUTS if name != 'base'])
+    if format not in FORMATS:
+        raise ValueError(f"Unknown output format: {format}")
+    report = report if report is not None else RunReport()
+    os.makedirs(output_dir, exist_ok=True)
+
+    reporter.step("Indexing reference files...")
+    with report.measure('index references'):
+        references = index_references(inputs, reporter, options)
+
+    workers = min(workers, len(base_paths))
+    reporter.step(f"Processing {len(base_paths)} periods over {max(workers, 1)} processes...")
+    results = {}
+
+    def on_done(result):
+        results[result.period] = result
+        reporter.success(f"{result.period}: {result.rows} rows written to {result.path} "
+                         f"({result.report.wall_s:.1f}s)")
+
+    done = False
+    if workers > 1:
+        # Each worker parses its notes alone and resolves doctor names against its
+        # own copy of the dictionary as loaded, so no period sees the names another
+        # one learns; the learned ones are merged back below and saved from here only
+        doctors = copy.deepcopy(options.doctors)
+        doctors.path = None
+        worker_options = dataclasses.replace(options, note_workers=1, note_profiler=None,
+                                             doctors=doctors)
+        try:
+            _run_parallel(base_paths, workers, references, worker_options, output_dir, format, on_done)
+            done = True
+        except (BrokenProcessPool, OSError):
+            # No usable process pool here (or it died): run the periods in this process
+            reporter.warning("Could not start the worker processes - processing the periods one by one")
+            results.clear()
+    if not done:
+        for period, path in base_paths.items():
+            on_done(run_period(references, period, path, output_dir, format, options))
+
+    # Timings, warnings and learned doctor names in period order
+    warned = set()
+    for period in base_paths:
+        result = results[period]
+        for timing in result.report.stages.values():
+            report.add(timing)
+        for message in result.warnings:
+            if message not in warned:
+                warned.add(message)
+                reporter.warning(f"{period}: {message}")
+        if result.doctors is not None and result.doctors is not options.doctors:
+            options.doctors.merge(result.doctors)
+    if options.doctors.path and options.doctors.unsaved:
+        options.doctors.save()
+    combined = os.path.join(output_dir, COMBINED_DIR)
+    reporter.success(f"Combined output in {combined}, partitioned by {PERIOD_COLUMN}")
+    return {period: results[period].rows for period in base_paths}
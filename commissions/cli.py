@@ -0,0 +1,176 @@
+"""
+Command line entry point: ``python -m commissions``.
+
+Runs the same pipeline as the Streamlit app on files given as paths and
+writes the processed CSV, so the monthly close can run as a batch job.
+"""
+import argparse
+import os
+import sys
+
+from .instrumentation import PROFILERS, NoteProfiler, RunReport
+from .batch import find_base_files, run_batch
+from .doctors import DoctorDictionary, default_dictionary_path
+from .dtypes import arrow_string_dtype
+from .export import FORMATS
+from .incremental import IncrementalState
+from .io import InputFileError
+from .masterdata import MasterDataStore, default_database_path
+from .pipeline import (
+    BACKENDS,
+    PipelineOptions,
+    load_inputs,
+    run_pipeline,
+    run_pipeline_chunked,
+    run_pipeline_incremental,
+    write_output,
+)
+from .refstore import ReferenceStore
+from .reporting import ConsoleReporter
+
+DEFAULT_OUTPUT = 'processed_base_file.csv'
+DEFAULT_BATCH_OUTPUT = 'processed_periods'
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m commissions',
+        description="Process Spanish commission files without the Streamlit app.")
+    parser.add_argument('--base', help="Base file (csv/xlsx)")
+    parser.add_argument('--batch', metavar='DIR_OR_GLOB',
+                        help="Process every Base file in DIR (or matching the glob) as one period, "
+                             "instead of --base")
+    parser.add_argument('--sap-notes', required=True, help="SAP Notes file")
+    parser.add_argument('--po', help="SAP DATA - PO NUMBER, DATE, REFERENCE file (required unless it is "
+                                     "in the --master-data store)")
+    parser.add_argument('--sames', help="SAMES file")
+    parser.add_argument('--incidencias', help="INCIDENCIAS + RECLASIFICACIONES file")
+    parser.add_argument('--facturas', help="FACTURAS COMISIONADAS file")
+    parser.add_argument('--focus', help="PRODUCTOS FOCUS file")
+    parser.add_argument('--master-data-es', metavar='FILE',
+                        help="MasterDataES file: IDCurrentCorrected by (IDBillDoc, IDBillDocItem)")
+    parser.add_argument('-o', '--output',
+                        help="Output path; a .parquet or .xlsx extension writes Parquet or Excel "
+                             f"instead of CSV (default: {DEFAULT_OUTPUT}). With --batch, the output "
+                             f"directory (default: {DEFAULT_BATCH_OUTPUT})")
+    parser.add_argument('--format', choices=FORMATS, default='csv',
+                        help="Format of the per-period files of --batch (default: %(default)s)")
+    parser.add_argument('--batch-workers', type=int, default=0, metavar='N',
+                        help="Processes running the --batch periods (default: one per CPU)")
+    parser.add_argument('--reference-cache', metavar='DIR',
+                        help="Directory of the Feather cache of the reference files "
+                             "(default: $COMMISSIONS_CACHE_DIR or ~/.cache/commissions/reference)")
+    parser.add_argument('--no-reference-cache', action='store_true',
+                        help="Always parse the reference files")
+    parser.add_argument('--reference-cache-mmap', action='store_true',
+                        help="Memory-map the cached reference files instead of reading them into memory "
+                             "first")
+    parser.add_argument('--master-data', metavar='DB', default=default_database_path(),
+                        help="SQLite store of the SAMES, PO, FACTURAS, FOCUS and MasterDataES files: the "
+                             "ones given are loaded into it, the others are read from it "
+                             "(default: $COMMISSIONS_MASTER_DATA)")
+    parser.add_argument('--chunk-size', type=int, metavar='ROWS',
+                        help="Process the Base file ROWS rows at a time, appending to the output "
+                             "as it goes (bounds memory on very large Base files)")
+    parser.add_argument('--incremental', metavar='DIR',
+                        help="Keep the processed rows in DIR and, on later runs, only process the "
+                             "Base rows that are new or whose inputs changed")
+    parser.add_argument('--nhc-max-edits', type=int, default=0, metavar='N',
+                        help="Also match NHCs against SAMES with up to N typing errors when exactly one "
+                             "SAMES value is that close (default: %(default)s, off)")
+    parser.add_argument('--doctors', metavar='CSV', default=default_dictionary_path(),
+                        help="Doctor dictionary (canonical,alias) to resolve DOCTOR names with; new "
+                             "names are added to it (default: $COMMISSIONS_DOCTORS; without one, names "
+                             "are only unified within the run)")
+    parser.add_argument('-j', '--workers', type=int, default=1, metavar='N',
+                        help="Processes parsing the SAP Notes (default: %(default)s, 0: one per CPU)")
+    parser.add_argument('--read-workers', type=int, default=1, metavar='N',
+                        help="Processes reading the input files at once (default: %(default)s, "
+                             "0: one per CPU)")
+    parser.add_argument('--arrow-strings', action='store_true',
+                        help="Hold text columns as Arrow strings and BU, BU 2, Product Type and "
+                             "DOCTOR as categoricals (less memory on wide Base files)")
+    parser.add_argument('--backend', choices=BACKENDS, default='pandas',
+                        help="Engine of the enrichment stages; polars (needs polars) runs them as one "
+                             "lazy multi-threaded query (default: %(default)s)")
+    parser.add_argument('--report', metavar='PATH',
+                        help="JSON file of per-stage timings (default: next to the output, *.report.json)")
+    parser.add_argument('--profile-notes', choices=PROFILERS,
+                        help="Profile the SAP Notes extraction with cProfile or pyinstrument")
+    parser.add_argument('--profile-output', metavar='PATH',
+                        help="Where to write the profile (default: notes_profile.prof / .html)")
+    parser.add_argument('-q', '--quiet', action='store_true', help="Only print warnings, without progress or diagnostics")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.incremental and args.chunk_size:
+        parser.error("--incremental and --chunk-size cannot be combined")
+    if bool(args.base) == bool(args.batch):
+        parser.error("give either --base or --batch")
+    if args.batch and (args.incremental or args.chunk_size):
+        parser.error("--batch cannot be combined with --incremental or --chunk-size")
+    args.output = args.output or (DEFAULT_BATCH_OUTPUT if args.batch else DEFAULT_OUTPUT)
+    sources = {
+        'base': args.base,
+        'sap_notes': args.sap_notes,
+        'sames': args.sames,
+        'po': args.po,
+        'incidencias': args.incidencias,
+        'facturas': args.facturas,
+        'focus': args.focus,
+        'master_data': args.master_data_es,
+    }
+    reporter = ConsoleReporter(verbose=not args.quiet)
+    store = None if args.no_reference_cache else ReferenceStore(args.reference_cache,
+                                                                memory_map=args.reference_cache_mmap)
+    report = RunReport()
+    try:
+        profiler = NoteProfiler(args.profile_notes, args.profile_output) if args.profile_notes else None
+        options = PipelineOptions(note_workers=args.workers or os.cpu_count() or 1,
+                                  note_profiler=profiler,
+                                  string_dtype=arrow_string_dtype() if args.arrow_strings else None,
+                                  nhc_max_edits=args.nhc_max_edits,
+                                  index_cache=store.root if store is not None else None,
+                                  read_workers=args.read_workers or os.cpu_count() or 1,
+                                  doctors=DoctorDictionary.load(args.doctors),
+                                  backend=args.backend)
+        periods = find_base_files(args.batch) if args.batch else None
+        base = sources.pop('base') if args.batch or args.chunk_size else None
+        inputs = load_inputs(sources, reference_store=store, report=report, options=options,
+                             reporter=reporter)
+        if args.master_data:
+            # Files given refresh the store; the run reads every reference table from it
+            master = MasterDataStore(args.master_data)
+            master.refresh(inputs, reporter, report, sources)
+            inputs = master.inputs(inputs, inputs.base, reporter, report)
+
+        if args.batch:
+            written = run_batch(inputs, periods, args.output, reporter, options, report,
+                                workers=args.batch_workers or os.cpu_count() or 1, format=args.format)
+            rows = sum(written.values())
+        elif args.chunk_size:
+            rows = run_pipeline_chunked(inputs, base, args.output, args.chunk_size, reporter, options,
+                                        report)
+        elif args.incremental:
+            state = IncrementalState(args.incremental)
+            base_df, _ = run_pipeline_incremental(inputs, state, reporter, options, report)
+            write_output(base_df, args.output, report)
+            rows = len(base_df)
+        else:
+            base_df = run_pipeline(inputs, reporter, options, report)
+            write_output(base_df, args.output, report)
+            rows = len(base_df)
+    except (InputFileError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    report_path = args.report or f"{os.path.splitext(args.output)[0]}.report.json"
+    report.write_json(report_path)
+    reporter.step(report.summary())
+    reporter.success(f"Wrote {rows} rows to {args.output}, timings to {report_path}")
+    if profiler is not None:
+        reporter.success(f"SAP Notes profile written to {profiler.output}")
+    return 0
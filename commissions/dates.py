@@ -0,0 +1,234 @@
+"""
+Tiered parsing of the dates found in SAP Notes.
+
+dateparser is slow per call while almost every date in the notes is a plain
+dd/mm/yyyy, dd-mm-yy or dd.mm.yyyy. parse_dates therefore reads those
+numeric layouts for a whole Series at once (tier "numeric") and only hands
+what is left to dateparser ("dateparser") and, optionally, to the
+DATE_REGEX_PATTERNS search ("regex"). Every tier applies the same rules:
+day before month, 2-digit years up to 30 are 20xx and older ones 19xx, and
+dates in the future are rejected.
+"""
+import re
+from dataclasses import dataclass, field, fields
+from datetime import date, datetime
+
+import dateparser
+import numpy as np
+import pandas as pd
+
+DATE_FORMAT = "%d/%m/%Y"
+
+# 2-digit years up to this value are 20xx, the others 19xx
+TWO_DIGIT_YEAR_PIVOT = 30
+
+# Years outside this range are left to the slower tiers
+MIN_YEAR, MAX_YEAR = 1900, 2100
+
+DATEPARSER_LANGUAGES = ['es', 'en']
+
+# Layouts of the Base Invoice Date column, tried in order: ISO dates (as SAP
+# exports them and as Excel cells read as text), then dd/mm/yyyy
+INVOICE_DATE_FORMATS = ['ISO8601', DATE_FORMAT]
+
+# dd/mm/yyyy, dd-mm-yy, dd.mm.yyyy ... or yyyy-mm-dd, after removing blanks
+NUMERIC_DATE_PATTERN = re.compile(
+    r'^(?:(?P<day>\d{1,2})[./-]+(?P<month>\d{1,2})[./-]+(?P<year>\d{4}|\d{2})'
+    r'|(?P<iso_year>\d{4})[./-]+(?P<iso_month>\d{1,2})[./-]+(?P<iso_day>\d{1,2}))$'
+)
+
+# Texts starting with a 4-digit year, read year-month-day by dateparser
+YEAR_FIRST_PATTERN = re.compile(r'^\s*\d{4}[./-]')
+
+# Common date patterns searched inside the text: dd/mm/yyyy, dd-mm-yyyy, d/m/yy, etc.
+DATE_REGEX_PATTERNS = [
+    re.compile(r'(\d{1,2})[/-](\d{1,2})[/-](\d{4})'),      # dd/mm/yyyy or dd-mm-yyyy
+    re.compile(r'(\d{1,2})[/-](\d{1,2})[/-](\d{2})'),      # dd/mm/yy or dd-mm-yy
+    re.compile(r'(\d{4})[/-](\d{1,2})[/-](\d{1,2})'),      # yyyy/mm/dd or yyyy-mm-dd
+]
+
+_BLANKS = re.compile(r'[_\s]+')
+
+
+@dataclass
+class DateTierStats:
+    """Number of values resolved by each tier of parse_dates."""
+    numeric: int = 0
+    dateparser: int = 0
+    regex: int = 0
+    future: int = 0
+    unparsed: int = 0
+
+    def add(self, other):
+        for f in fields(self):
+            setattr(self, f.name, getattr(self, f.name) + getattr(other, f.name))
+
+    def summary(self):
+        return ", ".join(f"{getattr(self, f.name)} {f.name}" for f in fields(self))
+
+
+@dataclass
+class DateParseResult:
+    """Output of parse_dates, aligned on the input index."""
+    dates: pd.Series
+    parsed: pd.Series
+    stats: DateTierStats = field(default_factory=DateTierStats)
+    # The future dates rejected, 'dd/mm/yyyy' (None elsewhere)
+    future: pd.Series = None
+
+
+def expand_year(year):
+    """Turn a 2-digit year into a 4-digit one."""
+    if year < 100:
+        return year + (2000 if year <= TWO_DIGIT_YEAR_PIVOT else 1900)
+    return year
+
+
+def _numeric_date(text):
+    match = NUMERIC_DATE_PATTERN.match(_BLANKS.sub('', text))
+    if not match:
+        return None
+    if match.group('day'):
+        day, month, year = match.group('day', 'month', 'year')
+    else:
+        year, month, day = match.group('iso_year', 'iso_month', 'iso_day')
+    year = expand_year(int(year)) if len(year) == 2 else int(year)
+    if not MIN_YEAR <= year <= MAX_YEAR:
+        return None
+    try:
+        return datetime(year, int(month), int(day))
+    except ValueError:
+        return None
+
+
+def _dateparser_date(text):
+    # dateparser reads numeric dates month first unless told otherwise
+    order = 'YMD' if YEAR_FIRST_PATTERN.match(text) else 'DMY'
+    try:
+        return dateparser.parse(text, languages=DATEPARSER_LANGUAGES, settings={'DATE_ORDER': order})
+    except Exception:
+        # counted as unparsed
+        return None
+
+
+def _regex_date(text):
+    for pattern in DATE_REGEX_PATTERNS:
+        match = pattern.search(text)
+        if not match:
+            continue
+        part1, part2, part3 = match.groups()
+        if len(part1) == 4:  # yyyy/mm/dd format
+            year, month, day = part1, part2, part3
+        else:
+            day, month, year = part1, part2, part3
+        year = expand_year(int(year)) if len(year) == 2 else int(year)
+        try:
+            if MIN_YEAR <= year <= MAX_YEAR:
+                return datetime(year, int(month), int(day))
+        except ValueError:
+            # not a calendar date (31/02); try the next pattern
+            continue
+    return None
+
+
+def _numeric_tier(texts):
+    """Vectorized tier 1: Series of text -> Series of Timestamp/NaT."""
+    parts = texts.str.replace(_BLANKS.pattern, '', regex=True).str.extract(NUMERIC_DATE_PATTERN)
+    parts = parts.apply(pd.to_numeric, errors='coerce')
+    day = parts['day'].fillna(parts['iso_day'])
+    month = parts['month'].fillna(parts['iso_month'])
+    year = parts['year'].fillna(parts['iso_year'])
+    year = year.where(year >= 100, year + np.where(year <= TWO_DIGIT_YEAR_PIVOT, 2000, 1900))
+    year = year.where(year.between(MIN_YEAR, MAX_YEAR))
+    return pd.to_datetime(pd.DataFrame({'year': year, 'month': month, 'day': day}), errors='coerce')
+
+
+def parse_dates(values, regex_fallback=False):
+    """
+    Parse a Series of date texts into 'dd/mm/yyyy' strings (None when
+    unreadable or in the future).
+
+    ``parsed`` flags the values some tier could read, including the future
+    dates that were then rejected. With ``regex_fallback`` the values no
+    other tier could read are searched for a date with DATE_REGEX_PATTERNS.
+    """
+    texts = values.dropna().astype(str).astype(object)
+    stats = DateTierStats()
+    resolved = pd.Series(pd.NaT, index=texts.index, dtype='datetime64[ns]')
+    tiers = [('numeric', None), ('dateparser', _dateparser_date)]
+    if regex_fallback:
+        tiers.append(('regex', _regex_date))
+
+    remaining = texts
+    for name, parse in tiers:
+        if remaining.empty:
+            break
+        if parse is None:
+            found = _numeric_tier(remaining)
+        else:
+            # Slow tiers run once per distinct text
+            lookup = {text: parse(text) for text in remaining.unique()}
+            found = pd.to_datetime(remaining.map(lookup), errors='coerce')
+        found = found.dropna()
+        resolved.loc[found.index] = found.dt.normalize()
+        setattr(stats, name, len(found))
+        remaining = remaining.drop(found.index)
+    stats.unparsed = len(remaining)
+
+    parsed = resolved.notna()
+    future = resolved > pd.Timestamp(date.today())
+    stats.future = int(future.sum())
+    formatted = resolved.dt.strftime(DATE_FORMAT).astype(object).reindex(values.index)
+    dates = formatted.where(~future.reindex(values.index, fill_value=False) & formatted.notna(), None)
+    rejected = formatted.where(future.reindex(values.index, fill_value=False), None)
+    return DateParseResult(dates, parsed.reindex(values.index, fill_value=False), stats, rejected)
+
+
+def _invoice_date(text):
+    """Scalar to_datetime of an invoice date no format read, day first unless the year leads."""
+    return pd.to_datetime(text, dayfirst=not YEAR_FIRST_PATTERN.match(text), errors='coerce')
+
+
+def parse_invoice_dates(values, formats=INVOICE_DATE_FORMATS):
+    """
+    Timestamps of a Series of invoice dates, NaT where nothing reads the
+    value. One vectorized to_datetime per format, on what the previous
+    formats left; the rest ('05.03.2025', '5 mar 2025' ...) get a scalar
+    to_datetime per distinct value, as the original script gave every row.
+    """
+    parsed = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+    remaining = values.dropna().astype(str).astype(object)
+    for format in formats:
+        if remaining.empty:
+            break
+        found = pd.to_datetime(remaining, format=format, errors='coerce').dropna()
+        parsed.loc[found.index] = found
+        remaining = remaining.drop(found.index)
+    if not remaining.empty:
+        codes, uniques = pd.factorize(remaining)
+        found = pd.Series([_invoice_date(text) for text in uniques], dtype='datetime64[ns]')
+        found = pd.Series(found.to_numpy()[codes], index=remaining.index).dropna()
+        parsed.loc[found.index] = found
+    return parsed
+
+
+def unparsed_dates(values, parsed):
+    """Number of non-blank ``values`` that ``parsed`` has no date for."""
+    filled = values.notna() & (values.astype(str).str.strip() != '')
+    return int((filled & parsed.isna()).sum())
+
+
+def parse_date(text, regex_fallback=False):
+    """
+    Scalar version of parse_dates: returns (parsed, 'dd/mm/yyyy' or None).
+    """
+    tiers = [_numeric_date, _dateparser_date]
+    if regex_fallback:
+        tiers.append(_regex_date)
+    for parse in tiers:
+        value = parse(text)
+        if value is not None:
+            if value.date() > date.today():
+                return True, None
+            return True, value.strftime(DATE_FORMAT)
+    return False, None
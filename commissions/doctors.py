@@ -0,0 +1,259 @@
+"""
+Cleanup and canonical spelling of the DOCTOR names.
+
+The doctor field of the SAP Notes is typed by hand: 'DR. GARCIA', 'Dr
+Garcia L.', 'GARCÍA LÓPEZ', '-', '____'. DoctorDictionary.resolve turns a
+column of such values into one spelling per doctor, so that commissions
+add up per doctor with a plain groupby:
+
+- placeholders (blank, dashes, underscores, numbers) become NO_DOCTOR;
+- names are compared by key: upper case without accents, punctuation or
+  titles (Dr, Dra, Doctor, Doctora);
+- a key the dictionary holds gives its canonical name (tier "exact");
+- otherwise a name of two words or more, all of which appear in exactly
+  one canonical name, resolves to it, a single letter standing for any
+  word with that initial (tier "token": 'Dr Garcia L.' -> 'GARCIA LOPEZ');
+- the other names are spelled by their key (tier "new"): a lone surname
+  such as 'RUIZ' is not folded into the one doctor called RUIZ it finds.
+
+Names are resolved against the dictionary as it was loaded: the spellings
+a run resolves are kept apart and only saved for later runs, so a name
+resolves the same whatever other names the run holds and however the Base
+is split in chunks, periods or processes.
+
+Lookups run on the distinct values of the column, by key through a dict
+and by word through a merge with the word index of the canonical names.
+The dictionary can be kept in a CSV file of (canonical, alias) rows that
+later runs load and that can be edited by hand to merge two names.
+"""
+import hashlib
+import os
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+NO_DOCTOR = 'NO INFORMADO'
+
+MATCH_TIERS = ('exact', 'token', 'new')
+
+# Words dropped from names before comparing them
+TITLES = ['DR', 'DRA', 'DRES', 'DOCTOR', 'DOCTORA']
+
+# Values that stand for "no doctor" once stripped
+PLACEHOLDER_PATTERN = r'[-_.\s]*|\d+'
+
+DICTIONARY_COLUMNS = ['canonical', 'alias']
+
+# Doctor dictionary used when none is given, if set
+DICTIONARY_ENV = 'COMMISSIONS_DOCTORS'
+
+
+def default_dictionary_path():
+    return os.environ.get(DICTIONARY_ENV) or None
+
+
+def clean_doctors(values):
+    """DOCTOR values stripped, with NO_DOCTOR for placeholders and missing values."""
+    text = pd.Series(values, dtype=object).str.strip()
+    placeholder = text.isna() | text.fillna('').str.fullmatch(PLACEHOLDER_PATTERN)
+    return text.where(~placeholder, NO_DOCTOR)
+
+
+def display_names(values):
+    """
+    Upper-case names with titles and punctuation removed, accents kept
+    ('Dr. García, L.' -> 'GARCÍA L'); '' when nothing is left.
+    """
+    # As plain Python strings: \w then covers accented letters
+    names = pd.Series(values, dtype=object).astype(str).astype(object).str.upper()
+    names = names.str.replace(r'[\W_]+', ' ', regex=True)
+    names = names.str.replace(rf"\b(?:{'|'.join(TITLES)})\b", ' ', regex=True)
+    return names.str.split().str.join(' ')
+
+
+def doctor_keys(names):
+    """Comparison keys of display names: accents removed."""
+    return names.str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii')
+
+
+def _words(keys, initials=False):
+    """
+    Frame of (position, token) for the words of ``keys``. Single letters
+    become 'X.' tokens; with ``initials`` every longer word also gives one.
+    """
+    words = keys.reset_index(drop=True).str.split().explode().dropna()
+    frame = pd.DataFrame({'position': words.index.to_numpy(dtype=int),
+                          'token': words.to_numpy(dtype=object)})
+    single = frame['token'].str.len() == 1
+    frame.loc[single, 'token'] = frame.loc[single, 'token'] + '.'
+    if initials:
+        first = frame[~single].assign(token=frame.loc[~single, 'token'].str[0] + '.')
+        frame = pd.concat([frame, first], ignore_index=True)
+    return frame.drop_duplicates(ignore_index=True)
+
+
+def _full_words(keys):
+    """Number of words longer than one letter in each of ``keys``."""
+    return keys.str.count(r'\b\w{2,}\b').to_numpy()
+
+
+class DoctorDictionary:
+    """
+    Canonical doctor names and every spelling resolved to them, indexed by
+    key and by word. ``path`` is the CSV file it is loaded from and saved to.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.names = []
+        self.aliases = {}
+        # Spellings resolved since the dictionary was loaded: key -> name, saved but not looked up
+        self.learned = {}
+        self._saved = 0
+        self._word_index = None
+
+    def __len__(self):
+        return len(set(self.names).union(self.learned.values()))
+
+    @property
+    def unsaved(self):
+        """Number of learned spellings the file does not have yet."""
+        return len(self.learned) - self._saved
+
+    def _add(self, names):
+        """Add canonical ``names`` (a Series); returns their entry numbers."""
+        entries = np.arange(len(self.names), len(self.names) + len(names))
+        self.names.extend(names)
+        for key, entry in zip(doctor_keys(display_names(names)), entries):
+            if key:
+                self.aliases.setdefault(key, int(entry))
+        self._word_index = None
+        return entries
+
+    def words(self):
+        """Word index of the canonical names: frame of (token, entry)."""
+        if self._word_index is None:
+            keys = doctor_keys(display_names(pd.Series(self.names, dtype=object)))
+            self._word_index = _words(keys, initials=True).rename(columns={'position': 'entry'})
+        return self._word_index
+
+    def _token_matches(self, keys):
+        """
+        Entry whose words include every word of each of ``keys``, -1 where
+        there is none or several. Keys made of initials only never match.
+        """
+        result = np.full(len(keys), -1)
+        words = self.words()
+        if words.empty or not len(keys):
+            return result
+        query = _words(keys)
+        needed = query.groupby('position').size()
+        pairs = query.merge(words, on='token')
+        counts = pairs.groupby(['position', 'entry']).size().reset_index(name='found')
+        counts = counts[counts['found'].to_numpy() == needed.loc[counts['position']].to_numpy()]
+        unique = counts.groupby('position')['entry'].transform('size') == 1
+        chosen = counts[unique & (_full_words(keys)[counts['position']] > 0)]
+        result[chosen['position'].to_numpy()] = chosen['entry'].to_numpy()
+        return result
+
+    def resolve(self, values):
+        """
+        Canonical name of each of ``values`` (a Series of DOCTOR values) in
+        the dictionary as loaded. Returns (name, tier): two Series aligned on
+        ``values``, tier None for NO_DOCTOR. The spellings it did not hold
+        are added to ``learned``.
+        """
+        cleaned = clean_doctors(values)
+        codes, uniques = pd.factorize(cleaned.where(cleaned != NO_DOCTOR))
+        keys = doctor_keys(display_names(uniques))
+        entries = keys.map(self.aliases).fillna(-1).astype(int).to_numpy(copy=True)
+        tiers = np.where(entries >= 0, 'exact', None).astype(object)
+
+        # Names made of initials alone ('L.') are not resolved
+        pending = np.flatnonzero((entries < 0) & (_full_words(keys) > 0))
+        # A single word could stand for any doctor of that name: only longer names match by word
+        several = pending[keys.iloc[pending].str.count(' ').to_numpy() > 0]
+        found = self._token_matches(keys.iloc[several])
+        entries[several[found >= 0]] = found[found >= 0]
+        tiers[several[found >= 0]] = 'token'
+
+        canonical = np.array(self.names + [NO_DOCTOR], dtype=object)
+        names = canonical[np.where(entries >= 0, entries, len(self.names))]
+        new = pending[entries[pending] < 0]
+        names[new] = keys.iloc[new].to_numpy()
+        tiers[new] = 'new'
+        for key, name in zip(keys.iloc[pending], names[pending]):
+            self.learned.setdefault(key, name)
+
+        names = np.append(names, NO_DOCTOR)[codes]
+        tiers = np.append(tiers, None)[codes]
+        return (pd.Series(names, index=cleaned.index, dtype=object),
+                pd.Series(tiers, index=cleaned.index, dtype=object))
+
+    def merge(self, other):
+        """
+        Add the spellings another copy of this dictionary learned (one sent
+        to a worker process, say) that this one lacks.
+        """
+        for key, name in other.learned.items():
+            if key not in self.aliases:
+                self.learned.setdefault(key, name)
+        return self
+
+    def rows(self):
+        """{alias key: canonical name} of every spelling, learned ones included."""
+        rows = {key: self.names[entry] for key, entry in self.aliases.items()}
+        rows.update(self.learned)
+        return rows
+
+    def digest(self):
+        """Digest of the (canonical, alias) rows save writes, in any order."""
+        digest = hashlib.sha256()
+        for key, name in sorted(self.rows().items()):
+            digest.update(f"{key}\t{name}\n".encode('utf-8'))
+        return digest.hexdigest()
+
+    # Persistence
+
+    @classmethod
+    def load(cls, path):
+        """The dictionary kept in ``path``; empty when the file does not exist yet."""
+        dictionary = cls(path)
+        if path is None or not os.path.exists(path):
+            return dictionary
+        table = pd.read_csv(path, dtype=str, keep_default_na=False, encoding='utf-8')
+        if not set(DICTIONARY_COLUMNS) <= set(table.columns):
+            raise ValueError(f"{path}: a doctor dictionary needs the columns {', '.join(DICTIONARY_COLUMNS)}")
+        table = table[table['canonical'].str.strip() != '']
+        canonical = table['canonical'].str.strip().drop_duplicates()
+        entries = pd.Series(dictionary._add(canonical), index=canonical.to_numpy())
+        aliases = doctor_keys(display_names(table['alias']))
+        for key, name in zip(aliases, table['canonical'].str.strip()):
+            if key:
+                dictionary.aliases.setdefault(key, int(entries[name]))
+        return dictionary
+
+    def save(self, path=None):
+        """
+        Write the dictionary as (canonical, alias) rows, one per spelling,
+        the learned ones included. They are looked up from the next load.
+        """
+        path = path or self.path
+        rows = self.rows()
+        table = pd.DataFrame({'canonical': list(rows.values()), 'alias': list(rows)},
+                             columns=DICTIONARY_COLUMNS)
+        table = table.sort_values(DICTIONARY_COLUMNS, kind='stable')
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        table.to_csv(tmp_path, index=False, encoding='utf-8')
+        os.replace(tmp_path, path)
+        self._saved = len(self.learned)
+        return path
+
+
+def format_tiers(tiers):
+    """'exact 120, token 14, new 2' from a Series of tiers."""
+    counts = Counter(tiers.dropna())
+    return ", ".join(f"{tier} {counts[tier]}" for tier in MATCH_TIERS if counts[tier])
@@ -0,0 +1,56 @@
+"""
+Opt-in Arrow-backed column dtypes.
+
+By default the inputs are read with dtype=str and the stages add object
+columns of Python strings, one Python object per cell. In Arrow mode every
+text column is held as an Arrow string array (one buffer per column) from
+the read onwards, columns added by the stages are converted as soon as the
+stage returns, and the low-cardinality output columns become categoricals.
+"""
+import numpy as np
+import pandas as pd
+
+from .refstore import have_pyarrow
+
+# Output columns with few distinct values, stored as categoricals
+CATEGORY_COLUMNS = ['BU', 'BU 2', 'Product Type', 'DOCTOR']
+
+
+def arrow_string_dtype():
+    """
+    Arrow string dtype with NaN as missing value, so comparisons and masks
+    behave as on object columns (a plain string[pyarrow] column propagates
+    pd.NA through ``==`` and changes which rows a mask selects).
+    """
+    if not have_pyarrow():
+        raise ValueError("Arrow strings need pyarrow (pip install pyarrow)")
+    try:
+        return pd.StringDtype('pyarrow', na_value=np.nan)
+    except TypeError:  # pandas < 2.3
+        return pd.StringDtype('pyarrow_numpy')
+
+
+def _is_text(series):
+    return series.dtype == object or isinstance(series.dtype, pd.StringDtype)
+
+
+def to_arrow_strings(df, dtype):
+    """Convert the object and non-Arrow string columns of ``df`` to ``dtype``, in place."""
+    for column in df.columns:
+        series = df[column]
+        if series.dtype != dtype and _is_text(series):
+            df[column] = series.astype(dtype)
+    return df
+
+
+def categorize(df, columns=CATEGORY_COLUMNS):
+    """Store ``columns`` of ``df`` (those present) as categoricals, in place."""
+    for column in columns:
+        if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+    return df
+
+
+def frame_memory_mb(df):
+    """Memory held by ``df``, Python string objects included."""
+    return df.memory_usage(deep=True).sum() / 2**20
@@ -0,0 +1,147 @@
+"""
+Writing the processed frame as CSV, Parquet or Excel.
+
+Every writer streams the frame to disk a slice at a time and takes the
+output column order as an argument, so neither the whole file nor a
+reordered copy of the frame is ever held in memory. ``export_to_tempfile``
+is what the app serves its download from.
+"""
+import os
+import tempfile
+
+from .refstore import have_pyarrow
+
+FORMATS = ('csv', 'parquet', 'xlsx')
+
+OUTPUT_ENCODING = 'utf-8-sig'
+
+# Columns moved to the end of the output, in this order
+LAST_COLUMNS = ['SAPNotes']
+
+# Rows written per slice
+EXPORT_CHUNK_ROWS = 50_000
+
+# Rows an Excel sheet holds, header included
+XLSX_MAX_ROWS = 1_048_576
+
+MIME_TYPES = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def export_columns(columns):
+    """Output order of ``columns``: as they are, with LAST_COLUMNS moved to the end."""
+    columns = list(columns)
+    last = [column for column in LAST_COLUMNS if column in columns]
+    return [column for column in columns if column not in last] + last
+
+
+def export_format(path):
+    """Format written for ``path``, from its extension (CSV by default)."""
+    extension = os.path.splitext(str(path))[1].lower().lstrip('.')
+    return extension if extension in FORMATS else 'csv'
+
+
+def _slices(df, rows=EXPORT_CHUNK_ROWS):
+    for start in range(0, len(df), rows):
+        yield df.iloc[start:start + rows]
+
+
+def write_csv(df, output, header=True):
+    """Write ``df`` as CSV to a path or to a text file opened with OUTPUT_ENCODING."""
+    if isinstance(output, (str, os.PathLike)):
+        with open(output, 'w', encoding=OUTPUT_ENCODING, newline='') as f:
+            write_csv(df, f, header)
+        return
+    df.to_csv(output, index=False, header=header, columns=export_columns(df.columns),
+              chunksize=EXPORT_CHUNK_ROWS)
+
+
+def write_parquet(df, path):
+    """Write ``df`` as Parquet, one row group per slice."""
+    if not have_pyarrow():
+        raise ValueError("Parquet output needs pyarrow (pip install pyarrow)")
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    columns = export_columns(df.columns)
+    # Taken from the whole frame so that a slice of empty cells keeps its column type
+    inferred = pa.Schema.from_pandas(df, preserve_index=False)
+    schema = pa.schema([inferred.field(column) for column in columns])
+    with pq.ParquetWriter(path, schema) as writer:
+        for part in _slices(df):
+            writer.write_table(pa.Table.from_pandas(part, schema=schema, preserve_index=False))
+
+
+def have_xlsxwriter():
+    try:
+        import xlsxwriter  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _xlsx_rows(df, columns):
+    """Rows of ``df`` in ``columns`` order as tuples, None for empty cells."""
+    for part in _slices(df):
+        part = part[columns].astype(object)
+        yield from part.where(part.notna(), None).itertuples(index=False, name=None)
+
+
+def write_xlsx(df, path):
+    """
+    Write ``df`` as an Excel workbook in constant memory: with XlsxWriter's
+    constant_memory mode when it is installed (faster),
+    otherwise with openpyxl's write-only mode.
+    """
+    if len(df) + 1 > XLSX_MAX_ROWS:
+        raise ValueError(f"{len(df)} rows do not fit in an Excel sheet "
+                         f"({XLSX_MAX_ROWS - 1} at most); export CSV or Parquet instead")
+    columns = export_columns(df.columns)
+    if have_xlsxwriter():
+        import xlsxwriter
+        # Cells are written as text: no formulas or links made out of notes starting with '=' or 'http'
+        options = {'constant_memory': True, 'strings_to_formulas': False, 'strings_to_urls': False}
+        with xlsxwriter.Workbook(path, options) as workbook:
+            sheet = workbook.add_worksheet("Processed")
+            sheet.write_row(0, 0, columns)
+            for number, row in enumerate(_xlsx_rows(df, columns), start=1):
+                sheet.write_row(number, 0, row)
+        return
+
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Processed")
+    sheet.append(columns)
+    for row in _xlsx_rows(df, columns):
+        sheet.append(row)
+    workbook.save(path)
+
+
+WRITERS = {
+    'csv': write_csv,
+    'parquet': write_parquet,
+    'xlsx': write_xlsx,
+}
+
+
+def export(df, path, format=None):
+    """Write ``df`` to ``path`` as ``format`` (taken from the extension when None)."""
+    format = format or export_format(path)
+    if format not in WRITERS:
+        raise ValueError(f"Unknown output format: {format}")
+    WRITERS[format](df, path)
+    return path
+
+
+def export_to_tempfile(df, format='csv'):
+    """Write ``df`` to a new temporary file and return its path; the caller removes it."""
+    fd, path = tempfile.mkstemp(prefix='processed_base_file_', suffix=f'.{format}')
+    os.close(fd)
+    try:
+        return export(df, path, format)
+    except BaseException:
+        os.remove(path)
+        raise
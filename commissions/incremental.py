@@ -0,0 +1,175 @@
+"""
+State kept between monthly runs for incremental reprocessing.
+
+Each month's Base file is mostly last month's rows plus new invoices.
+IncrementalState stores the processed rows of the last run, keyed by
+(IDBillDoc, IDBillDocItem), together with a hash of everything the row's
+output depends on: its own Base values and the reference entries it looks
+up (SAP DATA and SAP Notes by IDOrder, MasterDataES by IDBillDoc and
+IDBillDocItem, INCIDENCIAS and FACTURAS by IDBillDoc, FOCUS by IDMaterial,
+SAMES by the NHC of the last run, through the same NHC tiers). Rows
+whose hash is unchanged are taken from the state; only the others go
+through the pipeline (see pipeline.run_pipeline_incremental), along with
+the rows whose note date was rejected for being in the future and has
+passed since. A state is only reused with the doctor dictionary it was
+saved with.
+"""
+import json
+import os
+import time
+from dataclasses import dataclass, fields
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from .dates import DATE_FORMAT
+from .joins import KeyIndex
+from .nhc_index import DEFAULT_MAX_EDITS, NHCIndex
+from .notes import FUTURE_DATE
+from .patterns import NOTE_PATTERNS
+from .refstore import have_pyarrow
+from .stages import DUPLICATE_KEY_POLICY
+
+# Bump when a change to the stages alters their output, to drop old states
+STATE_VERSION = 7
+
+KEY_COLUMNS = ['IDBillDoc', 'IDBillDocItem']
+
+# Helper columns stored next to the output columns
+ROW_KEY = '_row_key'
+INPUT_HASH = '_input_hash'
+
+# Reference lookups each row depends on: (input, Base column(s) it is looked up by)
+ROW_DEPENDENCIES = [
+    ('po', 'IDOrder'),
+    ('master_data', KEY_COLUMNS),
+    ('sap_notes', 'IDOrder'),
+    ('incidencias', 'IDBillDoc'),
+    ('facturas', 'IDBillDoc'),
+    ('focus', 'IDMaterial'),
+]
+
+
+@dataclass
+class IncrementalStats:
+    """What an incremental run reused and recomputed."""
+    rows: int = 0
+    reused: int = 0
+    changed: int = 0
+    new: int = 0
+    dropped: int = 0
+
+    @property
+    def recomputed(self):
+        return self.changed + self.new
+
+    def summary(self):
+        return ", ".join(f"{getattr(self, f.name)} {f.name}" for f in fields(self))
+
+
+def row_keys(base_df):
+    """
+    'IDBillDoc|IDBillDocItem|n' for every Base row, n numbering the rows that
+    share the same pair so that repeated keys stay distinct.
+    """
+    keys = base_df[KEY_COLUMNS].astype(object).fillna('').astype(str)
+    pair = keys[KEY_COLUMNS[0]] + '|' + keys[KEY_COLUMNS[1]]
+    occurrence = pair.groupby(pair, sort=False).cumcount().astype(str)
+    return (pair + '|' + occurrence).astype(object)
+
+
+def _lookup(reference, values, **kwargs):
+    """Values ``reference`` (a KeyIndex or NHCIndex) holds for ``values``; None when not indexed."""
+    if not isinstance(reference, (KeyIndex, NHCIndex)):
+        return pd.Series(None, index=values.index, dtype=object)
+    return reference.lookup_many(values, **kwargs)
+
+
+def input_hashes(base_df, references, nhc, max_edits=DEFAULT_MAX_EDITS):
+    """
+    uint64 hash per Base row of its values and of the reference entries it
+    looks up; ``nhc`` is the NHC each row had in the last run (for SAMES,
+    matched with up to ``max_edits`` edits like the stage does).
+    """
+    parts = [base_df.astype(object)]
+    for name, column in ROW_DEPENDENCIES:
+        found = _lookup(getattr(references, name), base_df[column])
+        parts.append(pd.DataFrame(found).add_prefix(f"{name}:"))
+    sames = _lookup(references.sames, nhc, max_edits=max_edits)
+    parts.append(pd.DataFrame(sames).add_prefix("sames:"))
+    deps = pd.concat(parts, axis=1)
+    deps.columns = range(deps.shape[1])
+    return pd.util.hash_pandas_object(deps.astype(object), index=False).to_numpy(copy=True)
+
+
+def expired_rows(previous):
+    """Rows of a stored state whose rejected future note date is today or earlier."""
+    if FUTURE_DATE not in previous.columns:
+        return np.zeros(len(previous), dtype=bool)
+    future = pd.to_datetime(previous[FUTURE_DATE], format=DATE_FORMAT, errors='coerce')
+    return (future <= pd.Timestamp(date.today())).to_numpy()
+
+
+class IncrementalState:
+    """Processed rows of the last run, stored as Feather in ``directory``."""
+
+    def __init__(self, directory):
+        if not have_pyarrow():
+            raise ValueError("Incremental mode needs pyarrow (pip install pyarrow)")
+        self.directory = directory
+        self.data_path = os.path.join(directory, 'state.feather')
+        self.meta_path = os.path.join(directory, 'state.json')
+
+    @staticmethod
+    def fingerprint(base_columns, nhc_max_edits=DEFAULT_MAX_EDITS, doctors=None):
+        """
+        Settings a stored state is only valid for. ``doctors`` is the doctor
+        dictionary; one without a file starts empty on every run.
+        """
+        return {
+            'version': STATE_VERSION,
+            'base_columns': list(base_columns),
+            'patterns': {name: family.sources for name, family in NOTE_PATTERNS.items()},
+            'duplicate_keys': DUPLICATE_KEY_POLICY,
+            'nhc_max_edits': nhc_max_edits,
+            'doctors': doctors.digest() if doctors is not None and doctors.path else None,
+        }
+
+    def load(self, base_columns, nhc_max_edits=DEFAULT_MAX_EDITS, doctors=None):
+        """
+        The stored rows, or None when there is no state or it was built for
+        other Base columns, patterns, NHC matching, doctor dictionary or
+        stage version.
+        """
+        if not (os.path.exists(self.data_path) and os.path.exists(self.meta_path)):
+            return None
+        try:
+            with open(self.meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('fingerprint') != self.fingerprint(base_columns, nhc_max_edits, doctors):
+            return None
+        return pd.read_feather(self.data_path)
+
+    def save(self, output_df, keys, hashes, base_columns, nhc_max_edits=DEFAULT_MAX_EDITS, doctors=None):
+        os.makedirs(self.directory, exist_ok=True)
+        state = output_df.reset_index(drop=True)
+        state[ROW_KEY] = keys.to_numpy()
+        state[INPUT_HASH] = hashes
+        tmp_path = f"{self.data_path}.tmp"
+        state.to_feather(tmp_path, compression='uncompressed')
+        os.replace(tmp_path, self.data_path)
+        meta = {'fingerprint': self.fingerprint(base_columns, nhc_max_edits, doctors), 'rows': len(state),
+                'saved': time.time()}
+        with open(self.meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+
+    @staticmethod
+    def match(previous, keys):
+        """Position in ``previous`` of the row with each key, -1 for new rows."""
+        if previous is None:
+            return np.full(len(keys), -1)
+        index = KeyIndex(previous, ROW_KEY, ROW_KEY)
+        return index.positions(keys)
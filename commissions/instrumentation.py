@@ -0,0 +1,173 @@
+"""
+Per-stage timing and memory of a pipeline run.
+
+Every stage (file reads, enrichment stages, export) runs inside
+RunReport.measure, which records wall time, CPU time, the growth of the
+peak RSS, the memory of the frame a stage returns and the rows going in
+and out. The report is shown as a table in the app and written as JSON by
+the command line.
+"""
+import json
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PROFILERS = ('cprofile', 'pyinstrument')
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far, None where unknown."""
+    if resource is None:
+        return None
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def have_pyinstrument():
+    try:
+        import pyinstrument  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+@dataclass
+class StageTiming:
+    """Measurements of one stage; repeated stages (chunks) are summed."""
+    stage: str
+    wall_s: float = 0.0
+    cpu_s: float = 0.0
+    peak_rss_delta_mb: float = None
+    # Memory held by the frame the stage returned (largest one over chunks)
+    frame_mb: float = None
+    rows_in: int = None
+    rows_out: int = None
+    calls: int = 0
+
+    def add(self, other):
+        self.wall_s += other.wall_s
+        self.cpu_s += other.cpu_s
+        for name in ('peak_rss_delta_mb', 'rows_in', 'rows_out'):
+            mine, theirs = getattr(self, name), getattr(other, name)
+            if theirs is not None:
+                setattr(self, name, theirs if mine is None else mine + theirs)
+        if other.frame_mb is not None:
+            self.frame_mb = max(self.frame_mb or 0.0, other.frame_mb)
+        self.calls += other.calls
+
+
+@dataclass
+class RunReport:
+    """Ordered StageTiming of a run."""
+    stages: dict = field(default_factory=dict)
+    started: float = field(default_factory=time.time)
+
+    @contextmanager
+    def measure(self, stage, rows_in=None):
+        """
+        Time the block as ``stage``. Set ``rows_out`` on the yielded
+        StageTiming to record the rows the stage produced.
+        """
+        timing = StageTiming(stage, rows_in=rows_in, calls=1)
+        rss_before = peak_rss_mb()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield timing
+        finally:
+            timing.wall_s = time.perf_counter() - wall
+            timing.cpu_s = time.process_time() - cpu
+            if rss_before is not None:
+                timing.peak_rss_delta_mb = peak_rss_mb() - rss_before
+            self.add(timing)
+
+    def add(self, timing):
+        if timing.stage in self.stages:
+            self.stages[timing.stage].add(timing)
+        else:
+            self.stages[timing.stage] = timing
+
+    @property
+    def wall_s(self):
+        return sum(timing.wall_s for timing in self.stages.values())
+
+    def to_frame(self):
+        return pd.DataFrame([asdict(timing) for timing in self.stages.values()],
+                            columns=[f for f in StageTiming.__dataclass_fields__])
+
+    def to_dict(self):
+        return {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'wall_s': self.wall_s,
+            'peak_rss_mb': peak_rss_mb(),
+            'stages': [asdict(timing) for timing in self.stages.values()],
+        }
+
+    def write_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def summary(self):
+        """Plain text table, one line per stage."""
+        lines = [f"{'stage':<18} {'wall s':>8} {'cpu s':>8} {'rss +MB':>8} {'frame MB':>9} {'rows':>9}"]
+        for timing in self.stages.values():
+            rss = '' if timing.peak_rss_delta_mb is None else f"{timing.peak_rss_delta_mb:.1f}"
+            frame = '' if timing.frame_mb is None else f"{timing.frame_mb:.1f}"
+            rows = '' if timing.rows_out is None else timing.rows_out
+            lines.append(f"{timing.stage:<18} {timing.wall_s:>8.2f} {timing.cpu_s:>8.2f} {rss:>8} "
+                         f"{frame:>9} {rows:>9}")
+        return "\n".join(lines)
+
+
+@dataclass
+class NoteProfiler:
+    """Profiles the SAP Notes extraction with cProfile or pyinstrument."""
+    kind: str = 'cprofile'
+    output: str = None
+
+    def __post_init__(self):
+        if self.kind not in PROFILERS:
+            raise ValueError(f"Unknown profiler: {self.kind}")
+        if self.kind == 'pyinstrument' and not have_pyinstrument():
+            raise ValueError("pyinstrument is not installed (pip install pyinstrument)")
+        if self.output is None:
+            self.output = 'notes_profile.prof' if self.kind == 'cprofile' else 'notes_profile.html'
+
+    @contextmanager
+    def profile(self):
+        if self.kind == 'cprofile':
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                profiler.dump_stats(self.output)
+            return
+
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(self.output, 'w', encoding='utf-8') as f:
+                f.write(profiler.output_html())
+
+
+@contextmanager
+def profiling(profiler):
+    """Run the block under ``profiler`` (a NoteProfiler), or as is when None."""
+    if profiler is None:
+        yield
+    else:
+        with profiler.profile():
+            yield
@@ -0,0 +1,101 @@
+"""
+Loading of the CSV / Excel input files.
+
+Works the same for Streamlit uploads (file-like objects with a ``name``)
+and for plain paths given on the command line.
+"""
+import hashlib
+import io
+import os
+
+import pandas as pd
+
+# Encodings tried in order when reading CSV files
+CSV_ENCODINGS = ['utf-8']  # , 'latin1', 'cp1252', 'ISO-8859-1'
+
+
+class InputFileError(Exception):
+    """Raised when an input file cannot be read."""
+
+
+def file_name(source):
+    """Return the file name of an upload or a path."""
+    name = getattr(source, 'name', None)
+    if name is None:
+        name = os.fspath(source)
+    return os.path.basename(str(name))
+
+
+def read_error(name, error):
+    """InputFileError for file ``name``, worded by its type as read_file words it."""
+    kind = 'Excel' if name.endswith(('xlsx', 'xls')) else 'CSV'
+    return InputFileError(f"Error reading {kind} file {name}: {error}")
+
+
+def read_file(source, dtype=str):
+    """
+    Read a CSV or Excel file with every column as string (``dtype``, e.g. an
+    Arrow string dtype, instead of str when given).
+    Returns None when no file is given, raises InputFileError on failure.
+    """
+    if source is None:
+        return None
+
+    name = file_name(source)
+    if name.endswith('csv'):
+        for encoding in CSV_ENCODINGS:
+            try:
+                if hasattr(source, 'seek'):
+                    source.seek(0)
+                return pd.read_csv(source, encoding=encoding, dtype=dtype)
+            except UnicodeDecodeError:
+                continue
+            except Exception as e:
+                raise read_error(name, e) from e
+        raise InputFileError(f"Could not decode file {name} with any of the attempted encodings")
+
+    if name.endswith(('xlsx', 'xls')):
+        try:
+            if hasattr(source, 'seek'):
+                source.seek(0)
+            # Single pass over the workbook, every column as str
+            return pd.read_excel(source, dtype=dtype)
+        except Exception as e:
+            raise read_error(name, e) from e
+
+    raise InputFileError(f"Unsupported file type: {name}")
+
+
+def read_chunks(source, chunksize, dtype=str):
+    """
+    Yield the rows of a CSV or Excel file as DataFrames of at most
+    ``chunksize`` rows, every column as string. CSV files are streamed;
+    Excel workbooks cannot be read in parts, so they are read whole and split.
+    """
+    name = file_name(source)
+    if not name.endswith('csv'):
+        df = read_file(source, dtype)
+        for start in range(0, len(df), chunksize):
+            yield df.iloc[start:start + chunksize].copy()
+        return
+
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    try:
+        reader = pd.read_csv(source, encoding=CSV_ENCODINGS[0], dtype=dtype, chunksize=chunksize)
+        with reader:
+            yield from reader
+    except (UnicodeDecodeError, pd.errors.ParserError) as e:
+        raise read_error(name, e) from e
+
+
+def content_hash(data):
+    """Hex digest identifying the content of an input file."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def read_bytes(data, name):
+    """Read file content held in memory; ``name`` decides CSV or Excel."""
+    buffer = io.BytesIO(data)
+    buffer.name = name
+    return read_file(buffer)
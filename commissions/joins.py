@@ -0,0 +1,189 @@
+"""
+Indexed lookups of Base keys into the reference tables.
+
+A KeyIndex is built once per reference table: its key column is normalized
+(e.g. zero-padded document numbers), duplicate keys are resolved with an
+explicit policy and the remaining rows are indexed by a hashed pandas Index.
+Lookups factorize the Base key column, so the normalization and the hash
+probe run once per distinct key instead of once per row.
+
+A key of several columns (e.g. IDBillDoc and IDBillDocItem) is indexed as
+a MultiIndex. Each key column of a lookup is factorized and normalized on
+its own, and the pair of level codes is probed as one integer, so no
+composite string is ever built.
+"""
+import numpy as np
+import pandas as pd
+
+# Width of the zero-padded SAP document / material numbers
+DOC_NUMBER_WIDTH = 10
+
+DUPLICATE_POLICIES = ('last', 'first', 'error')
+
+
+class DuplicateKeyError(ValueError):
+    """Raised when a reference table has duplicate keys under policy 'error'."""
+
+
+def doc_number_key(values, width=DOC_NUMBER_WIDTH):
+    """Normalize SAP document numbers: strip and left-pad with zeros."""
+    values = pd.Series(values, dtype=object)
+    keys = values.astype(str).str.strip().str.zfill(width)
+    return keys.where(values.notna())
+
+
+def raw_key(values):
+    """Use the key values as they are."""
+    return pd.Series(values, dtype=object)
+
+
+def _key_text(key):
+    """A key as shown in messages; composite keys as 'doc / item'."""
+    return ' / '.join(map(str, key)) if isinstance(key, tuple) else str(key)
+
+
+def _factorized(values):
+    """pd.factorize of ``values``; Series are factorized in their own dtype (no object copy)."""
+    return pd.factorize(values if isinstance(values, pd.Series) else pd.Series(values, dtype=object))
+
+
+def _level(values, normalize):
+    """
+    (level, codes) of ``values`` keyed with ``normalize``: the distinct
+    normalized keys and the position of each value in them, -1 where missing.
+    ``normalize`` runs once per distinct value.
+    """
+    codes, uniques = _factorized(values)
+    level_codes, level = pd.factorize(normalize(uniques).to_numpy(dtype=object))
+    level_codes = np.append(level_codes, -1)
+    return pd.Index(level, dtype=object), level_codes[codes]
+
+
+def _codes(level, values, normalize):
+    """Code of each of ``values`` (a Series) in ``level``, -1 when missing or not found."""
+    codes, uniques = _factorized(values)
+    if not len(uniques):
+        return np.full(len(codes), -1)
+    found = level.get_indexer(normalize(uniques).to_numpy(dtype=object))
+    return np.where(codes >= 0, found[codes], -1)
+
+
+class KeyIndex:
+    """
+    Hashed index of a reference table on one key column, or on several
+    (``key`` a list of columns, each normalized with ``normalize``).
+
+    ``duplicates`` decides which row a repeated key resolves to: 'last' (the
+    behaviour of the old dict(zip(...)) mappings), 'first', or 'error'.
+    """
+
+    def __init__(self, table, key, columns, normalize=raw_key, duplicates='last', name=None):
+        if duplicates not in DUPLICATE_POLICIES:
+            raise ValueError(f"Unknown duplicate key policy: {duplicates}")
+        composite = not isinstance(key, str)
+        self.name = name or (' + '.join(key) if composite else key)
+        self.normalize = normalize
+        if isinstance(columns, str):
+            columns = [columns]
+        self.columns = list(columns)
+
+        levels, codes = zip(*(_level(table[column], normalize) for column in (key if composite else [key])))
+        present = np.logical_and.reduce([c >= 0 for c in codes])
+        if composite:
+            # Built from the codes at hand: from_arrays would factorize every column again
+            keys = pd.MultiIndex(levels=levels, codes=[c[present] for c in codes], names=list(key),
+                                 verify_integrity=False)
+        else:
+            keys = pd.Index(levels[0].to_numpy(dtype=object)[codes[0][present]], dtype=object)
+        positions = np.flatnonzero(present)
+        duplicated = keys.duplicated(keep=False)
+        self.duplicate_keys = len(keys[duplicated].unique())
+        self.duplicate_rows = int(duplicated.sum())
+        if self.duplicate_keys and duplicates == 'error':
+            sample = ', '.join(map(_key_text, keys[duplicated].unique()[:5]))
+            columns = ' + '.join(key) if composite else key
+            raise DuplicateKeyError(
+                f"{self.name}: {self.duplicate_keys} duplicate keys in '{columns}' ({sample})")
+
+        keep = ~keys.duplicated(keep='first' if duplicates == 'first' else 'last')
+        rows = table[self.columns].iloc[positions[keep]]
+        self.index = keys[keep]
+        if composite:
+            # MultiIndex.levels gives new views on every access, which would
+            # rebuild the hash table of each level on every lookup
+            self._levels = list(levels)
+            # Level codes of each key combined into one integer, probed by positions()
+            self._combined = pd.Index(self._combine(self.index.codes))
+        # Values with a trailing missing entry that unmatched keys point to
+        self._values = {col: np.append(rows[col].to_numpy(dtype=object), None) for col in self.columns}
+
+    def __len__(self):
+        return len(self.index)
+
+    def describe_duplicates(self):
+        """Message about the duplicate keys found, or None."""
+        if not self.duplicate_keys:
+            return None
+        return (f"{self.name}: {self.duplicate_keys} keys appear on more than one row "
+                f"({self.duplicate_rows} rows), one row kept per key")
+
+    def _combine(self, codes):
+        """One int64 per row from the level codes of each key column; -1 where any is -1."""
+        combined = np.zeros(len(codes[0]), dtype=np.int64)
+        for level, level_codes in zip(self._levels, codes):
+            combined = combined * len(level) + level_codes
+        return np.where(np.logical_and.reduce([c >= 0 for c in codes]), combined, -1)
+
+    def positions(self, values):
+        """
+        Row position of each value in the index, -1 when not found. A
+        composite index takes a DataFrame of its key columns, in key order.
+        """
+        if isinstance(self.index, pd.MultiIndex):
+            codes = [_codes(level, values.iloc[:, i], self.normalize)
+                     for i, level in enumerate(self._levels)]
+            combined = self._combine(codes)
+            found = self._combined.get_indexer(combined)
+            return np.where(combined >= 0, found, -1)
+        # Missing base keys get code -1 and stay unmatched
+        return _codes(self.index, values, self.normalize)
+
+    def covered(self, values):
+        """
+        Whether the first key column of each row of ``values`` (as for
+        positions) is in the index at all, whatever the other key columns.
+        """
+        if isinstance(self.index, pd.MultiIndex):
+            codes = _codes(self._levels[0], values.iloc[:, 0], self.normalize)
+            return codes >= 0
+        return self.positions(values) >= 0
+
+    def rows(self, key='key'):
+        """
+        The indexed rows as a DataFrame: the normalized key as ``key`` (one
+        column per key column, as named in the table, for a composite
+        index), then the columns.
+        """
+        frame = pd.DataFrame({col: values[:-1] for col, values in self._values.items()}, dtype=object)
+        if isinstance(self.index, pd.MultiIndex):
+            for i, name in enumerate(self.index.names):
+                frame.insert(i, name, self.index.get_level_values(i).to_numpy(dtype=object))
+        else:
+            frame.insert(0, key, self.index.to_numpy(dtype=object))
+        return frame
+
+    def lookup(self, values, column=None):
+        """
+        Look up ``values`` (a Series of raw keys, or a DataFrame of them for
+        a composite index) and return the matching ``column`` as a Series
+        aligned on ``values``; None where not found.
+        """
+        column = column or self.columns[0]
+        positions = self.positions(values)
+        return pd.Series(self._values[column][positions], index=values.index, dtype=object)
+
+    def lookup_many(self, values):
+        """Like lookup, for every indexed column at once; returns a DataFrame."""
+        positions = self.positions(values)
+        return pd.DataFrame({col: self._values[col][positions] for col in self.columns},
+                            index=values.index, dtype=object)
@@ -0,0 +1,393 @@
+"""
+Local database of the reference (master data) files.
+
+SAMES, SAP DATA (PO), FACTURAS COMISIONADAS, PRODUCTOS FOCUS and
+MasterDataES change a little from one month to the next but used to be
+uploaded and parsed whole on every run. MasterDataStore keeps them in one SQLite file instead:
+
+- loading a file upserts its rows by key: new keys are inserted, rows whose
+  values changed are updated, the rest is left alone. Every row remembers
+  the file (source) that last held it, and a file loaded again under the
+  same name replaces that source: its rows the new file no longer holds
+  are deleted, while the rows of other files stay. Each load gets a
+  version number, stamped on the rows it inserted or changed and recorded
+  with its counts in the ``versions`` table;
+- every table keeps its lookup key normalized as the stages match it (zero
+  padded document numbers, NHCs as written) in an indexed ``_key`` column;
+- a run reads the rows of the keys its Base file looks up with a join
+  against a temporary table of those keys, so its cost follows the Base
+  rather than the size of the master data. SAMES is read whole: its
+  normalized and fuzzy NHC tiers compare against every entry.
+
+The tables come back as the frames read_file gives, every column as text,
+so the stages index them as if the files had been uploaded.
+
+    python -m commissions.masterdata status master.sqlite
+    python -m commissions.masterdata load master.sqlite sames sames_2025_06.xlsx
+"""
+import argparse
+import contextlib
+import dataclasses
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+
+import pandas as pd
+
+from .io import InputFileError, file_name, read_file
+from .joins import doc_number_key, raw_key
+from .pipeline import INPUT_LABELS
+from .reporting import ConsoleReporter
+from .stages import find_master_data_columns
+
+# Database used when none is given, if set
+DATABASE_ENV = 'COMMISSIONS_MASTER_DATA'
+
+# Bookkeeping columns of every table, before the columns of the file
+ID_COLUMN = '_id'
+KEY_COLUMN = '_key'
+VERSION_COLUMN = '_version'
+SOURCE_COLUMN = '_source'
+BOOKKEEPING_COLUMNS = (ID_COLUMN, KEY_COLUMN, VERSION_COLUMN, SOURCE_COLUMN)
+
+# Separates the parts of composite keys and row ids
+KEY_SEPARATOR = '\x1f'
+
+
+@dataclasses.dataclass(frozen=True)
+class MasterTable:
+    """How one reference input is kept in the database."""
+    # Columns the stages look rows up by, normalized with ``normalize``
+    keys: tuple
+    normalize: object = doc_number_key
+    # Further columns that, with the key, tell apart rows of the same key
+    # (None: one row per key, the last one of a file)
+    identity: tuple = None
+    # Base columns holding the keys looked up; None reads the whole table
+    base_keys: tuple = None
+    # Function giving the columns of a file that hold ``keys``, None where
+    # one is not found, for files whose column names vary
+    find_keys: object = None
+
+    def key_columns(self, df):
+        return tuple(self.find_keys(df)) if self.find_keys is not None else self.keys
+
+
+def _master_data_keys(df):
+    return find_master_data_columns(df)[:2]
+
+
+# Reference inputs kept in the database, by PipelineInputs name
+TABLES = {
+    'sames': MasterTable(('Nº Historial Clínico',), normalize=raw_key),
+    'po': MasterTable(('SD Document',), base_keys=('IDOrder',)),
+    'facturas': MasterTable(('IDBillDoc',), identity=('CurrentCorrected_Name', 'PERIODO COMISION'),
+                            base_keys=('IDBillDoc',)),
+    'focus': MasterTable(('IDMaterial',), base_keys=('IDMaterial',)),
+    'master_data': MasterTable(('IDBillDoc', 'IDBillDocItem'), find_keys=_master_data_keys,
+                               base_keys=('IDBillDoc', 'IDBillDocItem')),
+}
+
+
+def default_database_path():
+    return os.environ.get(DATABASE_ENV) or None
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def table_keys(table, df, columns):
+    """Normalized lookup key of every row of ``df`` from its ``columns``, None where a part is missing."""
+    parts = [table.normalize(df[column].to_numpy(dtype=object)) for column in columns]
+    keys = parts[0].astype(object)
+    for part in parts[1:]:
+        keys = keys + KEY_SEPARATOR + part
+    keys.index = df.index
+    return keys.where(pd.concat(parts, axis=1).notna().all(axis=1).to_numpy(), None)
+
+
+def frame_digest(df):
+    """sha256 of the columns and values of ``df``."""
+    digest = hashlib.sha256('\n'.join(map(str, df.columns)).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df.astype(object), index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+@dataclasses.dataclass
+class LoadStats:
+    """What loading one file into the database changed."""
+    name: str
+    version: int = None
+    rows: int = 0
+    new: int = 0
+    updated: int = 0
+    deleted: int = 0
+    duplicates: int = 0
+    unchanged: bool = False
+
+    def summary(self):
+        label = INPUT_LABELS.get(self.name, self.name)
+        if self.unchanged:
+            return f"{label}: same file as version {self.version}, nothing to load"
+        return (f"{label}: version {self.version}, {self.rows} rows loaded "
+                f"({self.new} new, {self.updated} updated, {self.deleted} deleted)")
+
+
+class MasterDataStore:
+    """The reference tables kept in the SQLite file ``path``."""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS versions (name TEXT, version INTEGER, source TEXT, "
+                       "digest TEXT, rows INTEGER, new INTEGER, updated INTEGER, loaded_at REAL, "
+                       "deleted INTEGER, PRIMARY KEY (name, version))")
+            # Stores created before loads deleted rows
+            if 'deleted' not in [row[1] for row in db.execute("PRAGMA table_info(versions)")]:
+                db.execute("ALTER TABLE versions ADD COLUMN deleted INTEGER")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """A connection for one operation (Streamlit sessions run on several threads), committed on success."""
+        db = sqlite3.connect(self.path)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    @staticmethod
+    def _columns(db, name):
+        """File columns of table ``name``, in the order they were added; None when it does not exist."""
+        info = db.execute(f"PRAGMA table_info({_quote(name)})").fetchall()
+        if not info:
+            return None
+        return [row[1] for row in info if row[1] not in BOOKKEEPING_COLUMNS]
+
+    def versions(self, name=None):
+        """The loads recorded, latest first, as a DataFrame."""
+        query = "SELECT * FROM versions"
+        params = ()
+        if name is not None:
+            query += " WHERE name = ?"
+            params = (name,)
+        with self._connect() as db:
+            return pd.read_sql_query(query + " ORDER BY loaded_at DESC, name", db, params=params)
+
+    def load(self, name, df, source=None):
+        """
+        Upsert the rows of ``df`` (the file of input ``name``), delete the
+        rows the file ``source`` held before and no longer holds, and record
+        the load as a new version. A file identical to the one loaded last
+        is skipped. Returns LoadStats.
+        """
+        table = TABLES.get(name)
+        if table is None:
+            raise ValueError(f"{name} is not kept in the master data store")
+        label = INPUT_LABELS.get(name, name)
+        key_columns = table.key_columns(df)
+        missing = [key for key, column in zip(table.keys, key_columns) if column not in df.columns]
+        missing += [column for column in table.identity or () if column not in df.columns]
+        if missing:
+            raise ValueError(f"{label}: column {', '.join(map(repr, missing))} not found")
+
+        digest = frame_digest(df)
+        with self._connect() as db:
+            latest = db.execute("SELECT version, digest FROM versions WHERE name = ? "
+                                "ORDER BY version DESC LIMIT 1", (name,)).fetchone()
+        if latest is not None and latest[1] == digest:
+            return LoadStats(name, version=latest[0], rows=len(df), unchanged=True)
+
+        rows = df.astype(object)
+        rows = rows.where(rows.notna(), None)
+        keys = table_keys(table, df, key_columns)
+        rows = rows[keys.notna().to_numpy()]
+        keys = keys[keys.notna()]
+        if table.identity is None:
+            ids = keys
+        else:
+            # Rows repeated with the same identity stay apart, numbered in file order
+            identity = df.loc[keys.index, list(table.identity)].astype(object).fillna('').astype(str)
+            ids = keys.str.cat([identity[column] for column in table.identity], sep=KEY_SEPARATOR)
+            ids = ids + KEY_SEPARATOR + ids.groupby(ids, sort=False).cumcount().astype(str)
+        # One row per id, the last of the file, as the stages index them
+        last = ~ids.duplicated(keep='last').to_numpy()
+        stats = LoadStats(name, rows=int(last.sum()), duplicates=int((~last).sum()))
+        rows, keys, ids = rows[last], keys[last], ids[last]
+
+        columns = [str(column) for column in df.columns]
+        with self._connect() as db:
+            stats.version = (latest[0] if latest is not None else 0) + 1
+            existing = self._columns(db, name)
+            if existing is None:
+                definitions = ', '.join(f"{_quote(column)} TEXT" for column in columns)
+                db.execute(f"CREATE TABLE {_quote(name)} ({ID_COLUMN} TEXT PRIMARY KEY, {KEY_COLUMN} TEXT, "
+                           f"{VERSION_COLUMN} INTEGER, {SOURCE_COLUMN} TEXT, {definitions})")
+                db.execute(f"CREATE INDEX {_quote(name + '_key')} ON {_quote(name)} ({KEY_COLUMN})")
+                db.execute(f"CREATE INDEX {_quote(name + '_source')} ON {_quote(name)} ({SOURCE_COLUMN})")
+            else:
+                self._add_source_column(db, name)
+                for column in columns:
+                    if column not in existing:
+                        db.execute(f"ALTER TABLE {_quote(name)} ADD COLUMN {_quote(column)} TEXT")
+
+            quoted = [ID_COLUMN, KEY_COLUMN, VERSION_COLUMN] + [_quote(column) for column in columns]
+            db.execute("DROP TABLE IF EXISTS temp.staging")
+            db.execute(f"CREATE TEMP TABLE staging ({', '.join(quoted)})")
+            records = zip(ids, keys, [stats.version] * len(ids), *(rows[column] for column in df.columns))
+            db.executemany(f"INSERT INTO temp.staging VALUES ({', '.join('?' * len(quoted))})", records)
+
+            target = _quote(name)
+            same = ' AND '.join(f"{target}.{column} IS staging.{column}" for column in quoted[3:])
+            stats.new = db.execute(f"SELECT COUNT(*) FROM temp.staging WHERE {ID_COLUMN} NOT IN "
+                                   f"(SELECT {ID_COLUMN} FROM {target})").fetchone()[0]
+            stats.updated = db.execute(f"SELECT COUNT(*) FROM temp.staging JOIN {target} USING ({ID_COLUMN}) "
+                                       f"WHERE NOT ({same})").fetchone()[0]
+            changed = ' OR '.join(f"{target}.{column} IS NOT excluded.{column}" for column in quoted[3:])
+            assignments = ', '.join(f"{column} = excluded.{column}" for column in quoted[2:])
+            db.execute(f"INSERT INTO {target} ({', '.join(quoted)}) SELECT * FROM temp.staging WHERE true "
+                       f"ON CONFLICT ({ID_COLUMN}) DO UPDATE SET {assignments} WHERE {changed}")
+            # The file replaces what it held before; rows it shares with other files move to it
+            in_file = f"{ID_COLUMN} IN (SELECT {ID_COLUMN} FROM temp.staging)"
+            stats.deleted = db.execute(f"DELETE FROM {target} WHERE {SOURCE_COLUMN} IS ? AND NOT {in_file}",
+                                       (source,)).rowcount
+            db.execute(f"UPDATE {target} SET {SOURCE_COLUMN} = ? WHERE {in_file}", (source,))
+            db.execute("DROP TABLE temp.staging")
+            db.execute("INSERT INTO versions (name, version, source, digest, rows, new, updated, loaded_at, "
+                       "deleted) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                       (name, stats.version, source, digest, stats.rows, stats.new, stats.updated, time.time(),
+                        stats.deleted))
+        return stats
+
+    @staticmethod
+    def _add_source_column(db, name):
+        """
+        Add the source column to a table of a store created before it, each
+        row taking the file of the version that last wrote it.
+        """
+        if SOURCE_COLUMN in [row[1] for row in db.execute(f"PRAGMA table_info({_quote(name)})")]:
+            return
+        target = _quote(name)
+        db.execute(f"ALTER TABLE {target} ADD COLUMN {SOURCE_COLUMN} TEXT")
+        db.execute(f"UPDATE {target} SET {SOURCE_COLUMN} = (SELECT source FROM versions WHERE "
+                   f"versions.name = ? AND versions.version = {target}.{VERSION_COLUMN})", (name,))
+        db.execute(f"CREATE INDEX {_quote(name + '_source')} ON {target} ({SOURCE_COLUMN})")
+
+    def table(self, name, base_df=None):
+        """
+        Table ``name`` as a frame of text columns, in load order; None when
+        it was never loaded. With ``base_df``, only the rows of the keys its
+        Base columns look up.
+        """
+        table = TABLES[name]
+        with self._connect() as db:
+            columns = self._columns(db, name)
+            if columns is None:
+                return None
+            selected = ', '.join(f"{_quote(name)}.{_quote(column)}" for column in columns)
+            query = f"SELECT {selected} FROM {_quote(name)}"
+            if (base_df is not None and table.base_keys
+                    and all(column in base_df.columns for column in table.base_keys)):
+                # Normalized once per distinct key, not per Base row
+                wanted = base_df[list(table.base_keys)].drop_duplicates()
+                keys = table_keys(table, wanted, table.base_keys).dropna().unique()
+                db.execute("DROP TABLE IF EXISTS temp.wanted")
+                db.execute(f"CREATE TEMP TABLE wanted ({KEY_COLUMN} TEXT PRIMARY KEY)")
+                db.executemany("INSERT INTO temp.wanted VALUES (?)", ((key,) for key in keys))
+                query += f" JOIN temp.wanted USING ({KEY_COLUMN})"
+            rows = db.execute(query + f" ORDER BY {_quote(name)}.rowid").fetchall()
+            db.execute("DROP TABLE IF EXISTS temp.wanted")
+        # Missing values as None, as read_file gives them, whatever the pandas version
+        df = pd.DataFrame.from_records(rows, columns=columns).astype(object)
+        return df.where(df.notna(), None)
+
+    def refresh(self, inputs, reporter=None, report=None, sources=None):
+        """
+        Load every reference file of ``inputs`` into the database, recording
+        the file names of ``sources`` (keyed like ``inputs``) when given.
+        Returns [LoadStats].
+        """
+        reporter = reporter or ConsoleReporter()
+        sources = sources or {}
+        loaded = []
+        for name in TABLES:
+            df = getattr(inputs, name)
+            if df is None:
+                continue
+            source = file_name(sources[name]) if sources.get(name) is not None else None
+            if report is not None:
+                with report.measure(f"store {name}", rows_in=len(df)) as timing:
+                    stats = self.load(name, df, source)
+                    timing.rows_out = stats.rows
+            else:
+                stats = self.load(name, df, source)
+            reporter.success(stats.summary())
+            if stats.duplicates:
+                reporter.warning(f"{INPUT_LABELS[name]}: {stats.duplicates} rows repeat a key of a later "
+                                 f"row; the later one was stored")
+            loaded.append(stats)
+        return loaded
+
+    def inputs(self, inputs, base_df=None, reporter=None, report=None):
+        """
+        Copy of ``inputs`` with every reference input read from the database,
+        limited to the keys ``base_df`` looks up when given.
+        """
+        replaced = {}
+        for name in TABLES:
+            if report is not None:
+                with report.measure(f"query {name}") as timing:
+                    df = self.table(name, base_df)
+                    timing.rows_out = None if df is None else len(df)
+            else:
+                df = self.table(name, base_df)
+            if df is not None:
+                replaced[name] = df
+            elif reporter is not None and getattr(inputs, name) is None:
+                reporter.log(f"{INPUT_LABELS[name]}: not in the master data store")
+        return dataclasses.replace(inputs, **replaced)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m commissions.masterdata',
+                                     description="Inspect or load the master data store.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    status = sub.add_parser('status', help="Versions loaded into each table")
+    status.add_argument('database')
+    load = sub.add_parser('load', help="Upsert a reference file into its table")
+    load.add_argument('database')
+    load.add_argument('name', choices=list(TABLES))
+    load.add_argument('file')
+    args = parser.parse_args(argv)
+
+    store = MasterDataStore(args.database)
+    if args.command == 'load':
+        try:
+            stats = store.load(args.name, read_file(args.file), source=file_name(args.file))
+        except (InputFileError, ValueError) as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+        print(stats.summary())
+        return 0
+
+    versions = store.versions()
+    if versions.empty:
+        print("No master data loaded")
+        return 0
+    for name, group in versions.groupby('name', sort=False):
+        latest = group.iloc[0]
+        loaded_at = time.strftime('%Y-%m-%d %H:%M', time.localtime(latest['loaded_at']))
+        source = latest['source'] if pd.notna(latest['source']) else '-'
+        deleted = 0 if pd.isna(latest['deleted']) else int(latest['deleted'])
+        print(f"{name:10} version {latest['version']:<4} {loaded_at}  {source}  "
+              f"({latest['rows']} rows, {latest['new']} new, {latest['updated']} updated, {deleted} deleted)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,255 @@
+"""
+Index of the SAMES file by NHC (Nº Historial Clínico).
+
+NHCs copied into the SAP Notes or the PO number rarely look exactly like
+the SAMES ones: leading zeros, spaces, '1234 / 5678' slashes, letter
+prefixes. NHCIndex resolves each NHC through tiers, the first match wins:
+
+- exact: the value as written (the old dict lookup);
+- normalized: separators, a letter prefix and leading zeros removed;
+- fuzzy (off unless ``max_edits`` > 0): a normalized key within
+  ``max_edits`` insertions, deletions, substitutions or adjacent swaps,
+  accepted only when every SAMES entry that close gives the same value.
+
+Fuzzy candidates come from a symmetric-delete index (every key with up to
+``max_edits`` characters removed, joined with the same variants of the
+NHCs looked up), so only keys sharing a variant are compared instead of
+every pair. The built index is pickled
+in the reference cache directory, keyed by the content of the SAMES
+columns it uses, and reloaded by later runs.
+"""
+import hashlib
+import os
+import pickle
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+MATCH_TIERS = ('exact', 'normalized', 'fuzzy')
+
+# Shorter normalized keys are never matched fuzzily: too many near neighbours
+FUZZY_MIN_LENGTH = 5
+
+# Edits tolerated by the fuzzy tier unless asked otherwise (0: tier off)
+DEFAULT_MAX_EDITS = 0
+
+# Bump when the pickled layout changes
+INDEX_VERSION = 1
+
+
+def normalize_nhc(values):
+    """
+    Upper-case alphanumerics of each NHC with a letter prefix and leading
+    zeros removed ('ab 0012 / 34' -> '1234'); NA for values without digits.
+    """
+    values = pd.Series(values, dtype=object)
+    keys = values.astype(str).str.upper().str.replace(r'[^0-9A-Z]', '', regex=True)
+    keys = keys.str.replace(r'^[A-Z]+(?=\d)', '', regex=True).str.lstrip('0')
+    return keys.where(values.notna() & keys.str.contains(r'\d'))
+
+
+def edit_distance(a, b, limit):
+    """
+    Optimal string alignment distance between ``a`` and ``b`` (adjacent
+    swaps count as one edit), or ``limit`` + 1 once it exceeds ``limit``.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2, previous = None, list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        for j, cb in enumerate(b, 1):
+            cost = ca != cb
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def deletion_variants(keys, edits):
+    """
+    Frame of (variant, source): each of ``keys`` with every combination of
+    up to ``edits`` characters removed, ``source`` being the key's position.
+    """
+    level = pd.DataFrame({'variant': pd.Series(keys, dtype=object).to_numpy(),
+                          'source': np.arange(len(keys))})
+    parts = [level]
+    for _ in range(edits):
+        lengths = level['variant'].str.len()
+        shorter = []
+        for position in range(int(lengths.max()) if len(level) else 0):
+            longer = level[lengths > position]
+            shorter.append(pd.DataFrame({
+                'variant': longer['variant'].str.slice_replace(position, position + 1, '').to_numpy(),
+                'source': longer['source'].to_numpy(),
+            }))
+        if not shorter:
+            break
+        level = pd.concat(shorter, ignore_index=True).drop_duplicates()
+        parts.append(level)
+    return pd.concat(parts, ignore_index=True).drop_duplicates(ignore_index=True)
+
+
+def table_digest(table, key, column):
+    """Hash of the key and value columns of ``table``, identifying a SAMES file."""
+    hashes = pd.util.hash_pandas_object(table[[key, column]].astype(object), index=False)
+    return hashlib.sha256(hashes.to_numpy().tobytes()).hexdigest()
+
+
+class NHCIndex:
+    """
+    Exact, normalized and fuzzy lookup of NHCs in the SAMES file, on top of
+    the exact KeyIndex ``exact`` of its NHC column.
+    """
+
+    def __init__(self, exact):
+        self.exact = exact
+        self.column = exact.columns[0]
+        self.name = exact.name
+        keys = pd.Series(exact.index.to_numpy(dtype=object))
+        values = pd.Series(exact._values[self.column][:-1])
+
+        # Normalized keys shared by entries with different values are left out
+        frame = pd.DataFrame({'key': normalize_nhc(keys), 'value': values}).dropna(subset=['key'])
+        frame = frame.drop_duplicates()
+        conflicting = frame['key'].duplicated(keep=False)
+        self.ambiguous_keys = int(frame.loc[conflicting, 'key'].nunique())
+        frame = frame[~conflicting]
+        self.normalized = pd.Index(frame['key'].to_numpy(dtype=object), dtype=object)
+        self._normalized_values = np.append(frame['value'].to_numpy(dtype=object), None)
+        # Delete index per edit budget, built on first use
+        self._deletes = {}
+
+    def describe_duplicates(self):
+        return self.exact.describe_duplicates()
+
+    def describe_ambiguous(self):
+        """Message about normalized keys left out, or None."""
+        if not self.ambiguous_keys:
+            return None
+        return (f"{self.name}: {self.ambiguous_keys} NHCs only differ by zeros, separators or "
+                f"prefixes but have different values; they only match exactly")
+
+    def prepare(self, max_edits):
+        """Build the delete index for ``max_edits`` ahead of lookups; True if it was missing."""
+        if max_edits <= 0 or max_edits in self._deletes:
+            return False
+        self._delete_index(max_edits)
+        return True
+
+    def _delete_index(self, edits):
+        if edits not in self._deletes:
+            keys = pd.Series(self.normalized.to_numpy(dtype=object))
+            long_enough = np.flatnonzero(keys.str.len() >= FUZZY_MIN_LENGTH)
+            variants = deletion_variants(keys.iloc[long_enough], edits)
+            variants['source'] = long_enough[variants['source'].to_numpy()]
+            self._deletes[edits] = variants
+        return self._deletes[edits]
+
+    def _fuzzy_positions(self, keys, edits):
+        """
+        Position in the normalized index of the key within ``edits`` edits of
+        each of ``keys``, -1 where there is none or the closest ones disagree.
+        """
+        keys = pd.Series(keys, dtype=object).reset_index(drop=True)
+        result = np.full(len(keys), -1)
+        long_enough = np.flatnonzero(keys.str.len() >= FUZZY_MIN_LENGTH)
+        if not len(long_enough):
+            return result
+        queries = deletion_variants(keys.iloc[long_enough], edits)
+        pairs = queries.merge(self._delete_index(edits), on='variant', suffixes=('_query', ''))
+        pairs = pairs[['source_query', 'source']].drop_duplicates()
+        if pairs.empty:
+            return result
+        query_keys = keys.to_numpy(dtype=object)[long_enough[pairs['source_query'].to_numpy()]]
+        index_keys = self.normalized.to_numpy(dtype=object)[pairs['source'].to_numpy()]
+        pairs['query'] = long_enough[pairs['source_query'].to_numpy()]
+        pairs['distance'] = [edit_distance(a, b, edits) for a, b in zip(query_keys, index_keys)]
+        pairs = pairs[pairs['distance'] <= edits]
+        # Keep the closest candidates of each query; accept them if they share one value
+        pairs = pairs[pairs['distance'] == pairs.groupby('query')['distance'].transform('min')]
+        pairs['value'] = self._normalized_values[pairs['source'].to_numpy()]
+        agreed = pairs.groupby('query')['value'].nunique() == 1
+        chosen = pairs[pairs['query'].isin(agreed.index[agreed])].drop_duplicates('query')
+        result[chosen['query'].to_numpy()] = chosen['source'].to_numpy()
+        return result
+
+    def normalized_rows(self, key='key'):
+        """The normalized tier as a DataFrame: the normalized NHC as ``key``, then the value."""
+        return pd.DataFrame({key: self.normalized.to_numpy(dtype=object),
+                             self.column: self._normalized_values[:-1]}, dtype=object)
+
+    def resolve(self, values, max_edits=DEFAULT_MAX_EDITS):
+        """
+        Look up ``values`` (a Series of NHCs). Returns (value, tier): two
+        Series aligned on ``values``, None where no tier matched.
+        """
+        values = pd.Series(values, dtype=object) if not isinstance(values, pd.Series) else values
+        codes, uniques = pd.factorize(values.astype(object))
+        found = np.full(len(uniques), None, dtype=object)
+        tiers = np.full(len(uniques), None, dtype=object)
+
+        positions = self.exact.positions(uniques)
+        hit = positions >= 0
+        found[hit] = self.exact._values[self.column][positions[hit]]
+        tiers[hit] = 'exact'
+
+        missing = np.flatnonzero(~hit)
+        if len(missing):
+            keys = normalize_nhc(uniques[missing])
+            positions = self.normalized.get_indexer(keys.fillna('').to_numpy(dtype=object))
+            hit = positions >= 0
+            found[missing[hit]] = self._normalized_values[positions[hit]]
+            tiers[missing[hit]] = 'normalized'
+
+            unmatched = keys[~hit].notna().to_numpy()
+            fuzzy = missing[~hit][unmatched]
+            if max_edits > 0 and len(fuzzy):
+                positions = self._fuzzy_positions(keys[~hit][unmatched], max_edits)
+                hit = positions >= 0
+                found[fuzzy[hit]] = self._normalized_values[positions[hit]]
+                tiers[fuzzy[hit]] = 'fuzzy'
+
+        found = np.append(found, None)[codes]
+        tiers = np.append(tiers, None)[codes]
+        return (pd.Series(found, index=values.index, dtype=object),
+                pd.Series(tiers, index=values.index, dtype=object))
+
+    def lookup_many(self, values, max_edits=DEFAULT_MAX_EDITS):
+        """Resolved value and tier of each of ``values``, as a DataFrame."""
+        found, tiers = self.resolve(values, max_edits)
+        return pd.DataFrame({self.column: found, 'tier': tiers})
+
+    # Persistence
+
+    @staticmethod
+    def path(cache_dir, digest):
+        return os.path.join(cache_dir, f"nhc-index-{digest}.pickle")
+
+    @classmethod
+    def load(cls, cache_dir, digest):
+        """The pickled index of SAMES content ``digest``, or None."""
+        try:
+            with open(cls.path(cache_dir, digest), 'rb') as f:
+                version, index = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError, AttributeError):
+            return None
+        return index if version == INDEX_VERSION else None
+
+    def save(self, cache_dir, digest):
+        os.makedirs(cache_dir, exist_ok=True)
+        path = self.path(cache_dir, digest)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((INDEX_VERSION, self), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+
+def format_tiers(tiers):
+    """'exact 120, normalized 14, fuzzy 2' from a Series of tiers."""
+    counts = Counter(tiers.dropna())
+    return ", ".join(f"{tier} {counts[tier]}" for tier in MATCH_TIERS if counts[tier])
@@ -0,0 +1,178 @@
+"""
+Memoized SAP Notes parsing.
+
+Many invoice lines share one sales order, so the same note text appears on
+dozens of Base rows. parse_notes parses each distinct text once and keeps
+the results in a bounded LRU cache that lives as long as the process, so
+later runs (or Streamlit reruns) only parse notes they have not seen.
+With ``workers`` above 1 the notes left to parse are split into batches
+and parsed in a process pool.
+"""
+import math
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from datetime import date, datetime
+
+import pandas as pd
+
+from .dates import DATE_FORMAT, DateTierStats
+from .notes import FUTURE_DATE, extract_sap_notes_columns
+
+NOTE_FIELDS = ["NHC", "F. Int - Textos", "DOCTOR", FUTURE_DATE]
+
+# Number of distinct notes kept between runs
+DEFAULT_CACHE_SIZE = 200_000
+
+# Fewer distinct notes than this are parsed serially: starting the pool costs more
+PARALLEL_MIN_NOTES = 5_000
+
+# Batches per worker, so that a slow batch does not hold up the whole pool
+BATCHES_PER_WORKER = 4
+
+
+def _expired(fields):
+    """Whether the future date a note was parsed with has passed since."""
+    future = fields[-1]
+    return future is not None and datetime.strptime(future, DATE_FORMAT).date() <= date.today()
+
+
+class NoteCache:
+    """
+    Bounded LRU cache of note text -> (NHC, F. Int - Textos, DOCTOR,
+    FUTURE_DATE). Notes whose rejected future date has passed are parsed again.
+    """
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_many(self, notes):
+        """Return {note: fields} for the cached notes, counting hits and misses."""
+        found = {}
+        for note in notes:
+            fields = self._entries.get(note)
+            if fields is None or _expired(fields):
+                self.misses += 1
+                continue
+            self._entries.move_to_end(note)
+            found[note] = fields
+            self.hits += 1
+        return found
+
+    def put_many(self, parsed):
+        """Store {note: fields}, evicting the least recently used notes."""
+        if self.maxsize <= 0:
+            return
+        for note, fields in parsed.items():
+            self._entries[note] = fields
+            self._entries.move_to_end(note)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+# Cache shared by every run in this process
+NOTES_CACHE = NoteCache()
+
+
+@dataclass
+class NoteParseStats:
+    """How much parsing a parse_notes call actually did."""
+    rows: int = 0
+    distinct: int = 0
+    cache_hits: int = 0
+    workers: int = 1
+    dates: DateTierStats = field(default_factory=DateTierStats)
+    # Notes resolved by each pattern, keyed 'family.name'
+    patterns: Counter = field(default_factory=Counter)
+
+    @property
+    def parsed(self):
+        return self.distinct - self.cache_hits
+
+    def summary(self):
+        workers = f" by {self.workers} workers" if self.workers > 1 else ""
+        return (f"{self.rows} notes, {self.distinct} distinct, "
+                f"{self.cache_hits} from cache, {self.parsed} parsed{workers} "
+                f"(dates: {self.dates.summary()})")
+
+
+def _parse_batch(notes):
+    """Worker side of _parse_parallel: list of notes -> (field tuples, DateTierStats, Counter)."""
+    date_stats = DateTierStats()
+    pattern_hits = Counter()
+    fields = extract_sap_notes_columns(pd.Series(notes, dtype=object), date_stats, pattern_hits)
+    return list(fields[NOTE_FIELDS].itertuples(index=False, name=None)), date_stats, pattern_hits
+
+
+def _parse_parallel(notes, workers, date_stats, pattern_hits):
+    """
+    Parse ``notes`` in batches over ``workers`` processes and return the
+    field tuples in the order of ``notes``.
+    """
+    batch_size = math.ceil(len(notes) / (workers * BATCHES_PER_WORKER))
+    batches = [notes[start:start + batch_size] for start in range(0, len(notes), batch_size)]
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # map yields the batches back in submission order
+        for batch_rows, batch_stats, batch_hits in pool.map(_parse_batch, batches):
+            rows.extend(batch_rows)
+            date_stats.add(batch_stats)
+            pattern_hits.update(batch_hits)
+    return rows
+
+
+def parse_notes(notes, cache=NOTES_CACHE, workers=1):
+    """
+    Extract NHC, F. Int - Textos and DOCTOR for a Series of notes, parsing
+    each distinct text once. Pass ``cache=None`` to skip the LRU cache.
+    With ``workers`` > 1 and at least PARALLEL_MIN_NOTES notes to parse,
+    parsing runs in a process pool; if the pool cannot start it runs here.
+    Returns (DataFrame aligned on the non-null rows of ``notes``, NoteParseStats).
+    """
+    notes = notes.dropna().astype(str).astype(object)
+    codes, uniques = pd.factorize(notes)
+    distinct = pd.Series(uniques, dtype=object)
+    stats = NoteParseStats(rows=len(notes), distinct=len(distinct))
+
+    known = cache.get_many(distinct) if cache is not None else {}
+    stats.cache_hits = len(known)
+
+    todo = distinct[~distinct.isin(list(known))] if known else distinct
+    if len(todo):
+        rows = None
+        if workers > 1 and len(todo) >= PARALLEL_MIN_NOTES:
+            try:
+                rows = _parse_parallel(todo.tolist(), workers, stats.dates, stats.patterns)
+                stats.workers = workers
+            except (BrokenProcessPool, OSError):
+                stats.dates = DateTierStats()
+                stats.patterns = Counter()
+        if rows is None:
+            fields = extract_sap_notes_columns(todo, stats.dates, stats.patterns)
+            rows = fields[NOTE_FIELDS].itertuples(index=False, name=None)
+        parsed = dict(zip(todo, rows))
+        if cache is not None:
+            cache.put_many(parsed)
+        known.update(parsed)
+
+    per_note = pd.DataFrame([known[note] for note in distinct], columns=NOTE_FIELDS, dtype=object)
+    result = per_note.take(codes)
+    result.index = notes.index
+    return result, stats
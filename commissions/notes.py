@@ -0,0 +1,133 @@
+"""
+Parsing helpers for the free-text SAP Notes attached to each sales order.
+"""
+import re
+
+import pandas as pd
+
+from .dates import DateTierStats, parse_date, parse_dates
+from .patterns import NOTE_PATTERNS
+
+# Date a note gave that was rejected for being in the future, 'dd/mm/yyyy';
+# incremental runs redo the row once it has passed
+FUTURE_DATE = '_future_date'
+
+# Fallback NHC pattern applied to the SO PO Number when the note has none
+NHC_FROM_SO_PO_PATTERN = r'NHC\s*(?:CIC\s+(\d+(?:\s*/\s*\d+)?)|:?\s*\*{0,2}\s*([A-Za-z0-9]+(?:\s*/\s*[A-Za-z0-9]+)?)\s*\*{0,2})'
+
+
+def normalize_date_format(date_string):
+    """
+    Convert various date formats to dd/mm/yyyy format.
+    Handles formats like: 07/09/2023_, 15-02-2023, 08/09/22, etc.
+    """
+    if not date_string:
+        return None
+
+    # Clean the date string - remove trailing underscores, spaces, and other unwanted characters
+    cleaned_date = re.sub(r'[_\s]+', '', date_string.strip())
+    cleaned_date = re.sub(r'[^\d\-/.]', '', cleaned_date)  # Keep only digits and separators
+    if not cleaned_date:
+        return None
+
+    return parse_date(cleaned_date, regex_fallback=True)[1]
+
+
+# Patterns tried in order against each note, the first match wins
+# (defined in note_patterns.toml, see commissions.patterns)
+NHC_PATTERNS = NOTE_PATTERNS['nhc'].sources
+DOCTOR_PATTERNS = NOTE_PATTERNS['doctor'].sources
+FECHA_PATTERNS = NOTE_PATTERNS['fecha'].sources
+
+
+def _clean_nhc(nhc):
+    nhc = nhc.strip()
+    # If multiple underscores, there is no NHC, just a blank form field
+    if nhc.count('_') > 1:
+        return None
+    # Remove the underscore if there is exactly one
+    return nhc.replace('_', '')
+
+
+def parse_note_date(note):
+    """
+    Step 1 of the date extraction: read the entire note as a date.
+    Returns (parsed, value); when parsed is False the note has to go
+    through the fecha patterns.
+    """
+    return parse_date(note)
+
+
+def parse_fecha_raw(fecha_raw):
+    """Turn the date text captured by FECHA_PATTERNS into dd/mm/yyyy, or None."""
+    return parse_date(fecha_raw, regex_fallback=True)[1]
+
+
+def _first_search(family, note, clean=str.strip):
+    value = NOTE_PATTERNS[family].search(note)
+    return clean(value) if value is not None else None
+
+
+# Function to extract information from SAP notes
+def extract_sap_notes_info(note):
+    """Return (nhc, fecha_int, doctor) found in a single SAP note."""
+    if pd.isna(note):
+        return None, None, None
+
+    # Convert to string if not already
+    note = str(note)
+
+    nhc = _first_search('nhc', note, _clean_nhc)
+    doctor = _first_search('doctor', note)
+
+    parsed, fecha_int = parse_note_date(note)
+    if parsed:
+        return nhc, fecha_int, doctor
+
+    fecha_raw = _first_search('fecha', note)
+    # If no pattern matched there is no date in the note
+    if not fecha_raw:
+        return nhc, None, doctor
+
+    return nhc, parse_fecha_raw(fecha_raw), doctor
+
+
+def extract_sap_notes_columns(notes, date_stats=None, pattern_hits=None):
+    """
+    Extract NHC, F. Int - Textos and DOCTOR for a whole Series of notes,
+    plus the FUTURE_DATE rejected instead of F. Int - Textos.
+
+    Gives the same values as calling extract_sap_notes_info on every note,
+    but each pattern runs once over the column instead of once per row.
+    Returns a DataFrame aligned on ``notes.index``; the date tier counts are
+    added to ``date_stats`` and the matches of each pattern to
+    ``pattern_hits`` (a Counter) when given.
+    """
+    notes = notes.dropna().astype(str).astype(object)
+    date_stats = date_stats if date_stats is not None else DateTierStats()
+    result = pd.DataFrame({
+        "NHC": NOTE_PATTERNS['nhc'].extract(notes, pattern_hits),
+        "F. Int - Textos": pd.Series(None, index=notes.index, dtype=object),
+        "DOCTOR": NOTE_PATTERNS['doctor'].extract(notes, pattern_hits),
+        FUTURE_DATE: pd.Series(None, index=notes.index, dtype=object),
+    }, index=notes.index)
+
+    result["NHC"] = result["NHC"].map(_clean_nhc, na_action='ignore')
+    result["DOCTOR"] = result["DOCTOR"].str.strip()
+
+    # Step 1: the whole note read as a date
+    note_dates = parse_dates(notes)
+    date_stats.add(note_dates.stats)
+    parsed = note_dates.parsed
+    result.loc[parsed, "F. Int - Textos"] = note_dates.dates[parsed]
+    result.loc[parsed, FUTURE_DATE] = note_dates.future[parsed]
+
+    # Step 2: fecha patterns on the notes that are not a date themselves
+    fecha_raw = NOTE_PATTERNS['fecha'].extract(notes[~parsed], pattern_hits).str.strip()
+    fecha_raw = fecha_raw[fecha_raw.notna() & (fecha_raw != '')]
+    fecha_dates = parse_dates(fecha_raw, regex_fallback=True)
+    date_stats.add(fecha_dates.stats)
+    result.loc[fecha_raw.index, "F. Int - Textos"] = fecha_dates.dates
+    result.loc[fecha_raw.index, FUTURE_DATE] = fecha_dates.future
+
+    return result.astype(object).where(result.notna(), None)
@@ -0,0 +1,43 @@
+"""
+Check or list the SAP Notes pattern tables.
+
+    python -m commissions.pattern_check [FILE]
+    python -m commissions.pattern_check --show
+"""
+import argparse
+import sys
+from collections import Counter
+
+from .patterns import PatternConfigError, load_patterns, pattern_file
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m commissions.pattern_check',
+                                     description="Load a pattern file and test its examples.")
+    parser.add_argument('file', nargs='?', help="Pattern file (default: %s)" % pattern_file())
+    parser.add_argument('--show', action='store_true', help="List the regular expressions instead")
+    args = parser.parse_args(argv)
+
+    try:
+        families = load_patterns(args.file)
+    except PatternConfigError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    for family in families.values():
+        print(f"[{family.name}]")
+        for position, pattern in enumerate(family.patterns, start=1):
+            line = f"  {position:>2}. {pattern.name:<30}"
+            if args.show:
+                line += f" {pattern.pattern}"
+            elif pattern.example is not None:
+                # Which pattern the example resolves to once priorities apply
+                winner = Counter()
+                family.search(pattern.example, winner)
+                line += f" ok, resolved by {next(iter(winner))}"
+            print(line)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""
+Pattern tables used to pull NHC, DOCTOR and the intervention date out of
+the SAP Notes.
+
+The tables live in note_patterns.toml (or the file named by
+COMMISSIONS_NOTE_PATTERNS), so a new clinic note format only needs a new
+entry there (check it with ``python -m commissions.pattern_check FILE``).
+Each table is compiled once into a PatternFamily; lookups count which
+pattern matched so the load of each one can be reported.
+"""
+import os
+import re
+import tomllib
+from dataclasses import dataclass
+
+import pandas as pd
+
+DEFAULT_PATTERN_FILE = os.path.join(os.path.dirname(__file__), 'note_patterns.toml')
+
+PATTERN_FILE_ENV = 'COMMISSIONS_NOTE_PATTERNS'
+
+# Tables every pattern file must define
+FAMILIES = ('nhc', 'doctor', 'fecha')
+
+PATTERN_FLAGS = re.IGNORECASE
+
+
+class PatternConfigError(ValueError):
+    """Raised when a pattern file is missing, malformed or fails its examples."""
+
+
+@dataclass
+class NotePattern:
+    """One entry of a pattern table."""
+    name: str
+    pattern: str
+    example: str = None
+
+    def __post_init__(self):
+        try:
+            self.regex = re.compile(self.pattern, PATTERN_FLAGS)
+        except re.error as e:
+            raise PatternConfigError(f"Pattern '{self.name}' does not compile: {e}") from e
+        if self.regex.groups < 1:
+            raise PatternConfigError(f"Pattern '{self.name}' has no capture group")
+        if self.example is not None and not self.regex.search(self.example):
+            raise PatternConfigError(f"Pattern '{self.name}' does not match its example '{self.example}'")
+
+
+class PatternFamily:
+    """Ordered patterns for one field; the first pattern that matches wins."""
+
+    def __init__(self, name, patterns):
+        if not patterns:
+            raise PatternConfigError(f"No patterns defined for '{name}'")
+        names = [pattern.name for pattern in patterns]
+        duplicated = sorted({n for n in names if names.count(n) > 1})
+        if duplicated:
+            raise PatternConfigError(f"Duplicate pattern names in '{name}': {', '.join(duplicated)}")
+        self.name = name
+        self.patterns = list(patterns)
+
+    def __len__(self):
+        return len(self.patterns)
+
+    @property
+    def sources(self):
+        """The regular expressions, in priority order."""
+        return [pattern.pattern for pattern in self.patterns]
+
+    def key(self, pattern):
+        return f"{self.name}.{pattern.name}"
+
+    def search(self, text, hits=None):
+        """Group 1 of the first pattern found in ``text``, or None."""
+        for pattern in self.patterns:
+            match = pattern.regex.search(text)
+            if match:
+                if hits is not None:
+                    hits[self.key(pattern)] += 1
+                return match.group(1)
+        return None
+
+    def extract(self, texts, hits=None):
+        """
+        Columnar search: run each pattern with str.extract on the texts no
+        earlier pattern matched, keeping group 1. Returns a Series aligned
+        on ``texts`` with None where nothing matched.
+        """
+        result = pd.Series(None, index=texts.index, dtype=object)
+        remaining = texts
+        for pattern in self.patterns:
+            if remaining.empty:
+                break
+            found = remaining.str.extract(pattern.regex, expand=True)[0]
+            hit = found.notna()
+            result.loc[found.index[hit]] = found[hit].to_numpy(dtype=object)
+            if hits is not None:
+                hits[self.key(pattern)] += int(hit.sum())
+            remaining = remaining[~hit]
+        return result
+
+
+def pattern_file():
+    return os.environ.get(PATTERN_FILE_ENV) or DEFAULT_PATTERN_FILE
+
+
+def load_patterns(path=None):
+    """Read a pattern file into {family name: PatternFamily}."""
+    path = path or pattern_file()
+    try:
+        with open(path, 'rb') as f:
+            config = tomllib.load(f)
+    except OSError as e:
+        raise PatternConfigError(f"Cannot read pattern file {path}: {e}") from e
+    except tomllib.TOMLDecodeError as e:
+        raise PatternConfigError(f"Invalid pattern file {path}: {e}") from e
+
+    families = {}
+    for family in FAMILIES:
+        entries = config.get(family)
+        if not isinstance(entries, list):
+            raise PatternConfigError(f"{path}: no [[{family}]] patterns")
+        try:
+            patterns = [NotePattern(**entry) for entry in entries]
+        except TypeError as e:
+            raise PatternConfigError(f"{path}: bad [[{family}]] entry: {e}") from e
+        families[family] = PatternFamily(family, patterns)
+    return families
+
+
+def format_hits(hits):
+    """'nhc.double_star 120, nhc.nh 3, ...' by decreasing count."""
+    return ", ".join(f"{key} {count}" for key, count in hits.most_common())
+
+
+# Pattern tables of this process, loaded once
+NOTE_PATTERNS = load_patterns()
@@ -0,0 +1,459 @@
+"""
+End-to-end commission pipeline, usable without Streamlit.
+"""
+import io
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field, fields
+
+import numpy as np
+import pandas as pd
+
+from .doctors import DoctorDictionary
+from .dtypes import categorize, frame_memory_mb, to_arrow_strings
+from .export import OUTPUT_ENCODING, export, export_format, write_csv
+from .incremental import INPUT_HASH, ROW_KEY, IncrementalStats, expired_rows, input_hashes, row_keys
+from .instrumentation import RunReport
+from .nhc_index import DEFAULT_MAX_EDITS
+from .io import InputFileError, file_name, read_chunks, read_file
+from .notes import FUTURE_DATE
+from .polars_backend import run_stages as run_polars_stages
+from .reporting import ChunkReporter, ConsoleReporter
+from .stages import (
+    REFERENCE_COLUMNS,
+    extract_notes,
+    finalize_output,
+    index_focus,
+    index_incidencias,
+    index_invoices,
+    index_master_data,
+    index_po,
+    index_sames,
+    index_sap_notes,
+    match_focus_products,
+    match_incidencias,
+    match_invoices_commissioned,
+    match_master_data,
+    match_po_data,
+    match_sames,
+    normalize_doctors,
+)
+
+# Input files that must be present for the pipeline to run
+REQUIRED_INPUTS = ('base', 'sap_notes', 'po')
+
+# Inputs that change rarely and go through the on-disk reference cache
+REFERENCE_INPUTS = ('sames', 'po', 'facturas', 'focus', 'master_data')
+
+# Base rows processed at a time by run_pipeline_chunked
+DEFAULT_CHUNK_SIZE = 50_000
+
+# Engines that can run the enrichment stages
+BACKENDS = ('pandas', 'polars')
+
+# Human readable name of each input, as labelled in the app
+INPUT_LABELS = {
+    'base': "Base",
+    'sap_notes': "SAP Notes",
+    'sames': "SAMES",
+    'po': "SAP DATA - PO NUMBER, DATE, REFERENCE",
+    'incidencias': "INCIDENCIAS + RECLASIFICACIONES",
+    'facturas': "FACTURAS COMISIONADAS",
+    'focus': "PRODUCTOS FOCUS",
+    'master_data': "MasterDataES",
+}
+
+
+@dataclass
+class PipelineInputs:
+    """The input tables of a commission run; MasterDataES is optional."""
+    base: object = None
+    sap_notes: object = None
+    sames: object = None
+    po: object = None
+    incidencias: object = None
+    facturas: object = None
+    focus: object = None
+    master_data: object = None
+
+    def missing(self):
+        """Names of the required inputs that are not loaded."""
+        return [name for name in REQUIRED_INPUTS if getattr(self, name) is None]
+
+    def items(self):
+        return [(f.name, getattr(self, f.name)) for f in fields(self)]
+
+
+@dataclass
+class PipelineOptions:
+    """Settings of a run that change how it is computed, not its output."""
+    # Processes parsing the SAP Notes; 1 parses them in this process
+    note_workers: int = 1
+    # instrumentation.NoteProfiler run around the SAP Notes extraction
+    note_profiler: object = None
+    # dtype of every text column (dtypes.arrow_string_dtype()); None keeps str / object
+    string_dtype: object = None
+    # Edits the fuzzy NHC tier tolerates when matching SAMES; 0 turns it off
+    nhc_max_edits: int = DEFAULT_MAX_EDITS
+    # Directory the SAMES NHC index is persisted in; None rebuilds it every run
+    index_cache: str = None
+    # Processes reading the input files at once; 1 reads them one after another
+    read_workers: int = 1
+    # Canonical doctor names, shared by every chunk of a run
+    doctors: DoctorDictionary = field(default_factory=DoctorDictionary)
+    # Engine of the enrichment stages: 'pandas', or 'polars' (one lazy query, see polars_backend)
+    backend: str = 'pandas'
+
+    def for_index(self, name):
+        """Extra keyword arguments of the index builder of input ``name``."""
+        if name == 'sames':
+            return {'cache_dir': self.index_cache, 'max_edits': self.nhc_max_edits}
+        return {}
+
+    def for_stage(self, name):
+        """Extra keyword arguments of the stage ``name``."""
+        if name == 'sap_notes':
+            return {'workers': self.note_workers, 'profiler': self.note_profiler}
+        if name == 'sames':
+            return {'max_edits': self.nhc_max_edits, 'cache_dir': self.index_cache}
+        if name == 'doctors':
+            return {'dictionary': self.doctors}
+        return {}
+
+
+def _portable(source):
+    """``source`` in a form a worker process can receive: paths as they are, uploads as BytesIO."""
+    if hasattr(source, 'getvalue'):
+        copy = io.BytesIO(source.getvalue())
+        copy.name = file_name(source)
+        return copy
+    return source
+
+
+def _read_input(name, source, reader, reference_store, string_dtype):
+    """Read one input; returns (DataFrame, StageTiming). Runs in the read workers."""
+    report = RunReport()
+    with report.measure(f"read {name}") as timing:
+        if reference_store is not None and name in REFERENCE_INPUTS:
+            df = reference_store.read(source)
+        elif string_dtype is not None:
+            df = reader(source, dtype=string_dtype)
+        else:
+            df = reader(source)
+        if string_dtype is not None:
+            to_arrow_strings(df, string_dtype)
+        timing.rows_out = len(df)
+        timing.frame_mb = frame_memory_mb(df)
+    return df, timing
+
+
+def _read_failed(name, error):
+    return InputFileError(f"{INPUT_LABELS.get(name, name)}: {error}")
+
+
+def _read_parallel(sources, workers, args, on_read):
+    """
+    Read ``sources`` over ``workers`` processes, calling ``on_read`` as each
+    one finishes. The first file that fails cancels the reads not started.
+    Raises BrokenProcessPool when the pool cannot be started or dies.
+    """
+    pool = None
+    try:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        futures = {pool.submit(_read_input, name, _portable(source), *args): name
+                   for name, source in sources.items()}
+    except OSError as e:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        raise BrokenProcessPool(f"Could not start the read workers: {e}") from e
+    try:
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                df, timing = future.result()
+            except (InputFileError, OSError) as e:
+                raise _read_failed(name, e) from e
+            on_read(name, df, timing)
+    except BaseException:
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown(wait=True)
+
+
+def load_inputs(sources, reader=read_file, reference_store=None, report=None, options=None,
+                reporter=None):
+    """
+    Read every source file of ``sources`` (a dict keyed like PipelineInputs).
+    Reference inputs go through ``reference_store`` when one is given.
+    Read times are recorded in ``report`` (a RunReport) when given.
+    Text columns get ``options.string_dtype`` when one is set. With
+    ``options.read_workers`` above 1 the files are read in a process pool.
+    Each file read is reported to ``reporter`` when given; the first file
+    that cannot be read raises InputFileError naming the input.
+    """
+    report = report if report is not None else RunReport()
+    options = options or PipelineOptions()
+    sources = {name: source for name, source in sources.items() if source is not None}
+    args = (reader, reference_store, options.string_dtype)
+    loaded, timings = {}, {}
+
+    def on_read(name, df, timing):
+        loaded[name], timings[name] = df, timing
+        if reporter is not None:
+            reporter.success(f"{INPUT_LABELS.get(name, name)}: {len(df)} rows read in {timing.wall_s:.1f}s")
+
+    workers = min(options.read_workers, len(sources))
+    done = False
+    if workers > 1:
+        try:
+            _read_parallel(sources, workers, args, on_read)
+            done = True
+        except BrokenProcessPool:
+            # No usable process pool here (or it died): read in this process
+            loaded.clear()
+            timings.clear()
+    if not done:
+        for name, source in sources.items():
+            try:
+                on_read(name, *_read_input(name, source, *args))
+            except (InputFileError, OSError) as e:
+                raise _read_failed(name, e) from e
+
+    # Timings in input order, whatever order the reads finished in
+    for name in sources:
+        report.add(timings[name])
+    return PipelineInputs(**loaded)
+
+
+# Ordered pipeline stages: (name, function, input holding its reference table)
+STAGES = [
+    ('po', match_po_data, 'po'),
+    ('master_data', match_master_data, 'master_data'),
+    ('sap_notes', extract_notes, 'sap_notes'),
+    ('doctors', normalize_doctors, None),
+    ('sames', match_sames, 'sames'),
+    ('incidencias', match_incidencias, 'incidencias'),
+    ('facturas', match_invoices_commissioned, 'facturas'),
+    ('focus', match_focus_products, 'focus'),
+]
+
+# Builder of the index each stage looks its reference table up in
+REFERENCE_INDEXES = {
+    'po': index_po,
+    'sap_notes': index_sap_notes,
+    'sames': index_sames,
+    'incidencias': index_incidencias,
+    'facturas': index_invoices,
+    'focus': index_focus,
+    'master_data': index_master_data,
+}
+
+
+def _check_inputs(inputs, required=REQUIRED_INPUTS):
+    missing = [name for name in inputs.missing() if name in required]
+    if missing:
+        labels = ', '.join(INPUT_LABELS[name] for name in missing)
+        raise ValueError(f"Please upload all required files ({labels})")
+
+
+def _check_columns(inputs):
+    """Raise InputFileError for the first reference table without a column it is indexed on."""
+    for name, columns in REFERENCE_COLUMNS.items():
+        table = getattr(inputs, name)
+        if not isinstance(table, pd.DataFrame):
+            continue
+        missing = [col for col in columns if col not in table.columns]
+        if missing:
+            plural = 's' if len(missing) > 1 else ''
+            raise InputFileError(f"{INPUT_LABELS[name]}: missing column{plural} "
+                                 + ', '.join(f"'{col}'" for col in missing))
+
+
+def _convert_columns(base_df, options, final=False):
+    """
+    Give the columns a stage added ``options.string_dtype``; the finished
+    frame also gets its categorical columns.
+    """
+    if options.string_dtype is not None:
+        to_arrow_strings(base_df, options.string_dtype)
+        if final:
+            categorize(base_df)
+    return base_df
+
+
+def _run_stages(base_df, inputs, reporter, options, report, future_dates=False):
+    """The stages on ``base_df``; with ``future_dates`` the FUTURE_DATE column is kept."""
+    if options.backend == 'polars':
+        base_df = run_polars_stages(base_df, inputs, reporter, options, report)
+        if not future_dates:
+            base_df = base_df.drop(columns=[FUTURE_DATE], errors='ignore')
+        return _convert_columns(base_df, options, final=True)
+    if options.backend != 'pandas':
+        raise ValueError(f"Unknown backend: {options.backend}")
+    for name, stage, source in STAGES:
+        with report.measure(name, rows_in=len(base_df)) as timing:
+            reference = getattr(inputs, source) if source else None
+            base_df = stage(base_df, reference, reporter, **options.for_stage(name))
+            base_df = _convert_columns(base_df, options)
+            timing.rows_out = len(base_df)
+            timing.frame_mb = frame_memory_mb(base_df)
+    with report.measure('finalize', rows_in=len(base_df)) as timing:
+        base_df = finalize_output(base_df, reporter)
+        if not future_dates:
+            base_df.drop(columns=[FUTURE_DATE], inplace=True, errors='ignore')
+        base_df = _convert_columns(base_df, options, final=True)
+        timing.rows_out = len(base_df)
+        timing.frame_mb = frame_memory_mb(base_df)
+    return base_df
+
+
+def run_pipeline(inputs, reporter=None, options=None, report=None):
+    """
+    Run every enrichment stage on ``inputs.base`` and return the processed frame.
+    Per-stage timings are recorded in ``report`` (a RunReport) when given.
+    """
+    reporter = reporter or ConsoleReporter()
+    _check_inputs(inputs)
+    _check_columns(inputs)
+    report = report if report is not None else RunReport()
+    return _run_stages(inputs.base, inputs, reporter, options or PipelineOptions(), report)
+
+
+def index_references(inputs, reporter, options=None):
+    """
+    Copy of ``inputs`` with every reference table replaced by its index,
+    so that runs over many Base chunks index each table once.
+    """
+    options = options or PipelineOptions()
+    _check_columns(inputs)
+    indexed = {}
+    for name, table in inputs.items():
+        build = REFERENCE_INDEXES.get(name)
+        if build is None or table is None:
+            indexed[name] = table
+        else:
+            # Tables that cannot be indexed stay as they are; the stage reports why
+            index = build(table, reporter, **options.for_index(name))
+            indexed[name] = table if index is None else index
+    return PipelineInputs(**indexed)
+
+
+def run_pipeline_chunked(inputs, base_source, path, chunk_size=DEFAULT_CHUNK_SIZE, reporter=None,
+                         options=None, report=None):
+    """
+    Process the Base file ``base_source`` ``chunk_size`` rows at a time and
+    append each processed chunk to the CSV at ``path``. The reference tables
+    of ``inputs`` are indexed once up front; ``inputs.base`` is ignored.
+    Memory use follows the chunk size instead of the Base file size.
+    Returns the number of rows written.
+    """
+    reporter = reporter or ConsoleReporter()
+    options = options or PipelineOptions()
+    _check_inputs(inputs, [name for name in REQUIRED_INPUTS if name != 'base'])
+    if chunk_size < 1:
+        raise ValueError(f"Chunk size must be positive, got {chunk_size}")
+    if export_format(path) != 'csv':
+        raise ValueError("Chunked runs append to a CSV file; use a .csv output")
+
+    report = report if report is not None else RunReport()
+    reporter.step("Indexing reference files...")
+    with report.measure('index references'):
+        references = index_references(inputs, reporter, options)
+    chunk_reporter = ChunkReporter(reporter)
+
+    rows = 0
+    chunks = read_chunks(base_source, chunk_size, options.string_dtype or str)
+    with open(path, 'w', encoding=OUTPUT_ENCODING, newline='') as output:
+        for number in itertools.count(1):
+            with report.measure('read base') as timing:
+                chunk = next(chunks, None)
+                timing.rows_out = 0 if chunk is None else len(chunk)
+            if chunk is None:
+                break
+            chunk = _run_stages(chunk, references, chunk_reporter, options, report)
+            with report.measure('export', rows_in=len(chunk)) as timing:
+                write_csv(chunk, output, header=rows == 0)
+                timing.rows_out = len(chunk)
+            rows += len(chunk)
+            reporter.success(f"Chunk {number}: {rows} rows written")
+    return rows
+
+
+def run_pipeline_incremental(inputs, state, reporter=None, options=None, report=None):
+    """
+    Run the stages only on the Base rows that are new, or whose own values or
+    looked up reference entries changed, since the run stored in ``state``
+    (an incremental.IncrementalState), and on the rows whose note date was
+    rejected for being in the future when it no longer is. The other rows
+    are taken from the state. The merged frame, in Base order, is stored as
+    the new state.
+    Returns (processed frame, IncrementalStats).
+    """
+    reporter = reporter or ConsoleReporter()
+    options = options or PipelineOptions()
+    _check_inputs(inputs)
+    report = report if report is not None else RunReport()
+    base_df = inputs.base
+
+    reporter.step("Indexing reference files...")
+    with report.measure('index references'):
+        references = index_references(inputs, reporter, options)
+    with report.measure('load state') as timing:
+        previous = state.load(base_df.columns, options.nhc_max_edits, options.doctors)
+        timing.rows_out = 0 if previous is None else len(previous)
+    if previous is None:
+        reporter.warning("No incremental state for these Base columns and patterns - processing every row")
+
+    with report.measure('hash rows', rows_in=len(base_df)):
+        keys = row_keys(base_df)
+        positions = state.match(previous, keys)
+        known = positions >= 0
+        nhc = pd.Series(None, index=base_df.index, dtype=object)
+        reused = np.zeros(len(base_df), dtype=bool)
+        if known.any():
+            nhc[known] = previous['NHC'].to_numpy(dtype=object)[positions[known]]
+        hashes = input_hashes(base_df, references, nhc, options.nhc_max_edits)
+        if known.any():
+            reused[known] = previous[INPUT_HASH].to_numpy()[positions[known]] == hashes[known]
+            reused[known] &= ~expired_rows(previous)[positions[known]]
+
+    stats = IncrementalStats(rows=len(base_df), reused=int(reused.sum()),
+                             changed=int((known & ~reused).sum()), new=int((~known).sum()),
+                             dropped=0 if previous is None else len(previous) - int(known.sum()))
+    reporter.step(f"Incremental run: {stats.summary()}")
+
+    parts = []
+    if stats.reused:
+        kept = previous.iloc[positions[reused]].drop(columns=[ROW_KEY, INPUT_HASH])
+        kept.index = base_df.index[reused]
+        parts.append(kept)
+    if stats.recomputed or not parts:
+        processed = _run_stages(base_df[~reused].copy(), references, reporter, options, report,
+                                future_dates=True)
+        # Rows whose NHC changed look up another SAMES entry from now on
+        hashes[~reused] = input_hashes(base_df[~reused], references, processed['NHC'],
+                                       options.nhc_max_edits)
+        parts.append(processed)
+
+    with report.measure('merge state', rows_in=len(base_df)) as timing:
+        merged = pd.concat(parts).loc[base_df.index] if len(parts) > 1 else parts[0]
+        # Stored and new categoricals rarely share categories, so concat gives object
+        merged = _convert_columns(merged, options, final=True)
+        state.save(merged, keys, hashes, base_df.columns, options.nhc_max_edits, options.doctors)
+        merged = merged.drop(columns=[FUTURE_DATE], errors='ignore')
+        timing.rows_out = len(merged)
+        timing.frame_mb = frame_memory_mb(merged)
+    reporter.success(f"Incremental state saved: {stats.reused} rows reused, {stats.recomputed} processed")
+    return merged, stats
+
+
+def write_output(base_df, path, report=None, format=None):
+    """
+    Write the processed frame to ``path``: CSV readable by Excel, Parquet or
+    XLSX, from ``format`` or the extension of ``path``.
+    """
+    report = report if report is not None else RunReport()
+    with report.measure('export', rows_in=len(base_df)) as timing:
+        export(base_df, path, format)
+        timing.rows_out = len(base_df)
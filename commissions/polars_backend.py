@@ -0,0 +1,373 @@
+"""
+Polars backend of the enrichment stages.
+
+run_stages builds the stages as one lazy Polars query on the Base frame:
+the PO, MasterDataES, SAP Notes, SAMES, INCIDENCIAS, FACTURAS and FOCUS
+lookups are left joins against the rows of the same indexes the pandas stages use (so key
+normalization and duplicate keys behave alike), Product Type is a
+when/otherwise on BU, and the helper columns are dropped in the final
+select. The Python parts (SAP Notes parsing, doctor names, Invoice Date
+formats and the fuzzy SAMES tier) run as map_batches steps on whole
+columns. Polars optimizes the query and runs the joins over its own
+thread pool; the result comes back as a pandas frame with the columns
+and index of the pandas pipeline.
+
+Every input is read as text, so the join keys are Polars strings.
+"""
+import functools
+
+import pandas as pd
+
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+from .dates import DATE_FORMAT, parse_invoice_dates, unparsed_dates
+from .doctors import DoctorDictionary
+from .doctors import format_tiers as format_doctor_tiers
+from .dtypes import frame_memory_mb
+from .instrumentation import profiling
+from .joins import DOC_NUMBER_WIDTH
+from .nhc_index import format_tiers
+from .note_cache import NOTE_FIELDS, parse_notes
+from .notes import NHC_FROM_SO_PO_PATTERN
+from .patterns import format_hits
+from .stages import (
+    DROPPED_OUTPUT_COLUMNS,
+    MASTER_DATA_KEYS,
+    PARSED_INVOICE_DATE,
+    _report_unmatched,
+    index_focus,
+    index_incidencias,
+    index_invoices,
+    index_master_data,
+    index_po,
+    index_sames,
+    index_sap_notes,
+    indexed,
+    report_master_data,
+    report_unparsed_dates,
+)
+
+# Join key column of the reference frames
+KEY = '__key'
+
+# Set on the rows the MasterDataES join found, for its match rate
+MASTER_DATA_HIT = '__master_data_hit'
+
+
+def have_polars():
+    return pl is not None
+
+
+def _reference(rows, hit=None):
+    """
+    LazyFrame of reference ``rows`` (KeyIndex.rows), keyed by KEY as text,
+    with a ``hit`` column of True if given: set once joined, even where the
+    value is empty.
+    """
+    frame = pl.from_pandas(rows.astype(object)).lazy()
+    frame = frame.with_columns(pl.col(KEY).cast(pl.String))
+    if hit is not None:
+        frame = frame.with_columns(pl.lit(True).alias(hit))
+    return frame
+
+
+def _doc_number(column):
+    """Polars version of joins.doc_number_key."""
+    return pl.col(column).cast(pl.String).str.strip_chars().str.zfill(DOC_NUMBER_WIDTH)
+
+
+def _normalized_nhc(column):
+    """Polars version of nhc_index.normalize_nhc."""
+    keys = pl.col(column).cast(pl.String).str.to_uppercase().str.replace_all(r'[^0-9A-Z]', '')
+    keys = keys.str.replace(r'^[A-Z]+(\d)', '${1}').str.strip_chars_start('0')
+    return pl.when(keys.str.contains(r'\d')).then(keys)
+
+
+def _left_join(frame, reference, key):
+    """Left join of ``reference`` on the key expression ``key``, keeping the row order."""
+    return (frame.join(reference, left_on=key, right_on=KEY, how='left', maintain_order='left')
+            .drop(KEY, strict=False))
+
+
+class _Plan:
+    """
+    The lazy query under construction, with the output columns in the
+    order the pandas stages give them: Base columns where they are, the
+    columns the stages add after them.
+    """
+
+    def __init__(self, base_df):
+        self.frame = pl.from_pandas(base_df).lazy()
+        self.columns = list(base_df.columns)
+        # Whether PARSED_INVOICE_DATE is in the query yet
+        self.parsed_dates = False
+
+    def add(self, *names):
+        self.columns += [name for name in names if name not in self.columns]
+
+    def with_columns(self, **exprs):
+        self.frame = self.frame.with_columns(**exprs)
+        self.add(*exprs)
+
+    def join(self, reference, key, columns):
+        """Left join ``reference`` on the key expression ``key``; its ``columns`` replace the Base ones."""
+        replaced = [name for name in columns if name in self.columns]
+        self.frame = _left_join(self.frame.drop(replaced), reference, key)
+        self.add(*columns)
+
+
+def _parse_notes_batch(notes, found, workers, profiler):
+    """map_batches step of the SAP Notes: struct of the NOTE_FIELDS of each note."""
+    with profiling(profiler):
+        fields, found['notes'] = parse_notes(notes.to_pandas(), workers=workers)
+    fields = fields.reindex(pd.RangeIndex(len(notes))).astype(object)
+    return pl.from_pandas(fields.where(fields.notna(), None)).to_struct(notes.name)
+
+
+def _invoice_dates_batch(values, found):
+    values = values.to_pandas()
+    parsed = parse_invoice_dates(values)
+    found['invoice_dates'] = (values.name, unparsed_dates(values, parsed))
+    return pl.from_pandas(parsed)
+
+
+def _invoice_dates(column, found):
+    """Parsed ``column`` (stages.parse_invoice_dates), as a map_batches step."""
+    parse = functools.partial(_invoice_dates_batch, found=found)
+    return pl.col(column).map_batches(parse, return_dtype=pl.Datetime('ns'))
+
+
+def _doctors_batch(values, found, dictionary):
+    names, found['doctors'] = dictionary.resolve(values.to_pandas())
+    return pl.Series(values.name, names.tolist(), dtype=pl.String)
+
+
+def _fuzzy_sames_batch(values, sames_index, max_edits):
+    """map_batches step of the fuzzy SAMES tier: struct of (value, tier)."""
+    found, tiers = sames_index.resolve(values.to_pandas(), max_edits)
+    return pl.DataFrame({'value': found.tolist(), 'tier': tiers.tolist()},
+                        schema={'value': pl.String, 'tier': pl.String}).to_struct(values.name)
+
+
+def _match_po(plan, po_index, reporter):
+    reporter.step("Matching with SAP file...")
+    rows = po_index.rows(KEY).rename(columns={'Purchase order number': 'SO PO Number'})
+    plan.join(_reference(rows), _doc_number('IDOrder'), ['SO PO Number', 'Your Reference'])
+
+
+def _match_master_data(plan, master_index):
+    """IDCurrentCorrected by the zero-padded (IDBillDoc, IDBillDocItem), the Base value where not found."""
+    right = [f"__master_{i}" for i in range(len(MASTER_DATA_KEYS))]
+    rows = master_index.rows()
+    rows.columns = right + ['__master']
+    reference = pl.from_pandas(rows.astype(object)).lazy().with_columns(pl.col(right).cast(pl.String))
+    plan.frame = (plan.frame.join(reference, left_on=[_doc_number(column) for column in MASTER_DATA_KEYS],
+                                  right_on=right, how='left', maintain_order='left')
+                  .drop(right, strict=False))
+    value = pl.col('__master')
+    if 'IDCurrentCorrected' in plan.columns:
+        value = pl.coalesce(value, pl.col('IDCurrentCorrected').cast(pl.String))
+    plan.with_columns(**{'IDCurrentCorrected': value, MASTER_DATA_HIT: pl.col('__master').is_not_null()})
+
+
+def _extract_notes(plan, notes_index, found, options):
+    """SAP Notes lookup and parsing, then the NHC and intervention date fallbacks."""
+    rows = notes_index.rows(KEY).rename(columns={notes_index.columns[0]: 'SAPNotes'})
+    plan.join(_reference(rows), pl.col('IDOrder').cast(pl.String), ['SAPNotes'])
+
+    parse = functools.partial(_parse_notes_batch, found=found, workers=options.note_workers,
+                              profiler=options.note_profiler)
+    schema = pl.Struct({field: pl.String for field in NOTE_FIELDS})
+    plan.frame = (plan.frame.drop([field for field in NOTE_FIELDS if field in plan.columns])
+                  .with_columns(pl.col('SAPNotes').map_batches(parse, return_dtype=schema).alias('__fields'))
+                  .unnest('__fields'))
+    plan.add(*NOTE_FIELDS)
+
+    so_po = pl.col('SO PO Number').cast(pl.String).str.extract_groups(NHC_FROM_SO_PO_PATTERN)
+    invoice_dates = _invoice_dates('Invoice Date' if 'Invoice Date' in plan.columns else 'Date', found)
+    plan.frame = plan.frame.with_columns(
+        pl.coalesce('NHC', so_po.struct.field('1'), so_po.struct.field('2'), pl.lit('NHC NO INFORMADO')),
+        invoice_dates.alias(PARSED_INVOICE_DATE))
+    plan.frame = plan.frame.with_columns(
+        pl.col('F. Int - Textos').fill_null(pl.col(PARSED_INVOICE_DATE).dt.strftime(DATE_FORMAT)))
+    plan.parsed_dates = True
+
+
+def _normalize_doctors(plan, dictionary, found):
+    resolve = functools.partial(_doctors_batch, found=found, dictionary=dictionary)
+    plan.with_columns(DOCTOR=pl.col('DOCTOR').map_batches(resolve, return_dtype=pl.String))
+
+
+def _match_sames(plan, sames_index, max_edits):
+    """Exact and normalized tiers as joins, the fuzzy one on what they leave."""
+    column = sames_index.column
+    exact = _reference(sames_index.exact.rows(KEY), '__exact').rename({column: '__exact_value'})
+    normalized = (_reference(sames_index.normalized_rows(KEY), '__normalized')
+                  .rename({column: '__normalized_value'}))
+    frame = plan.frame.drop([name for name in ('INICIADOR SAMES', 'SAMES MATCH') if name in plan.columns])
+    frame = _left_join(frame, exact, pl.col('NHC').cast(pl.String))
+    frame = _left_join(frame, normalized, _normalized_nhc('NHC'))
+    exact_hit, normalized_hit = pl.col('__exact').is_not_null(), pl.col('__normalized').is_not_null()
+    value = (pl.when(exact_hit).then(pl.col('__exact_value'))
+             .when(normalized_hit).then(pl.col('__normalized_value')))
+    tier = pl.when(exact_hit).then(pl.lit('exact')).when(normalized_hit).then(pl.lit('normalized'))
+    if max_edits > 0:
+        fuzzy = functools.partial(_fuzzy_sames_batch, sames_index=sames_index, max_edits=max_edits)
+        schema = pl.Struct({'value': pl.String, 'tier': pl.String})
+        unmatched = pl.when(~exact_hit & ~normalized_hit).then(pl.col('NHC').cast(pl.String))
+        frame = frame.with_columns(unmatched.map_batches(fuzzy, return_dtype=schema).alias('__fuzzy'))
+        value = value.otherwise(pl.col('__fuzzy').struct.field('value'))
+        tier = tier.otherwise(pl.col('__fuzzy').struct.field('tier'))
+    plan.frame = frame
+    plan.with_columns(**{'INICIADOR SAMES': value, 'SAMES MATCH': tier})
+
+
+def _lookup(plan, index, key_column, column):
+    """Add ``column``, the first indexed column of ``index``, by zero-padded ``key_column``."""
+    if index is None:
+        plan.with_columns(**{column: pl.lit(None, dtype=pl.String)})
+        return
+    plan.join(_reference(index.rows(KEY)[[KEY, column]]), _doc_number(key_column), [column])
+
+
+def _match_focus(plan, focus_index):
+    """Product Type: the focus product type ('Legacy' if none) for SPORTS MEDICINE, else BU 2."""
+    focus = pl.lit(None, dtype=pl.String)
+    if focus_index is not None:
+        rows = focus_index.rows(KEY).rename(columns={focus_index.columns[0]: '__focus'})
+        plan.frame = _left_join(plan.frame, _reference(rows), _doc_number('IDMaterial'))
+        focus = pl.col('__focus')
+    product_type = (pl.when(pl.col('BU') == 'SPORTS MEDICINE').then(focus.fill_null('Legacy'))
+                    .otherwise(pl.col('BU 2').cast(pl.String)))
+    plan.with_columns(**{'Product Type': product_type})
+
+
+def _finalize(plan, found):
+    """Format the Invoice Date and keep the output columns, in order."""
+    if not plan.parsed_dates:
+        plan.frame = plan.frame.with_columns(_invoice_dates('Invoice Date', found).alias(PARSED_INVOICE_DATE))
+    plan.frame = plan.frame.with_columns(pl.col(PARSED_INVOICE_DATE).dt.strftime(DATE_FORMAT).alias('Invoice Date'))
+    plan.frame = plan.frame.select([column for column in plan.columns if column not in DROPPED_OUTPUT_COLUMNS])
+
+
+def _report(base_df, found, dictionary, master_index, reporter):
+    """The messages of the pandas stages, from the collected frame."""
+    matched = _report_unmatched(base_df, 'SO PO Number', reporter)
+    reporter.success(f"SAP data mapping completed: {matched} rows updated")
+    if MASTER_DATA_HIT in base_df.columns:
+        hits = base_df.pop(MASTER_DATA_HIT).to_numpy(dtype=bool)
+        report_master_data(base_df[MASTER_DATA_KEYS], hits, master_index, reporter)
+    if 'invoice_dates' in found:
+        column, count = found['invoice_dates']
+        report_unparsed_dates(count, column, reporter)
+    if 'notes' in found:
+        stats = found['notes']
+        reporter.success(f"SAP Notes extraction completed: {stats.summary()}")
+        if stats.patterns:
+            reporter.log(f"Note pattern hits: {format_hits(stats.patterns)}")
+    if 'doctors' in found:
+        named = found['doctors'].notna().to_numpy()
+        doctors = base_df.loc[named, 'DOCTOR'].nunique()
+        reporter.success(f"Doctor names normalized: {named.sum()} rows, {doctors} doctors")
+        if named.any():
+            reporter.log(f"Doctor names by tier: {format_doctor_tiers(found['doctors'])}")
+        if dictionary.path and dictionary.unsaved:
+            dictionary.save()
+            reporter.log(f"Doctor dictionary saved to {dictionary.path} ({len(dictionary)} doctors)")
+
+    matched = _report_unmatched(base_df, 'INICIADOR SAMES', reporter)
+    reporter.success(f"SAMES mapping completed: {matched} rows matched")
+    if matched:
+        reporter.log(f"SAMES matches by tier: {format_tiers(base_df['SAMES MATCH'])}")
+    for column, label in [('COMENTARIOS S+N', "INCIDENCIAS + RECLASIFICACIONES"),
+                          ('PAGADAS', "FACTURAS COMISIONADAS")]:
+        matched = _report_unmatched(base_df, column, reporter)
+        reporter.success(f"{label} mapping completed: {matched} rows matched")
+    matched = _report_unmatched(base_df, 'Product Type', reporter)
+    reporter.success(f"PRODUCTOS FOCUS mapping completed: {matched} rows matched")
+
+
+def run_stages(base_df, inputs, reporter, options, report):
+    """
+    Polars counterpart of pipeline._run_stages: the same output frame (same
+    columns, index and values) from one lazy query. ``inputs`` holds the
+    reference tables or their indexes.
+    """
+    if not have_polars():
+        raise ValueError("The polars backend needs polars (pip install polars)")
+
+    with report.measure('index references'):
+        references = {}
+        for name, build in [('po', index_po), ('master_data', index_master_data),
+                            ('sap_notes', index_sap_notes), ('sames', index_sames),
+                            ('incidencias', index_incidencias), ('facturas', index_invoices),
+                            ('focus', index_focus)]:
+            table = getattr(inputs, name)
+            build = functools.partial(build, **options.for_index(name))
+            references[name] = None if table is None else indexed(table, build, reporter)
+        if references['sames'] is not None:
+            references['sames'].prepare(options.nhc_max_edits)
+    dictionary = options.doctors if options.doctors is not None else DoctorDictionary()
+
+    with report.measure('polars query', rows_in=len(base_df)) as timing:
+        # Filled by the map_batches steps while the query runs
+        found = {}
+        plan = _Plan(base_df)
+        _match_po(plan, references['po'], reporter)
+
+        if inputs.master_data is not None:
+            reporter.step("Joining with MasterDataES file...")
+            if not all(column in base_df.columns for column in MASTER_DATA_KEYS):
+                reporter.warning("Could not join with MasterDataES - required columns not found in Base file")
+            elif references['master_data'] is not None:
+                _match_master_data(plan, references['master_data'])
+
+        reporter.step("Extracting data from SAP Notes...")
+        if 'IDOrder' not in base_df.columns or inputs.sap_notes is None:
+            reporter.warning("Could not process SAP Notes - 'IDOrder' column not found in Base file")
+        elif references['sap_notes'] is not None:
+            _extract_notes(plan, references['sap_notes'], found, options)
+
+        reporter.step("Normalizing doctor names...")
+        if 'DOCTOR' in plan.columns:
+            _normalize_doctors(plan, dictionary, found)
+        else:
+            reporter.warning("No DOCTOR column - skipping doctor names")
+
+        reporter.step("Extracting data from SAMES..")
+        if references['sames'] is None:
+            reporter.warning("SAMES file not uploaded - skipping SAMES mapping")
+            plan.with_columns(**{'INICIADOR SAMES': pl.lit(None, dtype=pl.String),
+                                 'SAMES MATCH': pl.lit(None, dtype=pl.String)})
+        else:
+            _match_sames(plan, references['sames'], options.nhc_max_edits)
+
+        reporter.step("Extracting data from INCIDENCIAS + RECLASIFICACIONES...")
+        if references['incidencias'] is None:
+            reporter.warning("INCIDENCIAS + RECLASIFICACIONES file not uploaded - skipping")
+        _lookup(plan, references['incidencias'], 'IDBillDoc', 'COMENTARIOS S+N')
+
+        reporter.step("Extracting data from FACTURAS COMISIONADAS...")
+        if references['facturas'] is None:
+            reporter.warning("FACTURAS COMISIONADAS file not uploaded - skipping")
+        _lookup(plan, references['facturas'], 'IDBillDoc', 'PAGADAS')
+
+        reporter.step("Extracting data PRODUCTOS FOCUS...")
+        if references['focus'] is None:
+            reporter.warning("PRODUCTOS FOCUS file not uploaded - SPORTS MEDICINE rows default to 'Legacy'")
+        _match_focus(plan, references['focus'])
+        _finalize(plan, found)
+        result = plan.frame.collect()
+        timing.rows_out = result.height
+
+    with report.measure('finalize', rows_in=result.height) as timing:
+        result = result.to_pandas()
+        result.index = base_df.index
+        _report(result, found, dictionary, references['master_data'], reporter)
+        result['INICIADOR SAMES'] = result['INICIADOR SAMES'].fillna('NHC NO ENCONTRADO')
+        timing.rows_out = len(result)
+        timing.frame_mb = frame_memory_mb(result)
+    return result
@@ -0,0 +1,221 @@
+"""
+On-disk columnar cache of the reference files.
+
+SAMES, PRODUCTOS FOCUS, FACTURAS COMISIONADAS and the SAP PO extract change
+rarely but parsing their xlsx takes most of the load time. ReferenceStore
+converts each file to Feather (or Parquet) the first time it is seen, keyed
+by the hash of its content, and reloads that copy on later runs.
+
+    python -m commissions.refstore list
+    python -m commissions.refstore prune --older-than 90
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from dataclasses import asdict, dataclass
+
+from .io import content_hash, file_name, read_bytes, read_error
+
+DEFAULT_CACHE_DIR = os.path.join('~', '.cache', 'commissions', 'reference')
+
+FORMATS = ('feather', 'parquet')
+
+
+def default_cache_dir():
+    return os.path.expanduser(os.environ.get('COMMISSIONS_CACHE_DIR', DEFAULT_CACHE_DIR))
+
+
+def have_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+@dataclass
+class CacheEntry:
+    """Sidecar metadata of one cached reference file."""
+    digest: str
+    name: str
+    format: str
+    rows: int
+    columns: int
+    size: int
+    created: float
+    last_used: float
+
+
+def _read_source_bytes(source):
+    if hasattr(source, 'getvalue'):
+        return source.getvalue()
+    if hasattr(source, 'read'):
+        source.seek(0)
+        return source.read()
+    try:
+        with open(source, 'rb') as f:
+            return f.read()
+    except OSError as e:
+        raise read_error(file_name(source), e) from e
+
+
+class ReferenceStore:
+    """Content-addressed Feather/Parquet copies of the reference files."""
+
+    def __init__(self, root=None, format='feather', memory_map=False):
+        if format not in FORMATS:
+            raise ValueError(f"Unknown reference cache format: {format}")
+        self.root = root or default_cache_dir()
+        self.format = format
+        self.memory_map = memory_map
+        self.hits = 0
+        self.misses = 0
+
+    def _data_path(self, digest, format=None):
+        return os.path.join(self.root, f"{digest}.{format or self.format}")
+
+    def _meta_path(self, digest):
+        return os.path.join(self.root, f"{digest}.json")
+
+    def read(self, source):
+        """Read ``source`` (path or upload) through the cache."""
+        data = _read_source_bytes(source)
+        return self.read_bytes(data, file_name(source))
+
+    def read_bytes(self, data, name):
+        return self.load(data, name)[0]
+
+    def load(self, data, name):
+        """
+        Return (DataFrame, from_cache) for file content ``data``. Without
+        pyarrow the file is simply parsed and nothing is cached.
+        """
+        if not have_pyarrow():
+            return read_bytes(data, name), False
+        digest = content_hash(data)
+        df = self._load(digest)
+        if df is not None:
+            self.hits += 1
+            return df, True
+        self.misses += 1
+        df = read_bytes(data, name)
+        self._save(digest, name, df)
+        return df, False
+
+    def _load(self, digest):
+        path = self._data_path(digest)
+        if not os.path.exists(path):
+            return None
+        if self.format == 'feather':
+            from pyarrow import feather
+            df = feather.read_table(path, memory_map=self.memory_map).to_pandas()
+        else:
+            import pandas as pd
+            df = pd.read_parquet(path, memory_map=self.memory_map)
+        self._touch(digest)
+        return df
+
+    def _save(self, digest, name, df):
+        os.makedirs(self.root, exist_ok=True)
+        path = self._data_path(digest)
+        tmp_path = f"{path}.tmp"
+        if self.format == 'feather':
+            df.to_feather(tmp_path, compression='uncompressed')
+        else:
+            df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+        now = time.time()
+        entry = CacheEntry(digest=digest, name=name, format=self.format, rows=len(df),
+                           columns=len(df.columns), size=os.path.getsize(path),
+                           created=now, last_used=now)
+        with open(self._meta_path(digest), 'w', encoding='utf-8') as f:
+            json.dump(asdict(entry), f)
+
+    def _touch(self, digest):
+        meta_path = self._meta_path(digest)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            meta['last_used'] = time.time()
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+        except (OSError, ValueError):
+            pass
+
+    def entries(self):
+        """Cached entries, most recently used first."""
+        if not os.path.isdir(self.root):
+            return []
+        entries = []
+        for file in os.listdir(self.root):
+            if not file.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.root, file), encoding='utf-8') as f:
+                    entries.append(CacheEntry(**json.load(f)))
+            except (OSError, ValueError, TypeError):
+                continue
+        return sorted(entries, key=lambda e: e.last_used, reverse=True)
+
+    def remove(self, entry):
+        for path in (self._data_path(entry.digest, entry.format), self._meta_path(entry.digest)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def prune(self, older_than_days=None, keep=None):
+        """
+        Remove entries unused for ``older_than_days`` and/or all but the
+        ``keep`` most recently used ones. Returns the removed entries.
+        """
+        entries = self.entries()
+        cutoff = time.time() - older_than_days * 86400 if older_than_days is not None else None
+        removed = []
+        for position, entry in enumerate(entries):
+            too_old = cutoff is not None and entry.last_used < cutoff
+            over_limit = keep is not None and position >= keep
+            if too_old or over_limit:
+                self.remove(entry)
+                removed.append(entry)
+        return removed
+
+
+def _format_entry(entry):
+    used = time.strftime('%Y-%m-%d %H:%M', time.localtime(entry.last_used))
+    return (f"{entry.digest[:12]}  {entry.format:<8} {entry.rows:>9} rows  "
+            f"{entry.size / 1e6:>8.1f} MB  {used}  {entry.name}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m commissions.refstore',
+                                     description="Inspect the reference file cache.")
+    parser.add_argument('--dir', default=None, help="Cache directory (default: %s)" % DEFAULT_CACHE_DIR)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help="List cached reference files")
+    prune = commands.add_parser('prune', help="Remove cached reference files")
+    prune.add_argument('--older-than', type=float, metavar='DAYS', help="Unused for more than DAYS days")
+    prune.add_argument('--keep', type=int, help="Keep only the N most recently used files")
+    prune.add_argument('--all', action='store_true', help="Remove every cached file")
+    args = parser.parse_args(argv)
+
+    store = ReferenceStore(args.dir)
+    if args.command == 'list':
+        entries = store.entries()
+        for entry in entries:
+            print(_format_entry(entry))
+        print(f"{len(entries)} cached files in {store.root}")
+        return 0
+
+    if not (args.all or args.older_than is not None or args.keep is not None):
+        parser.error("prune needs --older-than, --keep or --all")
+    removed = store.prune(older_than_days=args.older_than, keep=0 if args.all else args.keep)
+    for entry in removed:
+        print(f"removed {_format_entry(entry)}")
+    print(f"{len(removed)} cached files removed")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""
+Progress reporting for the pipeline stages.
+
+The engine only talks to a reporter object with ``step``, ``success``,
+``warning`` and ``log`` methods, so the same stages can print to the console in batch
+runs or write Streamlit messages in the app.
+"""
+
+
+class ConsoleReporter:
+    """Reporter that prints messages to stdout."""
+
+    def __init__(self, verbose=True):
+        self.verbose = verbose
+
+    def step(self, message):
+        if self.verbose:
+            print(message)
+
+    def success(self, message):
+        if self.verbose:
+            print(f"  {message}")
+
+    def warning(self, message):
+        print(f"Warning: {message}")
+
+    def log(self, message):
+        """Diagnostics that only go to the console, such as the unmatched record counts."""
+        if self.verbose:
+            print(message)
+
+
+class NullReporter(ConsoleReporter):
+    """Reporter that drops every message."""
+
+    def step(self, message):
+        pass
+
+    def success(self, message):
+        pass
+
+    def warning(self, message):
+        pass
+
+    def log(self, message):
+        pass
+
+
+class ChunkReporter:
+    """
+    Reporter for the stages of a chunked run: drops the per-chunk progress
+    and passes each distinct warning on to ``reporter`` once.
+    """
+
+    def __init__(self, reporter):
+        self.reporter = reporter
+        self._warned = set()
+
+    def step(self, message):
+        pass
+
+    def success(self, message):
+        pass
+
+    def warning(self, message):
+        if message not in self._warned:
+            self._warned.add(message)
+            self.reporter.warning(message)
+
+    def log(self, message):
+        pass
+
+
+class BufferedReporter(NullReporter):
+    """
+    Reporter of a run in a worker process: keeps the warnings so that the
+    parent process can report them.
+    """
+
+    def __init__(self):
+        super().__init__(verbose=False)
+        self.warnings = []
+
+    def warning(self, message):
+        self.warnings.append(message)
@@ -0,0 +1,445 @@
+"""
+Enrichment stages of the commission pipeline.
+
+Each stage takes the Base dataframe plus the reference table it needs,
+adds its columns and returns the Base dataframe. Stages report progress
+through a reporter (see ``commissions.reporting``).
+"""
+import functools
+
+import numpy as np
+import pandas as pd
+
+from .dates import DATE_FORMAT, parse_invoice_dates, unparsed_dates
+from .doctors import DoctorDictionary
+from .doctors import format_tiers as format_doctor_tiers
+from .instrumentation import profiling
+from .joins import KeyIndex, doc_number_key, raw_key
+from .nhc_index import DEFAULT_MAX_EDITS, NHCIndex, format_tiers, table_digest
+from .note_cache import parse_notes
+from .notes import FUTURE_DATE, NHC_FROM_SO_PO_PATTERN
+from .patterns import format_hits
+
+# Invoice Date as parsed by extract_notes, reused by finalize_output
+PARSED_INVOICE_DATE = '_invoice_date'
+
+# Columns of the Base file that are not part of the processed output
+DROPPED_OUTPUT_COLUMNS = ['F. Int - Formula', 'NHC - Textos', 'NHC - Formula', 'Dr - Textos']
+
+# Columns of aggregate_commissioned_invoices
+COMMISSIONED_INVOICE_COLUMNS = ['PAGADAS', 'PAYMENTS', 'PAYEES', 'LATEST PERIOD']
+
+# Base columns the MasterDataES file is joined on
+MASTER_DATA_KEYS = ['IDBillDoc', 'IDBillDocItem']
+
+# Columns the reference tables are indexed on; SAP Notes and MasterDataES are found by name
+REFERENCE_COLUMNS = {
+    'po': ['SD Document', 'Purchase order number', 'Your Reference'],
+    'sames': ['Nº Historial Clínico', 'Comisionista (11)'],
+    'incidencias': ['IDBillDoc', 'COMENTARIOS S+N'],
+    'facturas': ['IDBillDoc', 'CurrentCorrected_Name', 'PERIODO COMISION'],
+    'focus': ['IDMaterial', 'PRODUCT TYPE'],
+}
+
+# Row kept when a reference table repeats a key: 'last', 'first' or 'error'
+DUPLICATE_KEY_POLICY = 'last'
+
+
+def _report_unmatched(base_df, column, reporter):
+    unmatched = base_df[column].isna().sum()
+    if unmatched > 0:
+        reporter.log(f"Warning: {unmatched} records could not be matched")
+    return int(base_df[column].notna().sum())
+
+
+def report_unparsed_dates(count, column, reporter):
+    if count:
+        reporter.warning(f"{count} '{column}' values could not be read as dates")
+
+
+def read_invoice_dates(base_df, column, reporter):
+    """Parsed ``column`` of the Base, warning about the values that could not be read."""
+    dates = parse_invoice_dates(base_df[column])
+    report_unparsed_dates(unparsed_dates(base_df[column], dates), column, reporter)
+    return dates
+
+
+def build_index(table, key, columns, reporter, normalize=doc_number_key, name=None):
+    """KeyIndex of a reference table, reporting its duplicate keys."""
+    index = KeyIndex(table, key, columns, normalize=normalize,
+                     duplicates=DUPLICATE_KEY_POLICY, name=name)
+    message = index.describe_duplicates()
+    if message:
+        reporter.warning(message)
+    return index
+
+
+def indexed(reference, build, reporter):
+    """
+    Index of a reference table built with ``build``; references indexed
+    ahead of time (see pipeline.index_references) are used as they are.
+    """
+    if isinstance(reference, (KeyIndex, NHCIndex)):
+        return reference
+    return build(reference, reporter)
+
+
+def index_po(po_df, reporter):
+    return build_index(po_df, 'SD Document', ['Purchase order number', 'Your Reference'],
+                       reporter, name="SAP DATA")
+
+
+def match_po_data(base_df, po_df, reporter):
+    """Add 'SO PO Number' and 'Your Reference' from the SAP PO extract."""
+    reporter.step("Matching with SAP file...")
+
+    po_index = indexed(po_df, index_po, reporter)
+    found = po_index.lookup_many(base_df['IDOrder'])
+    base_df['SO PO Number'] = found['Purchase order number']
+    base_df['Your Reference'] = found['Your Reference']
+
+    matched = _report_unmatched(base_df, 'SO PO Number', reporter)
+    reporter.success(f"SAP data mapping completed: {matched} rows updated")
+    return base_df
+
+
+def find_master_data_columns(master_df):
+    """Return the (bill doc, bill doc item, current corrected ID) column names of the MasterDataES file."""
+    lower = {col: str(col).lower() for col in master_df.columns}
+    bill_doc_col = next((col for col, name in lower.items() if 'billdoc' in name and 'item' not in name), None)
+    item_col = next((col for col, name in lower.items() if 'billdoc' in name and 'item' in name), None)
+    corrected_col = next((col for col, name in lower.items()
+                          if 'currentcorrected' in name and 'id' in name), None)
+    return bill_doc_col, item_col, corrected_col
+
+
+def index_master_data(master_df, reporter):
+    """
+    Index of the MasterDataES file by (IDBillDoc, IDBillDocItem), both zero
+    padded; None when its columns are not found.
+    """
+    bill_doc_col, item_col, corrected_col = find_master_data_columns(master_df)
+    if not all([bill_doc_col, item_col, corrected_col]):
+        missing = [label for label, col in [("BillDoc", bill_doc_col), ("BillDocItem", item_col),
+                                            ("CurrentCorrectedID", corrected_col)] if not col]
+        reporter.warning(f"Could not find required columns in MasterDataES: {', '.join(missing)}")
+        return None
+    reporter.log(f"MasterDataES: joining on '{bill_doc_col}', '{item_col}' to get '{corrected_col}'")
+    return build_index(master_df, [bill_doc_col, item_col], corrected_col, reporter, name="MasterDataES")
+
+
+def match_master_data(base_df, master_df, reporter):
+    """
+    Set 'IDCurrentCorrected' from the MasterDataES line of each invoice item.
+    Items the file does not list keep the Base value, if the Base has one.
+    """
+    if master_df is None:
+        return base_df
+    reporter.step("Joining with MasterDataES file...")
+
+    if not all(col in base_df.columns for col in MASTER_DATA_KEYS):
+        reporter.warning("Could not join with MasterDataES - required columns not found in Base file")
+        return base_df
+
+    master_index = indexed(master_df, index_master_data, reporter)
+    if master_index is None:
+        return base_df
+
+    keys = base_df[MASTER_DATA_KEYS]
+    found = master_index.lookup(keys)
+    if 'IDCurrentCorrected' in base_df.columns:
+        base_df['IDCurrentCorrected'] = found.combine_first(base_df['IDCurrentCorrected'].astype(object))
+    else:
+        base_df['IDCurrentCorrected'] = found
+
+    report_master_data(keys, found.notna().to_numpy(), master_index, reporter)
+    return base_df
+
+
+def report_master_data(keys, matched, master_index, reporter):
+    """
+    Match rate of the MasterDataES join: ``matched`` flags the rows of
+    ``keys`` found; the others are told apart by whether their invoice is
+    in the file at all.
+    """
+    rows = len(matched)
+    count = int(matched.sum())
+    rate = count / rows if rows else 0
+    reporter.success(f"MasterDataES joining completed: {count} rows updated ({rate:.1%})")
+    if count < rows:
+        invoices = master_index.covered(keys[~matched])
+        reporter.log(f"MasterDataES unmatched rows: {int((~invoices).sum())} invoices not in the file, "
+                     f"{int(invoices.sum())} items not in the file")
+
+
+def find_notes_columns(sap_notes_df):
+    """Return the (order, notes) column names of the SAP Notes file."""
+    order_col = next((col for col in sap_notes_df.columns if 'order' in col.lower()), None)
+    notes_col = next((col for col in sap_notes_df.columns
+                      if 'note' in col.lower() or 'text' in col.lower()), None)
+    return order_col, notes_col
+
+
+def index_sap_notes(sap_notes_df, reporter):
+    """Index of the notes by order number; None when its columns are not found."""
+    order_col, notes_col = find_notes_columns(sap_notes_df)
+    if not (order_col and notes_col):
+        reporter.warning("Could not find required columns in SAP Notes file")
+        return None
+    # Order numbers are matched as they are, without zero padding
+    return build_index(sap_notes_df, order_col, notes_col, reporter,
+                       normalize=raw_key, name="SAP Notes")
+
+
+def nhc_from_so_po(so_po):
+    """
+    NHC written in each SO PO Number (a Series): the 'NHC CIC 123 / 45'
+    number or the plain 'NHC: AB123' one, 'NHC NO INFORMADO' where there is none.
+    """
+    # One extract over the distinct numbers, as plain strings (faster than Arrow ones here)
+    codes, uniques = pd.factorize(so_po.astype(object))
+    groups = pd.Series([str(value) for value in uniques], dtype=object).str.extract(NHC_FROM_SO_PO_PATTERN)
+    nhc = groups[0].combine_first(groups[1]).fillna('NHC NO INFORMADO').to_numpy(dtype=object)
+    return pd.Series(np.append(nhc, 'NHC NO INFORMADO')[codes], index=so_po.index, dtype=object)
+
+
+def extract_notes(base_df, sap_notes_df, reporter, workers=1, profiler=None):
+    """
+    Add 'SAPNotes', 'NHC', 'F. Int - Textos' and 'DOCTOR' from the SAP Notes,
+    parsing the notes over ``workers`` processes, under ``profiler`` if given.
+    """
+    reporter.step("Extracting data from SAP Notes...")
+
+    if "IDOrder" not in base_df.columns or sap_notes_df is None:
+        reporter.warning("Could not process SAP Notes - 'IDOrder' column not found in Base file")
+        return base_df
+
+    notes_index = indexed(sap_notes_df, index_sap_notes, reporter)
+    if notes_index is None:
+        return base_df
+
+    base_df["SAPNotes"] = notes_index.lookup(base_df["IDOrder"])
+
+    base_df["NHC"] = None
+    base_df["F. Int - Textos"] = None
+    base_df["DOCTOR"] = None
+    base_df[FUTURE_DATE] = None
+
+    # Columnar extraction for every row that has a note
+    with profiling(profiler):
+        fields, stats = parse_notes(base_df["SAPNotes"], workers=workers)
+    base_df.loc[fields.index, "NHC"] = fields["NHC"]
+    base_df.loc[fields.index, "F. Int - Textos"] = fields["F. Int - Textos"]
+
+    # Cleaned up by normalize_doctors
+    base_df.loc[fields.index, "DOCTOR"] = fields["DOCTOR"]
+    # Kept by incremental runs, dropped from the output by the pipeline
+    base_df.loc[fields.index, FUTURE_DATE] = fields[FUTURE_DATE]
+
+    # Fallbacks: NHC from the SO PO Number, intervention date from the invoice
+    no_nhc = base_df["NHC"].isna()
+    base_df["NHC"] = base_df["NHC"].combine_first(nhc_from_so_po(base_df.loc[no_nhc, "SO PO Number"]))
+
+    if "Invoice Date" in base_df.columns:
+        # Parsed once: finalize_output formats the same column
+        invoice_dates = base_df[PARSED_INVOICE_DATE] = read_invoice_dates(base_df, "Invoice Date", reporter)
+    else:
+        invoice_dates = read_invoice_dates(base_df, "Date", reporter)
+    base_df["F. Int - Textos"] = base_df["F. Int - Textos"].fillna(invoice_dates.dt.strftime(DATE_FORMAT))
+
+
+    reporter.success(f"SAP Notes extraction completed: {stats.summary()}")
+    if stats.patterns:
+        reporter.log(f"Note pattern hits: {format_hits(stats.patterns)}")
+    return base_df
+
+
+def normalize_doctors(base_df, _, reporter, dictionary=None):
+    """
+    Replace 'DOCTOR' by the canonical name of each doctor (see
+    commissions.doctors), 'NO INFORMADO' where the note names none. New
+    spellings are added to ``dictionary``, saved when it has a path.
+    """
+    reporter.step("Normalizing doctor names...")
+
+    if "DOCTOR" not in base_df.columns:
+        reporter.warning("No DOCTOR column - skipping doctor names")
+        return base_df
+
+    dictionary = dictionary if dictionary is not None else DoctorDictionary()
+    base_df["DOCTOR"], tiers = dictionary.resolve(base_df["DOCTOR"])
+
+    named = tiers.notna()
+    doctors = base_df.loc[named, "DOCTOR"].nunique()
+    reporter.success(f"Doctor names normalized: {named.sum()} rows, {doctors} doctors")
+    if named.any():
+        reporter.log(f"Doctor names by tier: {format_doctor_tiers(tiers)}")
+    if dictionary.path and dictionary.unsaved:
+        dictionary.save()
+        reporter.log(f"Doctor dictionary saved to {dictionary.path} ({len(dictionary)} doctors)")
+    return base_df
+
+
+def index_sames(sames_df, reporter, cache_dir=None, max_edits=DEFAULT_MAX_EDITS):
+    """
+    NHCIndex of the SAMES file, loaded from ``cache_dir`` when it was built
+    for the same content before and saved there otherwise.
+    """
+    key, column = 'Nº Historial Clínico', 'Comisionista (11)'
+    digest = table_digest(sames_df, key, column) if cache_dir else None
+    index = NHCIndex.load(cache_dir, digest) if cache_dir else None
+    built = index is None
+    if built:
+        index = NHCIndex(KeyIndex(sames_df, key, column, normalize=raw_key,
+                                  duplicates=DUPLICATE_KEY_POLICY, name="SAMES"))
+    for message in (index.describe_duplicates(), index.describe_ambiguous()):
+        if message:
+            reporter.warning(message)
+    # The fuzzy delete index is the costly part: build it before saving
+    if (index.prepare(max_edits) or built) and cache_dir:
+        index.save(cache_dir, digest)
+    return index
+
+
+def match_sames(base_df, sames_df, reporter, max_edits=DEFAULT_MAX_EDITS, cache_dir=None):
+    """
+    Add 'INICIADOR SAMES' by matching the NHC against the SAMES file, and
+    'SAMES MATCH': the tier (exact, normalized, fuzzy) that found it.
+    """
+    reporter.step("Extracting data from SAMES..")
+
+    if sames_df is None:
+        reporter.warning("SAMES file not uploaded - skipping SAMES mapping")
+        base_df['INICIADOR SAMES'] = None
+        base_df['SAMES MATCH'] = None
+    else:
+        build = functools.partial(index_sames, cache_dir=cache_dir, max_edits=max_edits)
+        sames_index = indexed(sames_df, build, reporter)
+        sames_index.prepare(max_edits)
+        base_df['INICIADOR SAMES'], base_df['SAMES MATCH'] = sames_index.resolve(base_df["NHC"], max_edits)
+
+    matched = _report_unmatched(base_df, 'INICIADOR SAMES', reporter)
+
+    reporter.success(f"SAMES mapping completed: {matched} rows matched")
+    if matched:
+        reporter.log(f"SAMES matches by tier: {format_tiers(base_df['SAMES MATCH'])}")
+    return base_df
+
+
+def index_incidencias(comments_df, reporter):
+    return build_index(comments_df, 'IDBillDoc', 'COMENTARIOS S+N', reporter,
+                       name="INCIDENCIAS + RECLASIFICACIONES")
+
+
+def match_incidencias(base_df, comments_df, reporter):
+    """Add 'COMENTARIOS S+N' from the INCIDENCIAS + RECLASIFICACIONES file."""
+    reporter.step("Extracting data from INCIDENCIAS + RECLASIFICACIONES...")
+
+    if comments_df is None:
+        reporter.warning("INCIDENCIAS + RECLASIFICACIONES file not uploaded - skipping")
+        base_df['COMENTARIOS S+N'] = None
+        return base_df
+
+    comments_index = indexed(comments_df, index_incidencias, reporter)
+    base_df['COMENTARIOS S+N'] = comments_index.lookup(base_df['IDBillDoc'])
+
+    matched = _report_unmatched(base_df, 'COMENTARIOS S+N', reporter)
+    reporter.success(f"INCIDENCIAS + RECLASIFICACIONES mapping completed: {matched} rows matched")
+    return base_df
+
+
+def aggregate_commissioned_invoices(invoices_df):
+    """
+    One row per commissioned invoice, indexed by the zero-padded IDBillDoc:
+    PAGADAS ('LA FACTURA X FUE COMISIONADA A ... EN ... & A ... EN ...'),
+    PAYMENTS (commission rows), PAYEES (distinct names) and LATEST PERIOD.
+    """
+    names = invoices_df['CurrentCorrected_Name'].astype(str).fillna('nan')
+    periods = invoices_df['PERIODO COMISION'].astype(str).fillna('nan')
+    doc_nr_formatted = invoices_df['IDBillDoc'].astype(str).str.zfill(10)
+    # Every payment after the first of its invoice carries the ' & ' separator,
+    # so that a plain groupby sum concatenates the sentence
+    payment = "A " + names + " EN " + periods
+    payment = payment.where(~doc_nr_formatted.duplicated(), " & " + payment)
+    frame = pd.DataFrame({
+        'doc_nr_formatted': doc_nr_formatted,
+        'IDBillDoc': invoices_df['IDBillDoc'].astype(str),
+        'payment': payment.astype(object),
+        'name': names,
+        'period': periods,
+    })
+
+    grouped = frame.groupby('doc_nr_formatted', sort=False)
+    agg = grouped.agg(IDBillDoc=('IDBillDoc', 'first'), payments=('payment', 'sum'),
+                      PAYMENTS=('payment', 'size'), PAYEES=('name', 'nunique'))
+    agg['PAGADAS'] = "LA FACTURA " + agg['IDBillDoc'] + " FUE COMISIONADA " + agg['payments']
+
+    # Latest period: the most recent readable date, else the last one listed
+    codes, uniques = pd.factorize(periods)
+    period_dates = pd.to_datetime(pd.Series(uniques), format='mixed', dayfirst=True, errors='coerce')
+    frame['period_date'] = period_dates.to_numpy()[codes]
+    latest = (frame.sort_values('period_date', na_position='first', kind='stable')
+              .groupby('doc_nr_formatted', sort=False)['period'].last())
+    agg['LATEST PERIOD'] = latest
+    return agg[COMMISSIONED_INVOICE_COLUMNS]
+
+
+def index_invoices(invoices_df, reporter):
+    agg_invoices = aggregate_commissioned_invoices(invoices_df).reset_index()
+    return KeyIndex(agg_invoices, 'doc_nr_formatted', COMMISSIONED_INVOICE_COLUMNS,
+                    normalize=doc_number_key, name="FACTURAS COMISIONADAS")
+
+
+def match_invoices_commissioned(base_df, invoices_df, reporter):
+    """Add 'PAGADAS' describing earlier commission payments of each invoice."""
+    reporter.step("Extracting data from FACTURAS COMISIONADAS...")
+
+    if invoices_df is None:
+        reporter.warning("FACTURAS COMISIONADAS file not uploaded - skipping")
+        base_df['PAGADAS'] = None
+        return base_df
+
+    invoices_index = indexed(invoices_df, index_invoices, reporter)
+    base_df['PAGADAS'] = invoices_index.lookup(base_df['IDBillDoc'])
+
+    matched = _report_unmatched(base_df, 'PAGADAS', reporter)
+    reporter.success(f"FACTURAS COMISIONADAS mapping completed: {matched} rows matched")
+    return base_df
+
+
+def index_focus(focus_df, reporter):
+    return build_index(focus_df, 'IDMaterial', 'PRODUCT TYPE', reporter, name="PRODUCTOS FOCUS")
+
+
+def match_focus_products(base_df, focus_df, reporter):
+    """Add 'Product Type': the focus product type for SPORTS MEDICINE, else 'BU 2'."""
+    reporter.step("Extracting data PRODUCTOS FOCUS...")
+
+    base_df['Product Type'] = None
+
+    # For rows where BU == 'SPORTS MEDICINE', look up the focus product type
+    mask = base_df['BU'] == 'SPORTS MEDICINE'
+    if focus_df is None:
+        reporter.warning("PRODUCTOS FOCUS file not uploaded - SPORTS MEDICINE rows default to 'Legacy'")
+    else:
+        focus_index = indexed(focus_df, index_focus, reporter)
+        base_df.loc[mask, 'Product Type'] = focus_index.lookup(base_df.loc[mask, 'IDMaterial'])
+    base_df['Product Type'] = base_df['Product Type'].fillna('Legacy')
+    # For all other rows, use the value from BU 2
+    base_df.loc[~mask, 'Product Type'] = base_df.loc[~mask, 'BU 2']
+
+    matched = _report_unmatched(base_df, 'Product Type', reporter)
+    reporter.success(f"PRODUCTOS FOCUS mapping completed: {matched} rows matched")
+    return base_df
+
+
+def finalize_output(base_df, reporter):
+    """Format dates, drop helper columns and fill the remaining defaults."""
+    if PARSED_INVOICE_DATE in base_df.columns:
+        invoice_dates = base_df.pop(PARSED_INVOICE_DATE)
+    else:
+        invoice_dates = read_invoice_dates(base_df, "Invoice Date", reporter)
+    base_df["Invoice Date"] = invoice_dates.dt.strftime(DATE_FORMAT)
+    base_df.drop(columns=DROPPED_OUTPUT_COLUMNS, inplace=True, errors='ignore')
+    base_df['INICIADOR SAMES'] = base_df['INICIADOR SAMES'].fillna('NHC NO ENCONTRADO')
+    return base_df